@@ -0,0 +1,20 @@
+import os
+import hmac
+from typing import Optional
+
+from fastapi import Header, HTTPException
+
+# 管理接口口令；未配置时所有管理接口一律拒绝
+ADMIN_TOKEN = os.getenv("TESTAGENT_ADMIN_TOKEN", "")
+
+
+def is_admin(token: Optional[str]) -> bool:
+    return bool(ADMIN_TOKEN) and token is not None and hmac.compare_digest(token, ADMIN_TOKEN)
+
+
+def require_admin(x_admin_token: Optional[str] = Header(default=None)) -> None:
+    """
+    FastAPI 依赖：校验 X-Admin-Token 请求头。
+    """
+    if not is_admin(x_admin_token):
+        raise HTTPException(status_code=403, detail="Admin token required")
@@ -0,0 +1,169 @@
+import os
+import re
+import json
+from difflib import SequenceMatcher
+from dataclasses import dataclass, asdict
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple
+
+from app.context_store import VersionCache
+from app.repair import coerce_plan
+
+# 本地自动修复：把白名单外的工具名映射到最接近的上下文工具、params 归一为字符串、order 重新编号。
+# 只在映射无歧义（得分达到阈值且明显领先第二名）时改动，并在 note 中注明，避免一次小瑕疵就多一次模型调用。
+#
+# 环境变量：
+#   TESTAGENT_AUTOFIX_MIN_SCORE   工具名映射的最低置信度，默认 0.8
+#   TESTAGENT_AUTOFIX_MARGIN      第一名至少领先第二名多少分才算无歧义，默认 0.08
+
+MIN_SCORE = float(os.getenv("TESTAGENT_AUTOFIX_MIN_SCORE", "0.8"))
+MARGIN = float(os.getenv("TESTAGENT_AUTOFIX_MARGIN", "0.08"))
+# 描述与步骤 action 的相似度最多加这么多分（名字相近时用来区分同族工具）
+DESC_WEIGHT = 0.1
+
+_NORM_RE = re.compile(r"[^0-9a-z一-鿿]+")
+
+
+def _norm(text: str) -> str:
+    return _NORM_RE.sub("", text.lower())
+
+
+def _grams(text: str, n: int = 3) -> FrozenSet[str]:
+    text = _norm(text)
+    if len(text) < n:
+        return frozenset([text]) if text else frozenset()
+    return frozenset(text[i:i + n] for i in range(len(text) - n + 1))
+
+
+@dataclass
+class PlanFix:
+    code: str
+    step: Optional[int]
+    before: Any = None
+    after: Any = None
+    score: Optional[float] = None
+
+    def describe(self) -> str:
+        if self.code == "tool_mapped":
+            return f"tool_mapped:{self.before}->{self.after}"
+        return self.code
+
+
+class ToolIndex:
+    """
+    预先计算的工具名模糊索引：规范化名字、名字三元组倒排表、描述三元组集合。
+    """
+
+    def __init__(self, tools: Dict[str, Any]):
+        self.names: Tuple[str, ...] = tuple(tools)
+        self._norm = {name: _norm(name) for name in self.names}
+        self._by_norm = {v: k for k, v in self._norm.items()}
+        self._desc_grams = {name: _grams(json.dumps(desc, ensure_ascii=False)) for name, desc in tools.items()}
+        self._postings: Dict[str, List[str]] = {}
+        for name in self.names:
+            for g in _grams(name):
+                self._postings.setdefault(g, []).append(name)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._norm
+
+    def _shortlist(self, query: str) -> List[str]:
+        hits: Dict[str, int] = {}
+        for g in _grams(query):
+            for name in self._postings.get(g, ()):
+                hits[name] = hits.get(name, 0) + 1
+        if not hits:
+            return list(self.names)
+        return sorted(hits, key=hits.get, reverse=True)[:20]
+
+    def _name_score(self, q: str, name: str) -> float:
+        t = self._norm[name]
+        score = SequenceMatcher(None, q, t).ratio()
+        # 一个名字包含另一个（BurnInTest ⊂ BurnInTestStress）：按覆盖的长度比例给分
+        short, long_ = (q, t) if len(q) <= len(t) else (t, q)
+        if short and short in long_:
+            score = max(score, 0.5 + 0.4 * len(short) / len(long_))
+        return score
+
+    def rank(self, query: str, context: str = "") -> List[Tuple[str, float]]:
+        """
+        候选工具按得分降序：名字相似度为主，query 与步骤文本对描述的三元组覆盖率作少量加分。
+        """
+        q = _norm(query)
+        if not q:
+            return []
+        ctx = _grams(query + " " + context) if context else _grams(query)
+        scored = []
+        for name in self._shortlist(query):
+            score = self._name_score(q, name)
+            desc = self._desc_grams[name]
+            if ctx and desc:
+                score += DESC_WEIGHT * len(ctx & desc) / len(ctx)
+            scored.append((name, round(min(score, 1.0), 4)))
+        scored.sort(key=lambda x: x[1], reverse=True)
+        return scored
+
+    def resolve(self, query: str, context: str = "") -> Tuple[Optional[str], Optional[float]]:
+        """
+        无歧义地解析工具名：大小写/分隔符不同直接命中；否则要求得分 ≥ MIN_SCORE 且领先第二名 ≥ MARGIN。
+        """
+        exact = self._by_norm.get(_norm(query))
+        if exact is not None:
+            return exact, 1.0
+        ranked = self.rank(query, context)
+        if not ranked:
+            return None, None
+        best, score = ranked[0]
+        runner_up = ranked[1][1] if len(ranked) > 1 else 0.0
+        if score >= MIN_SCORE and score - runner_up >= MARGIN:
+            return best, score
+        return None, score
+
+
+def autofix_plan(plan: Any, index: ToolIndex, renumber: bool = True) -> List[PlanFix]:
+    """
+    原地修复计划并返回改动列表：
+    - 白名单外的工具名无歧义时映射到目录中的工具，并在 note 末尾注明；
+    - params 转为单一字符串、数字字符串的 order 转为整数（见 app.repair.coerce_plan）；
+    - renumber 为 True 时按原 order 排序后从 1 连续编号。
+    """
+    fixes: List[PlanFix] = []
+    steps = plan.get("steps") if isinstance(plan, dict) else None
+    if not isinstance(steps, list):
+        return fixes
+    for name in coerce_plan(plan):
+        fixes.append(PlanFix(name, None))
+    for i, s in enumerate(steps):
+        if not isinstance(s, dict):
+            continue
+        tool = s.get("tool")
+        if not isinstance(tool, str) or tool in index:
+            continue
+        mapped, score = index.resolve(tool, f"{s.get('action', '')} {s.get('note', '')}")
+        if mapped is None:
+            continue
+        s["tool"] = mapped
+        note = s.get("note") if isinstance(s.get("note"), str) else ""
+        s["note"] = f"{note}（工具名自动映射：{tool} → {mapped}）" if note else f"工具名自动映射：{tool} → {mapped}"
+        fixes.append(PlanFix("tool_mapped", i, tool, mapped, score))
+    if renumber:
+        orders = [s.get("order") if isinstance(s, dict) else None for s in steps]
+        if orders != list(range(1, len(steps) + 1)) and all(isinstance(s, dict) for s in steps):
+            steps.sort(key=lambda s: s.get("order") if isinstance(s.get("order"), int) else 10**9)
+            for idx, s in enumerate(steps, start=1):
+                s["order"] = idx
+            fixes.append(PlanFix("orders_renumbered", None, orders, list(range(1, len(steps) + 1))))
+    return fixes
+
+
+def fixes_to_dicts(fixes: List[PlanFix]) -> List[Dict[str, Any]]:
+    return [asdict(f) for f in fixes]
+
+
+_cache: VersionCache[ToolIndex] = VersionCache()
+
+
+def get_tool_index(context_version: str, context_json: str) -> ToolIndex:
+    """
+    按上下文版本取（必要时构建）工具索引。
+    """
+    return _cache.get(context_version, lambda: ToolIndex(json.loads(context_json).get("tools") or {}))
@@ -0,0 +1,211 @@
+import re
+from functools import lru_cache
+from dataclasses import dataclass, replace
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+# 命令行风格 params 的分词：--TestTimes 500、--TestTimes=500、/A DisCharge、-Restart、TestTime=120、"带引号的值"，
+# 以及以 / 开头的路径取值（--Path /tmp/x）。
+# 结果是有序、不可变的结构，逐字保留分隔与引号，render() 可还原出原字符串；
+# 在此之上按键读取/改写取值（循环次数、时长等），不必再交给模型改写整段参数。
+# 同一 params 字符串在上下文与计划中反复出现，解析结果按字符串缓存。
+
+# 上下文示例里常见的多余引号
+STRAY_QUOTES = "‘’“”'"
+# 用例中表示“无参数”的占位
+EMPTY_ARGS = {"", "nan", "无", "null", "none"}
+# 首尾出现即视为多余的引号（ASCII 引号可能是取值的一部分，不去掉）
+_EDGE_QUOTES = "‘’“”"
+
+_TOKEN_RE = re.compile(r"""
+    (?P<lead>\s*)
+    (?:
+        # 参数键 + 可选取值（空白或 "=" 分隔）；空白分隔时取值本身不能是参数键（负数可以）。
+        # 键后紧跟 / 或 \ 的是路径（/tmp/x、-Dir\sub），不是参数键
+        (?P<flag>(?:--?|/)[A-Za-z][\w.-]*(?![\w./\\-]))
+        (?:(?P<fsep>=|\s+)(?P<fval>"[^"]*"|(?<==)[^\s"]*|(?!(?:--?|/)[A-Za-z][\w.-]*(?![\w./\\-]))[^\s"]+))?
+      | (?P<key>[A-Za-z_][\w.-]*)=(?P<kval>"[^"]*"|[^\s"]*)
+      | (?P<pos>"[^"]*"|\S+)
+    )
+""", re.X)
+_INT_RE = re.compile(r"^[+-]?\d+$")
+_NUM_RE = re.compile(r"^[+-]?(?:\d+\.\d*|\.\d+)$")
+
+
+def _norm_key(key: str) -> str:
+    return key.lstrip("-/").lower()
+
+
+def _unquote(value: str) -> str:
+    if len(value) >= 2 and value[0] == value[-1] == '"':
+        return value[1:-1]
+    return value
+
+
+def _quote(value: str) -> str:
+    return f'"{value}"' if not value or any(c.isspace() for c in value) else value
+
+
+def typed(value: Optional[str]) -> Any:
+    """
+    取值按字面转成 int / float，其余保持字符串。
+    """
+    if value is None:
+        return None
+    if _INT_RE.match(value):
+        return int(value)
+    if _NUM_RE.match(value):
+        return float(value)
+    return value
+
+
+@dataclass(frozen=True)
+class Arg:
+    # flag：--键/-键//键（value 为 None 时是无取值的开关）；pair：键=值；positional：独立取值
+    kind: str
+    key: Optional[str]
+    # 原样的取值文本（含引号）
+    raw_value: Optional[str] = None
+    # 键与值之间的原样分隔（空白或 "="）
+    sep: str = ""
+    # 本参数之前的原样空白
+    lead: str = ""
+
+    @property
+    def value(self) -> Optional[str]:
+        return None if self.raw_value is None else _unquote(self.raw_value)
+
+    def render(self) -> str:
+        if self.kind == "positional":
+            return self.lead + (self.raw_value or "")
+        return self.lead + (self.key or "") + (self.sep + self.raw_value if self.raw_value is not None else "")
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"kind": self.kind, "key": self.key, "value": typed(self.value)}
+
+
+@dataclass(frozen=True)
+class CliParams:
+    args: Tuple[Arg, ...]
+    # 首尾原样保留的空白与多余引号
+    prefix: str = ""
+    suffix: str = ""
+
+    def __iter__(self) -> Iterator[Arg]:
+        return iter(self.args)
+
+    def __len__(self) -> int:
+        return len(self.args)
+
+    @property
+    def empty(self) -> bool:
+        return not self.args
+
+    def render(self) -> str:
+        """
+        还原为字符串；未改动时与解析前逐字相同。
+        """
+        return self.prefix + "".join(a.render() for a in self.args) + self.suffix
+
+    @property
+    def text(self) -> str:
+        """
+        规范写法：去掉首尾空白与多余引号，参数之间单个空格。
+        """
+        return " ".join(replace(a, lead="").render() for a in self.args)
+
+    @property
+    def flags(self) -> Tuple[str, ...]:
+        return tuple(a.key for a in self.args if a.kind == "flag")
+
+    def keys(self) -> Tuple[str, ...]:
+        return tuple(a.key for a in self.args if a.key is not None)
+
+    def find(self, key: str) -> Optional[Arg]:
+        """
+        按键查找：先精确匹配，再忽略大小写与 -、/ 前缀（"TestTimes" 可找到 "--TestTimes"）。
+        """
+        for a in self.args:
+            if a.key == key:
+                return a
+        k = _norm_key(key)
+        for a in self.args:
+            if a.key is not None and _norm_key(a.key) == k:
+                return a
+        return None
+
+    def get(self, key: str, default: Any = None) -> Any:
+        a = self.find(key)
+        return typed(a.value) if a is not None and a.value is not None else default
+
+    def set(self, key: str, value: Any, add: bool = True) -> "CliParams":
+        """
+        返回改写了某个键取值的新对象；其余参数（顺序、空白、引号）不变。
+        键不存在且 add 为 True 时追加到末尾，写法沿用已有参数键的前缀风格；
+        原为 "nan"、"无" 等占位时占位文本不保留，结果只有新参数。
+        """
+        text = "true" if value is True else "false" if value is False else str(value)
+        a = self.find(key)
+        if a is not None:
+            quoted = a.raw_value is not None and a.raw_value.startswith('"')
+            new = replace(a, raw_value=f'"{text}"' if quoted else _quote(text), sep=a.sep or (" " if a.kind == "flag" else "="))
+            return replace(self, args=tuple(new if x is a else x for x in self.args))
+        if not add:
+            return self
+        if not self.args:
+            # 占位（或空白）整段保存在 prefix 中，不能留在新参数前面
+            return replace(self, args=(self._new_arg(key, text, ""),), prefix="", suffix="")
+        return replace(self, args=self.args + (self._new_arg(key, text, " "),))
+
+    def _new_arg(self, key: str, text: str, lead: str) -> Arg:
+        if key[:1] in "-/":
+            return Arg("flag", key, _quote(text), " ", lead)
+        style = next((f[:len(f) - len(f.lstrip("-/"))] for f in self.flags), None)
+        return (Arg("flag", f"{style}{key}", _quote(text), " ", lead) if style
+                else Arg("pair", key, _quote(text), "=", lead))
+
+    def to_list(self) -> List[Dict[str, Any]]:
+        return [a.to_dict() for a in self.args]
+
+
+def _tokenize(text: str) -> CliParams:
+    stripped = text.strip().strip(_EDGE_QUOTES).strip()
+    if stripped.lower() in EMPTY_ARGS:
+        return CliParams((), text, "")
+    start = text.index(stripped) if stripped else len(text)
+    end = start + len(stripped)
+    args: List[Arg] = []
+    pos = start
+    while pos < end:
+        m = _TOKEN_RE.match(text, pos, end)
+        if m is None or m.end() == pos:
+            break
+        lead = m.group("lead")
+        if m.group("flag") is not None:
+            args.append(Arg("flag", m.group("flag"), m.group("fval"), m.group("fsep") or "", lead))
+        elif m.group("key") is not None:
+            args.append(Arg("pair", m.group("key"), m.group("kval"), "=", lead))
+        elif m.group("pos") is not None:
+            args.append(Arg("positional", None, m.group("pos"), "", lead))
+        else:
+            break
+        pos = m.end()
+    return CliParams(tuple(args), text[:start], text[pos:])
+
+
+@lru_cache(maxsize=8192)
+def parse_cli(text: str) -> CliParams:
+    """
+    解析一段命令行风格的 params（结果不可变，按字符串缓存）。
+    "nan"、"无" 等占位解析为空。
+    """
+    return _tokenize(text)
+
+
+def override(params: str, values: Dict[str, Any], add: bool = True) -> str:
+    """
+    按键改写 params 字符串中的取值，如 override("--TestTimes 1 --SleepTime 60", {"TestTimes": 500})。
+    """
+    parsed = parse_cli(params)
+    for key, value in values.items():
+        parsed = parsed.set(key, value, add=add)
+    return parsed.render()
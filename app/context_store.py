@@ -0,0 +1,212 @@
+import os
+import json
+import time
+import logging
+import hashlib
+import pathlib
+import threading
+import contextvars
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Generic, Iterator, Optional, Tuple, TypeVar
+
+# 规划上下文（context.json）的版本化快照。当前版本可在运行时整体替换（管理接口上传 Excel 转换后），
+# 替换只是换一个引用：请求开始时固定（pin）当时的快照，处理过程中的提示词、校验、工具映射都用它，
+# 因此切换时仍在处理中的请求会在旧版本上完成，新请求使用新版本。
+# 多 worker 部署时替换只发生在处理上传的进程里（随后写回 CONTEXT_PATH）；其余进程定期比较该文件的
+# 修改时间与大小，发现变化后重新加载，内容版本不同才替换。
+#
+# 环境变量：
+#   TESTAGENT_CONTEXT_PATH             启动时加载 / 上传替换后写回的 context.json，默认为仓库根目录下的 context.json；
+#                                      相对路径按仓库根目录解析（与启动时的工作目录无关）
+#   TESTAGENT_CONTEXT_RELOAD_INTERVAL  检查 CONTEXT_PATH 是否被其他进程改写的最短间隔（秒），默认 2，0 关闭
+
+logger = logging.getLogger(__name__)
+
+_ROOT = pathlib.Path(__file__).resolve().parent.parent
+CONTEXT_PATH = _ROOT / os.getenv("TESTAGENT_CONTEXT_PATH", "context.json")
+RELOAD_INTERVAL = float(os.getenv("TESTAGENT_CONTEXT_RELOAD_INTERVAL", "2"))
+
+
+@dataclass(frozen=True)
+class ContextSnapshot:
+    text: str
+    # 内容指纹（sha256 前 12 位），即校验器/注册表的缓存键与生成日志中的 context_version
+    version: str
+    source: str = ""
+    loaded_at: float = 0.0
+
+    def info(self) -> Dict[str, Any]:
+        return {"version": self.version, "source": self.source, "loaded_at": self.loaded_at,
+                "bytes": len(self.text.encode("utf-8"))}
+
+
+T = TypeVar("T")
+
+
+class VersionCache(Generic[T]):
+    """
+    按上下文版本缓存由上下文派生的对象（校验器、工具注册表、工具索引），第一次用到某个版本时构建。
+    只保留当前与上一个版本：上下文替换时仍在处理的请求用旧版本收尾，不必反复重建。
+    """
+
+    def __init__(self, keep: int = 2):
+        self.keep = keep
+        self._items: Dict[str, T] = {}
+        self._lock = threading.Lock()
+
+    def get(self, version: str, build: Callable[[], T]) -> T:
+        item = self._items.get(version)
+        if item is not None:
+            return item
+        with self._lock:
+            item = self._items.get(version)
+            if item is None:
+                item = build()
+                while len(self._items) >= self.keep:
+                    self._items.pop(next(iter(self._items)))
+                self._items[version] = item
+        return item
+
+
+def make_snapshot(text: str, source: str = "") -> ContextSnapshot:
+    return ContextSnapshot(text, hashlib.sha256(text.encode("utf-8")).hexdigest()[:12], source, time.time())
+
+
+def load_text(path: pathlib.Path = CONTEXT_PATH) -> str:
+    if not path.exists():
+        raise FileNotFoundError(f"未找到上下文文件：{path}")
+    return path.read_text(encoding="utf-8")
+
+
+_current: Optional[ContextSnapshot] = None
+# 当前版本对应的 CONTEXT_PATH 状态（修改时间、大小）与上次检查的时间
+_file_stamp: Optional[Tuple[int, int]] = None
+_checked_at = 0.0
+_swap_lock = threading.Lock()
+_load_lock = threading.Lock()
+_pinned: contextvars.ContextVar[Optional[ContextSnapshot]] = contextvars.ContextVar("context_snapshot", default=None)
+
+
+def install(snapshot: ContextSnapshot) -> None:
+    global _current
+    _current = snapshot
+
+
+def latest() -> ContextSnapshot:
+    """
+    当前（最新安装的）版本，不考虑请求固定的快照。尚未安装任何版本时在第一次调用时从 CONTEXT_PATH 加载，
+    文件不存在则抛出 FileNotFoundError（导入本模块不读文件）。
+    """
+    global _current, _file_stamp
+    if _current is None:
+        with _load_lock:
+            if _current is None:
+                stamp = _stamp(CONTEXT_PATH)
+                _current = make_snapshot(load_text(), str(CONTEXT_PATH))
+                _file_stamp = stamp
+    elif RELOAD_INTERVAL > 0 and time.monotonic() - _checked_at >= RELOAD_INTERVAL:
+        _reload_if_changed()
+    return _current
+
+
+def _stamp(path: pathlib.Path) -> Optional[Tuple[int, int]]:
+    try:
+        st = path.stat()
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+def _reload_if_changed() -> None:
+    """
+    CONTEXT_PATH 自上次加载后被改写（其他 worker 上传替换）时重新加载；内容不合格时保留当前版本。
+    同一时间只有一个线程检查，其余线程直接用当前版本。
+    """
+    global _file_stamp, _checked_at
+    if not _load_lock.acquire(blocking=False):
+        return
+    try:
+        _checked_at = time.monotonic()
+        stamp = _stamp(CONTEXT_PATH)
+        if stamp is None or stamp == _file_stamp:
+            return
+        _file_stamp = stamp
+        text = load_text()
+        if make_snapshot(text).version == _current.version:
+            return
+        check_context(text)
+        with _swap_lock:
+            install(make_snapshot(text, str(CONTEXT_PATH)))
+        logger.info("上下文文件已更新，重新加载", extra={"context_version": _current.version})
+    except Exception as e:
+        logger.warning("重新加载上下文失败，保留当前版本：%s", e)
+    finally:
+        _load_lock.release()
+
+
+def current() -> ContextSnapshot:
+    """
+    本请求固定的快照；未固定时为当前版本。
+    """
+    return _pinned.get() or latest()
+
+
+@contextmanager
+def pinned(snapshot: Optional[ContextSnapshot] = None) -> Iterator[ContextSnapshot]:
+    """
+    在 with 块内（含其中 copy_context 派生的线程）固定一个快照，默认为当前版本。
+    """
+    snap = snapshot or current()
+    token = _pinned.set(snap)
+    try:
+        yield snap
+    finally:
+        _pinned.reset(token)
+
+
+def check_context(text: str) -> Dict[str, Any]:
+    """
+    新上下文的结构检查：JSON 对象，tools 为非空对象，cases 为非空对象且每个用例有步骤。
+    不合格时抛出 ValueError。
+    """
+    try:
+        data = json.loads(text)
+    except ValueError as e:
+        raise ValueError(f"上下文不是合法 JSON：{e}")
+    if not isinstance(data, dict):
+        raise ValueError("上下文必须是 JSON 对象")
+    tools, cases = data.get("tools"), data.get("cases")
+    if not isinstance(tools, dict) or not tools:
+        raise ValueError("上下文缺少 tools 或 tools 为空")
+    if not isinstance(cases, dict) or not cases:
+        raise ValueError("上下文缺少 cases 或 cases 为空")
+    empty = [k for k, c in cases.items() if not isinstance(c, dict) or not c.get("steps")]
+    if empty:
+        raise ValueError(f"{len(empty)} 个用例没有步骤：{', '.join(map(str, empty[:5]))}")
+    return data
+
+
+def _write_atomic(path: pathlib.Path, text: str) -> None:
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(text, encoding="utf-8")
+    os.replace(tmp, path)
+
+
+def swap(text: str, source: str = "", persist: Optional[pathlib.Path] = None) -> Tuple[ContextSnapshot, ContextSnapshot]:
+    """
+    检查并安装新的上下文版本，返回 (新, 旧)。persist 给出时先原子写回文件，重启后仍是新版本。
+    """
+    global _file_stamp
+    check_context(text)
+    with _swap_lock:
+        # 已持有 _swap_lock：已加载时直接取当前版本，不走 latest() 中的重新加载检查
+        old = _current or latest()
+        new = make_snapshot(text, source)
+        if persist is not None:
+            _write_atomic(persist, text)
+            if persist == CONTEXT_PATH:
+                # 本进程写回的文件不必再重新加载
+                _file_stamp = _stamp(persist)
+        install(new)
+    return new, old
@@ -0,0 +1,206 @@
+import os
+import io
+import sys
+import json
+import time
+import pathlib
+import tempfile
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, List, Optional, Tuple
+
+from app import context_store
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+# 上传 Excel 更新规划上下文：转换放在独立的工作进程里（pandas/openpyxl 解析不占用服务进程的 GIL），
+# 结果在服务进程中检查、预编译校验器/注册表后原子替换（见 app.context_store），处理中的请求用旧版本完成。
+_GET_JSON = pathlib.Path(__file__).resolve().parent.parent / "get_json"
+# 默认转换配置（与 get_json/excel_to_json2.py 的 --config 相同），请求中的配置逐项覆盖它
+CONVERTER_CONFIG = os.getenv("TESTAGENT_CONVERTER_CONFIG", str(_GET_JSON / "config.case.yaml"))
+UPLOAD_MAX_MB = float(os.getenv("TESTAGENT_UPLOAD_MAX_MB", "50"))
+# 单次转换的最长等待（秒）
+UPLOAD_TIMEOUT = float(os.getenv("TESTAGENT_UPLOAD_TIMEOUT", "300"))
+
+# 由请求决定、不从配置读取的字段
+_FIXED_FIELDS = {"input", "output", "per_case", "stream", "stream_format", "jobs"}
+
+_executor: Optional[ProcessPoolExecutor] = None
+_executor_lock = threading.Lock()
+# 同一时间只做一次上传替换
+_upload_lock = threading.Lock()
+
+
+def _pool() -> ProcessPoolExecutor:
+    """
+    懒创建的单进程转换池（spawn：服务进程里有后台线程，不宜 fork）。进程常驻，只有第一次上传承担 pandas 的导入。
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"))
+        return _executor
+
+
+def shutdown() -> None:
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
+
+
+def convert_workbook(data: bytes, base: Dict[str, Any], overrides: Dict[str, Any], tools_sheet: Any = None,
+                     tool_name_col: Optional[str] = None) -> Dict[str, Any]:
+    """
+    工作进程中执行：默认配置 base 与请求配置 overrides 合并后（overrides 中的未知字段报错），
+    把上传的 xlsx 转成 cases（sheet 为 "all" 或通配时逐个表合并，记录重复的用例 ID），给出 tools_sheet 时同时读取工具表。
+    返回 cases / tools / collisions / rows 与各阶段耗时（毫秒）。pandas 只在工作进程中导入。
+    """
+    if str(_GET_JSON) not in sys.path:
+        sys.path.insert(0, str(_GET_JSON))
+    from excel_to_json2 import Config, convert_many, expand_tasks
+    from build_context import _tools_from_sheet
+
+    allowed = set(Config().__dict__)
+    unknown = sorted(set(overrides) - allowed)
+    if unknown:
+        raise ValueError(f"未知的转换配置项：{', '.join(map(str, unknown))}")
+    fields = {k: v for k, v in {**base, **overrides}.items() if k in allowed and k not in _FIXED_FIELDS}
+
+    t0 = time.perf_counter()
+    with tempfile.TemporaryDirectory(prefix="ctx-upload-") as tmp:
+        path = os.path.join(tmp, "upload.xlsx")
+        with open(path, "wb") as f:
+            f.write(data)
+        cfg = Config(**fields, input=path, jobs=1)
+        try:
+            tasks = expand_tasks(cfg)
+            t1 = time.perf_counter()
+            cases, collisions = convert_many(cfg, tasks, log=io.StringIO())
+            t2 = time.perf_counter()
+            tools = _tools_from_sheet(path, tools_sheet, tool_name_col) if tools_sheet is not None else None
+            t3 = time.perf_counter()
+        except Exception as e:
+            # 错误信息里不暴露临时路径
+            raise ValueError(str(e).replace(path, "upload.xlsx")) from None
+        # 重复用例的来源标签形如 "<路径>[表名]"，同样换成不含临时路径的写法
+        collisions = [(cid, kept.replace(path, "upload.xlsx"), dropped.replace(path, "upload.xlsx"))
+                      for cid, kept, dropped in collisions]
+    # 用例 ID 可能是数字：按 json 写出时的键传回，与 context.json 一致
+    cases = json.loads(json.dumps(cases, ensure_ascii=False, default=str))
+    return {
+        "cases": cases,
+        "tools": tools,
+        "sheets": [str(sheet) for _, sheet in tasks],
+        "rows": sum(c.get("num_steps", 0) for c in cases.values()),
+        "collisions": [[str(cid), kept, dropped] for cid, kept, dropped in collisions],
+        "timing_ms": {"read": round((t1 - t0) * 1000, 1), "convert": round((t2 - t1) * 1000, 1),
+                      "tools": round((t3 - t2) * 1000, 1)},
+    }
+
+
+def converter_config(config_text: Optional[str] = None, sheet: Optional[str] = None) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    返回 (默认配置文件的内容, 请求中的配置)；请求配置为 YAML 或 JSON 文本，sheet 参数覆盖其中的 sheet。
+    """
+    if yaml is None:
+        raise RuntimeError("pyyaml 未安装，无法读取转换配置")
+    base: Dict[str, Any] = {}
+    if CONVERTER_CONFIG and os.path.exists(CONVERTER_CONFIG):
+        with open(CONVERTER_CONFIG, "r", encoding="utf-8") as f:
+            base = yaml.safe_load(f) or {}
+    overrides: Dict[str, Any] = {}
+    if config_text:
+        try:
+            overrides = yaml.safe_load(config_text)  # JSON 是 YAML 的子集
+        except yaml.YAMLError as e:
+            raise ValueError(f"转换配置无法解析：{e}")
+        if not isinstance(overrides, dict):
+            raise ValueError("转换配置必须是对象")
+    if sheet is not None:
+        overrides["sheet"] = int(sheet) if sheet.strip().isdigit() else sheet
+    return base, overrides
+
+
+def update_from_excel(data: bytes, config_text: Optional[str] = None, sheet: Optional[str] = None,
+                      tools_sheet: Optional[str] = None, tool_name_col: Optional[str] = None,
+                      source: str = "upload", dry_run: bool = False) -> Dict[str, Any]:
+    """
+    转换上传的工作簿并替换当前上下文（dry_run 时只转换与检查）。未给出工具表时沿用当前版本的 tools。
+    转换或检查失败抛出 ValueError，当前版本保持不变。
+    """
+    import step
+
+    started = time.perf_counter()
+    base, overrides = converter_config(config_text, sheet)
+    if tools_sheet is not None and tools_sheet.strip().isdigit():
+        tools_sheet = int(tools_sheet)
+    with _upload_lock:
+        t0 = time.perf_counter()
+        try:
+            result = _pool().submit(convert_workbook, data, base, overrides, tools_sheet, tool_name_col).result(UPLOAD_TIMEOUT)
+        except FutureTimeout:
+            raise ValueError(f"转换超时（{UPLOAD_TIMEOUT:.0f}s）")
+        except BrokenProcessPool:
+            # 工作进程异常退出（如内存不足）：丢弃该池，下次上传重新创建
+            shutdown()
+            raise RuntimeError("转换进程异常退出")
+        except Exception as e:
+            # 工作进程中的异常都来自上传内容或配置（非 xlsx、缺列、用例未分组等）
+            raise ValueError(f"转换失败：{e}")
+        t1 = time.perf_counter()
+
+        if result["collisions"] and {**base, **overrides}.get("on_collision") == "error":
+            raise ValueError(f"{len(result['collisions'])} 个用例 ID 在多个表中重复："
+                             + ", ".join(c[0] for c in result["collisions"][:5]))
+        old = context_store.latest()
+        tools = result["tools"]
+        if tools is None:
+            tools = json.loads(old.text).get("tools") or {}
+        text = json.dumps({"tools": tools, "cases": result["cases"]}, ensure_ascii=False, indent=2)
+        context_store.check_context(text)
+
+        # 切换前预编译新版本的校验器 / 注册表 / 工具索引，切换后的第一个请求不必承担
+        snapshot = context_store.make_snapshot(text, source)
+        step.plan_validator(snapshot)
+        step.tool_index(snapshot)
+        t2 = time.perf_counter()
+
+        warnings: List[str] = []
+        unknown = sorted({s.get("tool") for c in result["cases"].values() for s in c.get("steps") or []
+                          if isinstance(s.get("tool"), str) and s.get("tool") and s.get("tool") not in tools})
+        if unknown:
+            warnings.append(f"{len(unknown)} 个步骤工具不在 tools 中：{', '.join(unknown[:10])}")
+        for cid, kept, dropped in result["collisions"]:
+            warnings.append(f"用例 {cid} 重复：保留 {kept}，忽略 {dropped}")
+
+        new = snapshot
+        if not dry_run:
+            new, old = context_store.swap(text, source, persist=step.CTX_PATH)
+        t3 = time.perf_counter()
+
+    return {
+        "version": new.version,
+        "previous_version": old.version,
+        "applied": not dry_run,
+        "changed": new.version != old.version,
+        "sheets": result["sheets"],
+        "cases": len(result["cases"]),
+        "rows": result["rows"],
+        "tools": len(tools),
+        "warnings": warnings,
+        "timing_ms": {
+            "wait": round((t0 - started) * 1000, 1),
+            "worker": round((t1 - t0) * 1000, 1),
+            **{f"worker.{k}": v for k, v in result["timing_ms"].items()},
+            "compile": round((t2 - t1) * 1000, 1),
+            "swap": round((t3 - t2) * 1000, 1),
+            "total": round((t3 - started) * 1000, 1),
+        },
+    }
@@ -0,0 +1,286 @@
+import os
+import json
+import gzip
+import time
+import queue
+import shutil
+import atexit
+import threading
+import contextlib
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+# 生成日志（append-only JSONL）：请求线程只负责入队，落盘/轮转/压缩全部在后台线程完成
+# TESTAGENT_JOURNAL_DIR 默认为仓库根目录下的 journal；相对路径按仓库根目录解析（与启动时的工作目录无关）
+_ROOT = Path(__file__).resolve().parent.parent
+JOURNAL_DIR = (_ROOT / os.environ.get("TESTAGENT_JOURNAL_DIR", "journal")).resolve()
+JOURNAL_MAX_BYTES = int(os.getenv("TESTAGENT_JOURNAL_MAX_BYTES", str(64 * 1024 * 1024)))
+JOURNAL_ROTATE_SECONDS = int(os.getenv("TESTAGENT_JOURNAL_ROTATE_SECONDS", str(24 * 3600)))
+# 最多保留的段数（含当前段），0 表示不清理
+JOURNAL_MAX_SEGMENTS = int(os.getenv("TESTAGENT_JOURNAL_MAX_SEGMENTS", "30"))
+JOURNAL_QUEUE_SIZE = int(os.getenv("TESTAGENT_JOURNAL_QUEUE_SIZE", "10000"))
+
+_STOP = object()
+
+
+class GenerationJournal:
+    """
+    文件布局：
+    - gen-<起始时间>-<pid>.jsonl  当前段，每行一条生成记录
+    - gen-<起始时间>-<pid>.jsonl.gz 轮转或关闭后压缩的历史段
+    - gen-<起始时间>-<pid>.idx    该段的侧车索引，每条记录一行：ts / case_name / session / 段名 / 偏移 / 长度
+    查询只扫描索引，再按偏移读取命中的记录，不需要整段扫描。
+    索引按段拆分：多 worker 共享目录时各写各的，清理时与段一起删除，不需要重写共享文件。
+    启动时把已退出进程留下的未压缩段补压缩（进程被强杀、未走到 close 时）。
+    """
+
+    def __init__(self, directory: Path, max_bytes: int = JOURNAL_MAX_BYTES,
+                 rotate_seconds: int = JOURNAL_ROTATE_SECONDS, max_segments: int = JOURNAL_MAX_SEGMENTS,
+                 queue_size: int = JOURNAL_QUEUE_SIZE):
+        self.directory = Path(directory)
+        # 旧版本的共享索引，只读（不再写入）
+        self.legacy_index_path = self.directory / "index.jsonl"
+        self.max_bytes = max_bytes
+        self.rotate_seconds = rotate_seconds
+        self.max_segments = max_segments
+        self.dropped = 0
+        self._queue: "queue.Queue[Any]" = queue.Queue(maxsize=queue_size)
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        # 以下状态只在写线程中访问
+        self._segment: Optional[str] = None
+        self._segment_started = 0.0
+        self._data_f = None
+        self._index_f = None
+        self._offset = 0
+
+    # ---------- 请求线程侧 ----------
+    def record(self, entry: Dict[str, Any]) -> bool:
+        """
+        非阻塞入队；队列满时丢弃并计数，绝不阻塞请求线程。
+        """
+        self._ensure_started()
+        entry.setdefault("ts", time.time())
+        try:
+            self._queue.put_nowait(entry)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def flush(self, timeout: float = 5.0) -> None:
+        """
+        等待已入队的记录全部落盘（测试/关停时使用）。
+        """
+        if self._thread is None:
+            return
+        done = threading.Event()
+        self._queue.put(done, timeout=timeout)
+        done.wait(timeout)
+
+    def start(self) -> None:
+        """
+        启动写线程（首次 record 时也会自动启动）；写线程先压缩已退出进程留下的未压缩段。
+        """
+        self._ensure_started()
+
+    def close(self, timeout: float = 5.0) -> None:
+        if self._thread is None:
+            return
+        self._queue.put(_STOP, timeout=timeout)
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _ensure_started(self) -> None:
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="generation-journal", daemon=True)
+                self._thread.start()
+
+    # ---------- 写线程侧 ----------
+    def _run(self) -> None:
+        with contextlib.suppress(Exception):
+            self._recover()
+        while True:
+            item = self._queue.get()
+            # 尽量攒批：把当前已到达的记录一起写完再 flush
+            batch = [item]
+            with contextlib.suppress(queue.Empty):
+                while len(batch) < 512:
+                    batch.append(self._queue.get_nowait())
+            stop = False
+            for it in batch:
+                if it is _STOP:
+                    stop = True
+                elif isinstance(it, threading.Event):
+                    self._flush_files()
+                    it.set()
+                else:
+                    try:
+                        self._write(it)
+                    except Exception:
+                        self.dropped += 1
+            self._flush_files()
+            if stop:
+                if self._data_f is not None:
+                    with contextlib.suppress(Exception):
+                        self._rotate()
+                self._close_segment()
+                return
+
+    def _flush_files(self) -> None:
+        for f in (self._data_f, self._index_f):
+            if f is not None:
+                f.flush()
+
+    def _open_segment(self, now: float) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        # 带上 pid：多 worker 共享同一目录时各写各的段
+        name = "gen-" + datetime.fromtimestamp(now).strftime("%Y%m%d-%H%M%S-%f") + f"-{os.getpid()}"
+        self._segment = name
+        self._segment_started = now
+        self._data_f = (self.directory / f"{name}.jsonl").open("ab")
+        self._offset = self._data_f.tell()
+        self._index_f = (self.directory / f"{name}.idx").open("a", encoding="utf-8")
+
+    def _close_segment(self) -> None:
+        for f in (self._data_f, self._index_f):
+            if f is not None:
+                f.close()
+        self._data_f = None
+        self._index_f = None
+
+    def _rotate(self) -> None:
+        name = self._segment
+        self._close_segment()
+        self._compress(name)
+        self._prune()
+
+    def _compress(self, name: str) -> None:
+        src = self.directory / f"{name}.jsonl"
+        dst = self.directory / f"{name}.jsonl.gz"
+        tmp = dst.with_suffix(".gz.tmp")
+        with src.open("rb") as fin, gzip.open(tmp, "wb", compresslevel=6) as fout:
+            shutil.copyfileobj(fin, fout)
+        os.replace(tmp, dst)
+        src.unlink()
+
+    def _recover(self) -> None:
+        """
+        压缩已退出进程留下的未压缩段；仍在运行的进程（含其他 worker）的当前段不动。
+        """
+        if not self.directory.exists():
+            return
+        for path in sorted(self.directory.glob("gen-*.jsonl")):
+            name = path.name[:-len(".jsonl")]
+            pid = name.rsplit("-", 1)[-1]
+            if not pid.isdigit() or _pid_alive(int(pid)):
+                continue
+            with contextlib.suppress(OSError):
+                self._compress(name)
+        self._prune()
+
+    def _prune(self) -> None:
+        if self.max_segments <= 0:
+            return
+        segments = sorted(p for p in self.directory.glob("gen-*.jsonl.gz"))
+        # 当前段也计入保留数
+        excess = segments[:max(0, len(segments) - (self.max_segments - 1))]
+        if not excess:
+            return
+        for p in excess:
+            p.unlink(missing_ok=True)
+            (self.directory / (p.name[:-len(".jsonl.gz")] + ".idx")).unlink(missing_ok=True)
+
+    def _write(self, entry: Dict[str, Any]) -> None:
+        now = entry["ts"]
+        if self._data_f is not None and (
+                self._offset >= self.max_bytes or now - self._segment_started >= self.rotate_seconds):
+            self._rotate()
+        if self._data_f is None:
+            self._open_segment(now)
+        line = (json.dumps(entry, ensure_ascii=False, default=str) + "\n").encode("utf-8")
+        self._data_f.write(line)
+        index_line = {
+            "ts": now,
+            "request_id": entry.get("request_id"),
+            "case_name": entry.get("case_name"),
+            "session": entry.get("session"),
+            "segment": self._segment,
+            "offset": self._offset,
+            "length": len(line),
+        }
+        self._index_f.write(json.dumps(index_line, ensure_ascii=False) + "\n")
+        self._offset += len(line)
+
+    # ---------- 查询 ----------
+    def query(self, start: Optional[float] = None, end: Optional[float] = None,
+              case_name: Optional[str] = None, session: Optional[str] = None,
+              limit: int = 100) -> List[Dict[str, Any]]:
+        """
+        按时间范围 / case_name / session 查询，返回最新的 limit 条（时间倒序）。
+        """
+        if not self.directory.exists():
+            return []
+        hits: List[Dict[str, Any]] = []
+        index_files = list(self.directory.glob("gen-*.idx"))
+        if self.legacy_index_path.exists():
+            index_files.append(self.legacy_index_path)
+        for index_file in index_files:
+            with contextlib.suppress(OSError), index_file.open("r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        item = json.loads(line)
+                    except Exception:
+                        continue
+                    if start is not None and item["ts"] < start:
+                        continue
+                    if end is not None and item["ts"] > end:
+                        continue
+                    if case_name is not None and item.get("case_name") != case_name:
+                        continue
+                    if session is not None and item.get("session") != session:
+                        continue
+                    hits.append(item)
+        hits.sort(key=lambda item: item["ts"], reverse=True)
+
+        out: List[Dict[str, Any]] = []
+        decompressed: Dict[str, bytes] = {}
+        for item in hits:
+            if len(out) >= limit:
+                break
+            plain = self.directory / f"{item['segment']}.jsonl"
+            try:
+                if plain.exists():
+                    with plain.open("rb") as f:
+                        f.seek(item["offset"])
+                        raw = f.read(item["length"])
+                else:
+                    seg = item["segment"]
+                    if seg not in decompressed:
+                        decompressed[seg] = gzip.decompress((self.directory / f"{seg}.jsonl.gz").read_bytes())
+                    raw = decompressed[seg][item["offset"]:item["offset"] + item["length"]]
+                out.append(json.loads(raw))
+            except Exception:
+                continue
+        return out
+
+
+def _pid_alive(pid: int) -> bool:
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        # 无权限发信号：进程存在
+        return True
+    return True
+
+
+journal = GenerationJournal(JOURNAL_DIR)
+atexit.register(journal.close)
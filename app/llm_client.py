@@ -0,0 +1,219 @@
+import os
+import json
+import time
+import logging
+import threading
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from app.metrics import Counter
+
+logger = logging.getLogger(__name__)
+
+# LLM 客户端工厂：显式连接池、按流式/非流式区分超时、可选 HTTP/2、启动预热、连接复用统计。
+#
+# 环境变量：
+#   TESTAGENT_LLM_ENDPOINTS          多端点配置（JSON 列表），如
+#                                    [{"name": "a", "base_url": "https://x/v1", "api_key_env": "KEY_A"}, ...]
+#                                    未配置时使用 OPENAI_BASE_URL / OPENAI_API_KEY 的单端点
+#   TESTAGENT_LLM_POOL_SIZE          每个端点最大连接数，默认 32
+#   TESTAGENT_LLM_KEEPALIVE          每个端点最大空闲保活连接数，默认 16
+#   TESTAGENT_LLM_KEEPALIVE_EXPIRY   空闲连接保活秒数，默认 120
+#   TESTAGENT_LLM_CONNECT_TIMEOUT    建连超时，默认 5
+#   TESTAGENT_LLM_READ_TIMEOUT       非流式读超时（思考模型整段输出），默认 600
+#   TESTAGENT_LLM_STREAM_READ_TIMEOUT 流式相邻 chunk 之间的读超时，默认 60
+#   TESTAGENT_LLM_HTTP2              1 开启 HTTP/2（需安装 h2）
+#   TESTAGENT_LLM_SDK_RETRIES        openai SDK 内置重试次数，默认 0（重试由 app.retry 统一负责，受请求截止时间约束）
+#   TESTAGENT_LLM_WARMUP             启动时预热连接，默认 1；TESTAGENT_LLM_WARMUP_CONNECTIONS 每端点预热连接数，默认 2
+#
+# 以上变量与 OPENAI_API_KEY / OPENAI_BASE_URL 都可以写在仓库根目录的 .env 中，由 main.py 在导入 app.* 之前加载。
+# 端点（连同 openai SDK 的导入）在第一次使用时才创建，服务在 lifespan 中创建（见 step.init）。
+
+POOL_SIZE = int(os.getenv("TESTAGENT_LLM_POOL_SIZE", "32"))
+KEEPALIVE = int(os.getenv("TESTAGENT_LLM_KEEPALIVE", "16"))
+KEEPALIVE_EXPIRY = float(os.getenv("TESTAGENT_LLM_KEEPALIVE_EXPIRY", "120"))
+CONNECT_TIMEOUT = float(os.getenv("TESTAGENT_LLM_CONNECT_TIMEOUT", "5"))
+READ_TIMEOUT = float(os.getenv("TESTAGENT_LLM_READ_TIMEOUT", "600"))
+STREAM_READ_TIMEOUT = float(os.getenv("TESTAGENT_LLM_STREAM_READ_TIMEOUT", "60"))
+HTTP2 = os.getenv("TESTAGENT_LLM_HTTP2", "0") == "1"
+SDK_RETRIES = int(os.getenv("TESTAGENT_LLM_SDK_RETRIES", "0"))
+WARMUP = os.getenv("TESTAGENT_LLM_WARMUP", "1") == "1"
+WARMUP_CONNECTIONS = int(os.getenv("TESTAGENT_LLM_WARMUP_CONNECTIONS", "2"))
+
+HTTP_REQUESTS = Counter("testagent_llm_http_requests_total", "发往 LLM 端点的 HTTP 请求数", ("endpoint",))
+HTTP_CONNECTIONS = Counter("testagent_llm_http_connections_total", "新建的 LLM 端点连接数（TCP/TLS 握手）",
+                           ("endpoint", "kind"))
+
+
+@dataclass(frozen=True)
+class EndpointConfig:
+    name: str
+    base_url: Optional[str] = None
+    api_key: Optional[str] = None
+
+
+def request_timeout(stream: bool) -> httpx.Timeout:
+    """
+    单次调用的超时：流式的 read 是相邻 chunk 的间隔，非流式则要覆盖整段生成。
+    """
+    read = STREAM_READ_TIMEOUT if stream else READ_TIMEOUT
+    return httpx.Timeout(connect=CONNECT_TIMEOUT, read=read, write=30.0, pool=CONNECT_TIMEOUT)
+
+
+class ConnectionStats:
+    """
+    借助 httpcore 的 trace 扩展统计新建连接数，复用率 = 1 - 新建连接 / 请求数。
+    """
+
+    def __init__(self, endpoint: str):
+        self.endpoint = endpoint
+        self.requests = 0
+        self.tcp_connects = 0
+        self.tls_handshakes = 0
+        self._lock = threading.Lock()
+
+    def on_request(self, request: httpx.Request) -> None:
+        with self._lock:
+            self.requests += 1
+        HTTP_REQUESTS.inc(endpoint=self.endpoint)
+        request.extensions["trace"] = self._trace
+
+    def _trace(self, event_name: str, info: Dict[str, Any]) -> None:
+        if event_name == "connection.connect_tcp.started":
+            with self._lock:
+                self.tcp_connects += 1
+            HTTP_CONNECTIONS.inc(endpoint=self.endpoint, kind="tcp")
+        elif event_name == "connection.start_tls.started":
+            with self._lock:
+                self.tls_handshakes += 1
+            HTTP_CONNECTIONS.inc(endpoint=self.endpoint, kind="tls")
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            reuse = 1 - self.tcp_connects / self.requests if self.requests else None
+            return {"requests": self.requests, "tcp_connects": self.tcp_connects,
+                    "tls_handshakes": self.tls_handshakes,
+                    "reuse_ratio": round(reuse, 4) if reuse is not None else None}
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401  type: ignore
+        return True
+    except Exception:
+        return False
+
+
+def load_endpoint_configs() -> List[EndpointConfig]:
+    raw = os.getenv("TESTAGENT_LLM_ENDPOINTS", "").strip()
+    if not raw:
+        return [EndpointConfig(name="default")]
+    items = json.loads(raw)
+    configs = []
+    for i, item in enumerate(items):
+        if isinstance(item, str):
+            item = {"base_url": item}
+        api_key = item.get("api_key") or (os.getenv(item["api_key_env"]) if item.get("api_key_env") else None)
+        configs.append(EndpointConfig(name=item.get("name") or f"ep{i}", base_url=item.get("base_url"),
+                                      api_key=api_key))
+    return configs
+
+
+class LLMEndpoint:
+    def __init__(self, config: EndpointConfig):
+        self.config = config
+        self.name = config.name
+        use_http2 = HTTP2 and _http2_available()
+        if HTTP2 and not use_http2:
+            logger.warning("TESTAGENT_LLM_HTTP2=1 但未安装 h2，回退到 HTTP/1.1", extra={"endpoint": config.name})
+        self.stats = ConnectionStats(config.name)
+        self.http_client = httpx.Client(
+            limits=httpx.Limits(max_connections=POOL_SIZE, max_keepalive_connections=KEEPALIVE,
+                                keepalive_expiry=KEEPALIVE_EXPIRY),
+            timeout=request_timeout(stream=False),
+            http2=use_http2,
+            follow_redirects=True,
+            event_hooks={"request": [self.stats.on_request]},
+        )
+        # base_url / api_key 为 None 时 SDK 回退到 OPENAI_BASE_URL / OPENAI_API_KEY
+        from openai import OpenAI
+        self.client = OpenAI(base_url=config.base_url, api_key=config.api_key,
+                             http_client=self.http_client, max_retries=SDK_RETRIES)
+
+    @property
+    def base_url(self) -> str:
+        return str(self.client.base_url)
+
+    def warm_up(self, connections: int = WARMUP_CONNECTIONS) -> Dict[str, Any]:
+        """
+        并发发起轻量探测（GET /models），提前完成 DNS/TCP/TLS 握手并把连接放入保活池。
+        探测返回错误状态码也无妨，连接已建立。
+        """
+        results: List[Optional[str]] = [None] * max(1, connections)
+        started = time.perf_counter()
+
+        def probe(i: int):
+            try:
+                self.client.with_options(max_retries=0, timeout=request_timeout(stream=False)).models.list()
+            except Exception as e:
+                results[i] = f"{type(e).__name__}: {e}"[:200]
+
+        threads = [threading.Thread(target=probe, args=(i,), daemon=True) for i in range(len(results))]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join(CONNECT_TIMEOUT * 2)
+        return {"endpoint": self.name, "base_url": self.base_url,
+                "ms": round((time.perf_counter() - started) * 1000, 1),
+                "errors": [r for r in results if r], **self.stats.snapshot()}
+
+    def close(self) -> None:
+        self.http_client.close()
+
+
+class LLMClients:
+    """
+    按名称管理多个 OpenAI 兼容端点；第一个端点为默认端点。
+    """
+
+    def __init__(self, configs: Optional[List[EndpointConfig]] = None):
+        self._configs = configs
+        self._endpoints: Optional[Dict[str, LLMEndpoint]] = None
+        self._lock = threading.Lock()
+
+    @property
+    def endpoints(self) -> Dict[str, LLMEndpoint]:
+        """
+        第一次访问时读取端点配置并创建客户端。
+        """
+        if self._endpoints is None:
+            with self._lock:
+                if self._endpoints is None:
+                    self._endpoints = {cfg.name: LLMEndpoint(cfg) for cfg in self._configs or load_endpoint_configs()}
+        return self._endpoints
+
+    def default(self) -> LLMEndpoint:
+        return next(iter(self.endpoints.values()))
+
+    def get(self, name: Optional[str] = None) -> LLMEndpoint:
+        return self.endpoints[name] if name else self.default()
+
+    def warm_up(self) -> List[Dict[str, Any]]:
+        reports = [ep.warm_up() for ep in self.endpoints.values()]
+        for r in reports:
+            logger.info("LLM 连接预热完成", extra=r)
+        return reports
+
+    def stats(self) -> List[Dict[str, Any]]:
+        return [{"endpoint": ep.name, "base_url": ep.base_url, **ep.stats.snapshot()}
+                for ep in self.endpoints.values()]
+
+    def close(self) -> None:
+        # 从未创建过端点时不必为了关闭而创建
+        for ep in (self._endpoints or {}).values():
+            ep.close()
+
+
+llm_clients = LLMClients()
@@ -0,0 +1,483 @@
+import os
+import time
+import queue
+import logging
+import threading
+import contextvars
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from app.llm_client import LLMClients, LLMEndpoint, llm_clients
+from app.metrics import observe_llm
+
+logger = logging.getLogger(__name__)
+
+# 多端点路由：按健康度（EWMA 延迟 / 错误率 / 熔断）挑选端点，端点级故障时自动切换到下一个；可选对冲请求。
+#
+# 环境变量：
+#   TESTAGENT_LLM_EWMA_ALPHA          EWMA 平滑系数，默认 0.2
+#   TESTAGENT_LLM_CB_FAILURES         连续失败多少次熔断，默认 5
+#   TESTAGENT_LLM_CB_COOLDOWN         熔断多少秒后放行一个试探请求（半开），默认 30
+#   TESTAGENT_LLM_HEDGE               1 开启对冲请求（至少 2 个可用端点时生效；非流式调用此时改走流式并聚合，
+#                                     以便关闭落败的请求）
+#   TESTAGENT_LLM_HEDGE_PERCENTILE    对冲触发分位数，默认 0.9（流式按首 chunk 延迟，非流式按总耗时）
+#   TESTAGENT_LLM_HEDGE_MIN_SAMPLES   样本数不足时改用 TESTAGENT_LLM_HEDGE_DEFAULT_DELAY（默认 10 秒）
+
+EWMA_ALPHA = float(os.getenv("TESTAGENT_LLM_EWMA_ALPHA", "0.2"))
+CB_FAILURES = int(os.getenv("TESTAGENT_LLM_CB_FAILURES", "5"))
+CB_COOLDOWN = float(os.getenv("TESTAGENT_LLM_CB_COOLDOWN", "30"))
+HEDGE = os.getenv("TESTAGENT_LLM_HEDGE", "0") == "1"
+HEDGE_PERCENTILE = float(os.getenv("TESTAGENT_LLM_HEDGE_PERCENTILE", "0.9"))
+HEDGE_MIN_SAMPLES = int(os.getenv("TESTAGENT_LLM_HEDGE_MIN_SAMPLES", "20"))
+HEDGE_DEFAULT_DELAY = float(os.getenv("TESTAGENT_LLM_HEDGE_DEFAULT_DELAY", "10"))
+
+
+def is_endpoint_error(exc: BaseException) -> bool:
+    """
+    计入端点健康度、可以换端点重试的错误：网络/超时/限流/5xx。4xx 参数错误换端点也没用，直接抛出。
+    """
+    # 出现这类错误时 openai 早已随客户端导入，这里的导入只是取已加载的模块
+    import openai
+    return isinstance(exc, (openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError))
+
+
+class EndpointHealth:
+    """
+    单个端点的健康状态：EWMA 延迟/首 chunk 延迟/错误率、最近延迟样本（算分位数）、熔断器。
+    """
+
+    def __init__(self):
+        self.latency: Optional[float] = None
+        self.ttft: Optional[float] = None
+        self.error_rate = 0.0
+        self.consecutive_failures = 0
+        self.opened_at: Optional[float] = None
+        self.probing = False
+        self.latency_samples: deque = deque(maxlen=200)
+        self.ttft_samples: deque = deque(maxlen=200)
+        self._lock = threading.Lock()
+
+    def available(self, now: float) -> bool:
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            # 半开：冷却期过后只放行一个试探请求
+            return now - self.opened_at >= CB_COOLDOWN and not self.probing
+
+    def acquire(self) -> None:
+        with self._lock:
+            if self.opened_at is not None:
+                self.probing = True
+
+    def record_success(self, latency: float, ttft: Optional[float] = None) -> None:
+        with self._lock:
+            self.latency = latency if self.latency is None else EWMA_ALPHA * latency + (1 - EWMA_ALPHA) * self.latency
+            self.latency_samples.append(latency)
+            if ttft is not None:
+                self.ttft = ttft if self.ttft is None else EWMA_ALPHA * ttft + (1 - EWMA_ALPHA) * self.ttft
+                self.ttft_samples.append(ttft)
+            self.error_rate *= 1 - EWMA_ALPHA
+            self.consecutive_failures = 0
+            self.opened_at = None
+            self.probing = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.error_rate = EWMA_ALPHA + (1 - EWMA_ALPHA) * self.error_rate
+            self.consecutive_failures += 1
+            # 半开试探失败直接重新熔断
+            if self.consecutive_failures >= CB_FAILURES or self.opened_at is not None:
+                self.opened_at = time.monotonic()
+            self.probing = False
+
+    def release(self) -> None:
+        """
+        请求被取消或因与端点无关的原因失败：不计入健康度，只归还半开试探名额。
+        """
+        with self._lock:
+            self.probing = False
+
+    def percentile(self, stream: bool, q: float) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self.ttft_samples if stream else self.latency_samples)
+        if len(samples) < HEDGE_MIN_SAMPLES:
+            return None
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            if self.opened_at is None:
+                circuit = "closed"
+            else:
+                circuit = "half-open" if self.probing else "open"
+            return {"ewma_latency_s": self.latency, "ewma_ttft_s": self.ttft,
+                    "error_rate": round(self.error_rate, 4),
+                    "consecutive_failures": self.consecutive_failures, "circuit": circuit}
+
+
+class PooledStream:
+    """
+    胜出端点的流：先吐出选路时已读到的首个 chunk，再透传其余 chunk；
+    迭代结束时记录该端点的耗时、首 chunk 延迟与 token 用量。支持 with 语句与 close()。
+    """
+
+    def __init__(self, pool: "EndpointPool", endpoint: LLMEndpoint, stream, iterator, first: List[Any],
+                 model: str, started: float, ttft: Optional[float]):
+        self.pool = pool
+        self.endpoint = endpoint
+        self._stream = stream
+        self._iterator = iterator
+        self._first = first
+        self._model = model
+        self._started = started
+        self._ttft = ttft
+        self._usage: Dict[str, Any] = {}
+        self._done = False
+
+    def __iter__(self):
+        try:
+            for chunk in self._first:
+                yield self._observe(chunk)
+            for chunk in self._iterator:
+                yield self._observe(chunk)
+            self._finish("ok")
+        except Exception as e:
+            if is_endpoint_error(e):
+                self._finish("error")
+            raise
+        finally:
+            # 调用方提前中断或出现与端点无关的异常
+            self._finish("cancelled")
+
+    def _observe(self, chunk):
+        usage = getattr(chunk, "usage", None)
+        if usage is not None:
+            self._usage = {"prompt_tokens": getattr(usage, "prompt_tokens", None),
+                           "completion_tokens": getattr(usage, "completion_tokens", None)}
+        return chunk
+
+    def _finish(self, outcome: str) -> None:
+        if self._done:
+            return
+        self._done = True
+        duration = time.monotonic() - self._started
+        health = self.pool.health[self.endpoint.name]
+        if outcome == "ok":
+            health.record_success(duration, self._ttft)
+        elif outcome == "error":
+            health.record_failure()
+        else:
+            health.release()
+        observe_llm(self._model, self.endpoint.name, stream=True, duration=duration, ttft=self._ttft,
+                    usage=self._usage, outcome=outcome)
+
+    def close(self) -> None:
+        self._stream.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class EndpointPool:
+    """
+    在 LLMClients 的多个端点之上做选路、故障切换与对冲；每次调用同时返回实际服务的端点。
+    """
+
+    def __init__(self, clients: LLMClients):
+        self.clients = clients
+        self._health: Optional[Dict[str, EndpointHealth]] = None
+        self._lock = threading.Lock()
+
+    @property
+    def health(self) -> Dict[str, EndpointHealth]:
+        # 与端点一样在第一次使用时创建
+        if self._health is None:
+            with self._lock:
+                if self._health is None:
+                    self._health = {name: EndpointHealth() for name in self.clients.endpoints}
+        return self._health
+
+    def ranked(self) -> List[LLMEndpoint]:
+        """
+        可用端点按 EWMA 延迟 ×（1 + 4 × 错误率）升序；还没有延迟数据的端点按已知最慢的端点估计。
+        全部熔断时退化为全部端点，总比直接失败好。
+        """
+        now = time.monotonic()
+        endpoints = list(self.clients.endpoints.values())
+        available = [ep for ep in endpoints if self.health[ep.name].available(now)] or endpoints
+        known = [self.health[ep.name].latency for ep in available if self.health[ep.name].latency is not None]
+        baseline = max(known) if known else 1.0
+
+        def score(ep: LLMEndpoint) -> float:
+            h = self.health[ep.name]
+            return (h.latency if h.latency is not None else baseline) * (1 + 4 * h.error_rate)
+
+        return sorted(available, key=score)
+
+    def _hedge_delay(self, endpoint: LLMEndpoint, stream: bool) -> Optional[float]:
+        if not HEDGE:
+            return None
+        p = self.health[endpoint.name].percentile(stream, HEDGE_PERCENTILE)
+        return p if p is not None else HEDGE_DEFAULT_DELAY
+
+    def _race(self, ranked: List[LLMEndpoint], attempt: Callable[[LLMEndpoint, threading.Event], Any],
+              hedge_delay: Optional[float], discard: Callable[[Any], None]) -> Tuple[Any, LLMEndpoint]:
+        """
+        依次尝试端点：端点级错误换下一个；hedge_delay 不为空时，首个请求超过该时长仍未完成就向下一个端点
+        再发一份，先成功者胜出，其余请求收到取消信号，迟到的结果交给 discard 释放。
+        """
+        if hedge_delay is None or len(ranked) < 2:
+            last_err: Optional[Exception] = None
+            for endpoint in ranked:
+                try:
+                    return attempt(endpoint, threading.Event()), endpoint
+                except Exception as e:
+                    if not is_endpoint_error(e):
+                        raise
+                    last_err = e
+                    logger.warning("LLM 端点调用失败，切换下一个：%s", e, extra={"endpoint": endpoint.name})
+            raise last_err
+
+        results: "queue.Queue[Tuple[LLMEndpoint, Any, Optional[BaseException]]]" = queue.Queue()
+        cancelled = threading.Event()
+        lock = threading.Lock()
+        won: Dict[str, Optional[LLMEndpoint]] = {"endpoint": None}
+
+        def run(endpoint: LLMEndpoint):
+            try:
+                value = attempt(endpoint, cancelled)
+            except BaseException as e:
+                results.put((endpoint, None, e))
+                return
+            with lock:
+                lost = won["endpoint"] is not None
+                if not lost:
+                    won["endpoint"] = endpoint
+            if lost:
+                discard(value)
+            else:
+                results.put((endpoint, value, None))
+
+        def launch(endpoint: LLMEndpoint):
+            # 每个线程各自复制一份 contextvars，request_id / 指标路径等上下文随请求走
+            ctx = contextvars.copy_context()
+            threading.Thread(target=ctx.run, args=(run, endpoint), daemon=True,
+                             name=f"llm-{endpoint.name}").start()
+
+        launch(ranked[0])
+        next_idx, pending, hedged = 1, 1, False
+        last_err = None
+        while pending:
+            timeout = hedge_delay if not hedged and next_idx < len(ranked) else None
+            try:
+                endpoint, value, err = results.get(timeout=timeout)
+            except queue.Empty:
+                hedged = True
+                logger.info("触发对冲请求", extra={"endpoint": ranked[next_idx].name, "hedge_delay_s": hedge_delay})
+                launch(ranked[next_idx])
+                next_idx, pending = next_idx + 1, pending + 1
+                continue
+            pending -= 1
+            if err is None:
+                cancelled.set()
+                return value, endpoint
+            if not is_endpoint_error(err):
+                cancelled.set()
+                raise err
+            last_err = err
+            logger.warning("LLM 端点调用失败，切换下一个：%s", err, extra={"endpoint": endpoint.name})
+            if pending == 0 and next_idx < len(ranked):
+                launch(ranked[next_idx])
+                next_idx, pending = next_idx + 1, pending + 1
+        raise last_err
+
+    # ---------- 非流式 ----------
+    def create(self, **kwargs) -> Tuple[Any, LLMEndpoint]:
+        """
+        非流式 chat.completions.create，返回 (响应, 实际服务的端点)。
+        对冲生效时改为流式请求并把 chunk 聚合成 ChatCompletion（见 _create_hedged）：
+        同步的非流式请求无法从外部中断，流式请求可以在 chunk 之间关闭，落败者不必跑完整个生成。
+        """
+        model = kwargs.get("model", "")
+        ranked = self.ranked()
+        hedge_delay = self._hedge_delay(ranked[0], stream=False)
+        if hedge_delay is not None and len(ranked) >= 2:
+            return self._create_hedged(ranked, hedge_delay, kwargs)
+
+        def attempt(endpoint: LLMEndpoint, cancelled: threading.Event):
+            health = self.health[endpoint.name]
+            health.acquire()
+            started = time.monotonic()
+            try:
+                resp = endpoint.client.chat.completions.create(**kwargs)
+            except BaseException as e:
+                if is_endpoint_error(e) and not cancelled.is_set():
+                    health.record_failure()
+                else:
+                    health.release()
+                observe_llm(model, endpoint.name, stream=False, duration=time.monotonic() - started,
+                            outcome="error")
+                raise
+            duration = time.monotonic() - started
+            health.record_success(duration)
+            usage = getattr(resp, "usage", None)
+            observe_llm(model, endpoint.name, stream=False, duration=duration,
+                        usage={"prompt_tokens": getattr(usage, "prompt_tokens", None),
+                               "completion_tokens": getattr(usage, "completion_tokens", None)} if usage else None)
+            return resp
+
+        return self._race(ranked, attempt, None, lambda resp: None)
+
+    def _create_hedged(self, ranked: List[LLMEndpoint], hedge_delay: float,
+                       kwargs: Dict[str, Any]) -> Tuple[Any, LLMEndpoint]:
+        """
+        create 的对冲版本：每个尝试都以流式请求读完并聚合；收到取消信号的尝试在下一个 chunk 处关闭响应，
+        胜出后仍在等待 chunk 的落败者由这里直接关闭，尽快释放连接。健康度与指标仍按非流式（总耗时）记录。
+        """
+        kwargs = {**kwargs, "stream": True}
+        kwargs.setdefault("stream_options", {"include_usage": True})
+        model = kwargs.get("model", "")
+        opened: Dict[str, Any] = {}
+        opened_lock = threading.Lock()
+
+        def attempt(endpoint: LLMEndpoint, cancelled: threading.Event):
+            health = self.health[endpoint.name]
+            health.acquire()
+            started = time.monotonic()
+            stream = None
+            try:
+                stream = endpoint.client.chat.completions.create(**kwargs)
+                with opened_lock:
+                    opened[endpoint.name] = stream
+                resp = _aggregate(stream, model, cancelled)
+            except BaseException as e:
+                if stream is not None:
+                    stream.close()
+                if is_endpoint_error(e) and not cancelled.is_set():
+                    health.record_failure()
+                    observe_llm(model, endpoint.name, stream=False, duration=time.monotonic() - started,
+                                outcome="error")
+                else:
+                    health.release()
+                raise
+            duration = time.monotonic() - started
+            health.record_success(duration)
+            usage = resp.usage
+            observe_llm(model, endpoint.name, stream=False, duration=duration,
+                        usage={"prompt_tokens": usage.prompt_tokens,
+                               "completion_tokens": usage.completion_tokens} if usage else None)
+            return resp
+
+        resp, endpoint = self._race(ranked, attempt, hedge_delay, lambda resp: None)
+        with opened_lock:
+            losers = [s for name, s in opened.items() if name != endpoint.name]
+        for s in losers:
+            try:
+                s.close()
+            except Exception:
+                pass
+        return resp, endpoint
+
+    # ---------- 流式 ----------
+    def stream(self, **kwargs) -> PooledStream:
+        """
+        流式 chat.completions.create（自动带上 stream=True）。读到首个 chunk 才算选路成功：
+        首个 chunk 之前的端点级错误会切换端点，对冲时落败的流立即关闭；
+        首个 chunk 之后的错误由调用方按自己的重试策略处理。
+        """
+        kwargs["stream"] = True
+        model = kwargs.get("model", "")
+        opened: Dict[str, Any] = {}
+        opened_lock = threading.Lock()
+
+        def attempt(endpoint: LLMEndpoint, cancelled: threading.Event):
+            health = self.health[endpoint.name]
+            health.acquire()
+            started = time.monotonic()
+            stream = None
+            try:
+                stream = endpoint.client.chat.completions.create(**kwargs)
+                with opened_lock:
+                    opened[endpoint.name] = stream
+                if cancelled.is_set():
+                    raise _Cancelled()
+                iterator = iter(stream)
+                try:
+                    first = [next(iterator)]
+                except StopIteration:
+                    first = []
+                return stream, iterator, first, started, time.monotonic() - started
+            except BaseException as e:
+                if stream is not None:
+                    stream.close()
+                if is_endpoint_error(e) and not cancelled.is_set():
+                    health.record_failure()
+                    observe_llm(model, endpoint.name, stream=True, duration=time.monotonic() - started,
+                                outcome="error")
+                else:
+                    health.release()
+                raise
+
+        def discard(value):
+            value[0].close()
+
+        ranked = self.ranked()
+        (stream, iterator, first, started, ttft), endpoint = self._race(
+            ranked, attempt, self._hedge_delay(ranked[0], stream=True), discard)
+        # 仍在等待首个 chunk 的对冲请求：关闭其响应，尽快释放连接
+        with opened_lock:
+            losers = [s for name, s in opened.items() if name != endpoint.name]
+        for s in losers:
+            try:
+                s.close()
+            except Exception:
+                pass
+        return PooledStream(self, endpoint, stream, iterator, first, model, started, ttft)
+
+    def stats(self) -> List[Dict[str, Any]]:
+        return [{"endpoint": name, **h.snapshot()} for name, h in self.health.items()]
+
+
+class _Cancelled(Exception):
+    pass
+
+
+def _aggregate(stream, model: str, cancelled: threading.Event):
+    """
+    把 chat.completions 的流式 chunk 聚合成非流式的 ChatCompletion（content、reasoning_content、
+    finish_reason、usage），供 create 的对冲路径返回；cancelled 置位时在下一个 chunk 处中止。
+    """
+    from openai.types.chat import ChatCompletion
+
+    content: List[str] = []
+    reasoning: List[str] = []
+    head: Dict[str, Any] = {"id": "", "created": 0, "model": model}
+    finish_reason = None
+    usage = None
+    for chunk in stream:
+        if cancelled.is_set():
+            raise _Cancelled()
+        if not head["id"]:
+            head = {"id": chunk.id, "created": chunk.created, "model": chunk.model or model}
+        if getattr(chunk, "usage", None) is not None:
+            usage = chunk.usage.model_dump()
+        for choice in chunk.choices or []:
+            if choice.index != 0:
+                continue
+            delta = choice.delta
+            content.append(getattr(delta, "content", None) or "")
+            reasoning.append(getattr(delta, "reasoning_content", None) or getattr(delta, "reasoning", None) or "")
+            finish_reason = choice.finish_reason or finish_reason
+    message: Dict[str, Any] = {"role": "assistant", "content": "".join(content)}
+    if any(reasoning):
+        message["reasoning_content"] = "".join(reasoning)
+    return ChatCompletion.model_validate({
+        **head, "object": "chat.completion", "usage": usage,
+        "choices": [{"index": 0, "message": message, "finish_reason": finish_reason or "stop"}],
+    })
+
+
+llm_pool = EndpointPool(llm_clients)
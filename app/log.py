@@ -0,0 +1,177 @@
+import os
+import re
+import sys
+import json
+import uuid
+import queue
+import random
+import atexit
+import logging
+import logging.handlers
+import contextvars
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+# 结构化日志：请求线程只把 LogRecord 放进内存队列，格式化与输出由 QueueListener 后台线程完成。
+#
+# 环境变量：
+#   TESTAGENT_LOG_LEVEL    根级别，默认 INFO
+#   TESTAGENT_LOG_LEVELS   按模块覆盖，如 "step=DEBUG,app.routers.plan=WARNING"
+#   TESTAGENT_LOG_FORMAT   json（默认）| text
+#   TESTAGENT_LOG_SAMPLE   高频事件采样率，如 "stream_chunk=0.01"（未配置的采样键默认全量）
+
+request_id_var: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("request_id", default=None)
+session_var: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("session", default=None)
+
+# 每条记录固定携带的结构化字段；model / attempt 由调用方通过 extra 传入
+CONTEXT_FIELDS = ("request_id", "session", "model", "attempt")
+_STD_ATTRS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "sample"}
+# 客户端传入的 X-Request-ID 只在符合该格式时沿用（会进入日志、响应头与生成日志），否则重新生成
+_REQUEST_ID_RE = re.compile(r"[0-9A-Za-z_.-]{1,64}")
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def _parse_mapping(raw: str) -> Dict[str, str]:
+    out: Dict[str, str] = {}
+    for part in (raw or "").split(","):
+        if "=" in part:
+            k, v = part.split("=", 1)
+            out[k.strip()] = v.strip()
+    return out
+
+
+class ContextFilter(logging.Filter):
+    """
+    从 contextvars 注入 request_id / session，并补齐缺省字段。
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if getattr(record, "request_id", None) is None:
+            record.request_id = request_id_var.get()
+        if getattr(record, "session", None) is None:
+            record.session = session_var.get()
+        for name in ("model", "attempt"):
+            if not hasattr(record, name):
+                setattr(record, name, None)
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    对带 extra={"sample": <键>} 的高频记录按配置比例采样，未被采中的记录不会入队。
+    """
+
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        key = getattr(record, "sample", None)
+        if key is None:
+            return True
+        rate = self.rates.get(key, 1.0)
+        return rate >= 1.0 or random.random() < rate
+
+
+class _InProcessQueueHandler(logging.handlers.QueueHandler):
+    """
+    同进程队列无需序列化：跳过 QueueHandler.prepare 中的 format，保证入队为 O(1)。
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        out = {
+            "ts": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for name in CONTEXT_FIELDS:
+            value = getattr(record, name, None)
+            if value is not None:
+                out[name] = value
+        for name, value in record.__dict__.items():
+            if name not in _STD_ATTRS and name not in CONTEXT_FIELDS and not name.startswith("_"):
+                out[name] = value
+        if record.exc_info:
+            out["exc"] = self.formatException(record.exc_info)
+        return json.dumps(out, ensure_ascii=False, default=str)
+
+
+TEXT_FORMAT = "%(asctime)s %(levelname)s %(name)s [req=%(request_id)s model=%(model)s attempt=%(attempt)s] %(message)s"
+
+
+def setup_logging(stream=None) -> None:
+    """
+    安装队列化的日志管线（幂等）。在 FastAPI 启动或脚本入口调用一次即可。
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    root = logging.getLogger()
+    root.setLevel(os.getenv("TESTAGENT_LOG_LEVEL", "INFO").upper())
+    for name, level in _parse_mapping(os.getenv("TESTAGENT_LOG_LEVELS", "")).items():
+        logging.getLogger(name).setLevel(level.upper())
+
+    output = logging.StreamHandler(stream or sys.stdout)
+    if os.getenv("TESTAGENT_LOG_FORMAT", "json").lower() == "text":
+        output.setFormatter(logging.Formatter(TEXT_FORMAT))
+    else:
+        output.setFormatter(JsonFormatter())
+
+    rates = {k: float(v) for k, v in _parse_mapping(os.getenv("TESTAGENT_LOG_SAMPLE", "stream_chunk=0.01")).items()}
+    handler = _InProcessQueueHandler(queue.SimpleQueue())
+    handler.addFilter(SamplingFilter(rates))
+    handler.addFilter(ContextFilter())
+    root.addHandler(handler)
+
+    _listener = logging.handlers.QueueListener(handler.queue, output, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+
+def shutdown_logging() -> None:
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+class RequestContextMiddleware:
+    """
+    纯 ASGI 中间件：为每个请求设置 request_id / session（取自 X-Request-ID / X-Session-ID 头，缺省生成），
+    并在响应头回写 X-Request-ID。X-Request-ID 不符合 _REQUEST_ID_RE（最长 64 位 [0-9A-Za-z_.-]）时改用新生成的 id。
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope.get("headers") or [])
+        request_id = headers.get(b"x-request-id", b"").decode("latin-1")
+        if not _REQUEST_ID_RE.fullmatch(request_id):
+            request_id = uuid.uuid4().hex
+        session = headers.get(b"x-session-id", b"").decode("latin-1") or None
+        rid_token = request_id_var.set(request_id)
+        session_token = session_var.set(session)
+
+        async def send_with_request_id(message):
+            if message["type"] == "http.response.start":
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [(b"x-request-id", request_id.encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            request_id_var.reset(rid_token)
+            session_var.reset(session_token)
@@ -0,0 +1,214 @@
+import os
+import time
+import bisect
+import threading
+import contextlib
+import contextvars
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+# 进程内的 Prometheus 指标（文本格式 0.0.4），无第三方依赖。
+# 多 worker 部署时每个进程各自导出，由抓取端按实例聚合。
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+RATE_BUCKETS = (1, 5, 10, 20, 30, 50, 75, 100, 150, 200, 300, 500)
+
+# 是否对所有请求附带 Server-Timing 头；否则仅在请求头 X-Server-Timing: 1 时附带
+SERVER_TIMING_ALWAYS = os.getenv("TESTAGENT_SERVER_TIMING", "0") == "1"
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _fmt_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_fmt_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # key -> [每个桶的计数..., +Inf 计数, sum]
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            row = self._values.get(key)
+            if row is None:
+                row = self._values[key] = [0.0] * (len(self.buckets) + 2)
+            row[idx] += 1
+            row[-1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = [(k, list(v)) for k, v in self._values.items()]
+        for key, row in items:
+            cumulative = 0.0
+            bounds = [str(b) for b in self.buckets] + ["+Inf"]
+            for bound, count in zip(bounds, row):
+                cumulative += count
+                le = 'le="%s"' % bound
+                lines.append(f"{self.name}_bucket{_fmt_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_fmt_labels(self.labelnames, key)} {row[-1]}")
+            lines.append(f"{self.name}_count{_fmt_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+REGISTRY: List[Any] = []
+
+HTTP_SECONDS = Histogram("testagent_http_request_duration_seconds", "HTTP 请求耗时",
+                         ("path", "method", "status"))
+STAGE_SECONDS = Histogram("testagent_stage_duration_seconds", "请求内各阶段耗时（存储/提示词/排队/解析/校验/保存等）",
+                          ("stage", "path", "model"))
+LLM_TTFT_SECONDS = Histogram("testagent_llm_ttft_seconds", "LLM 首 token 延迟", ("model", "endpoint", "path"))
+LLM_SECONDS = Histogram("testagent_llm_request_duration_seconds", "单次 LLM 调用总耗时",
+                        ("model", "endpoint", "path", "stream"))
+LLM_TOKENS_PER_SECOND = Histogram("testagent_llm_tokens_per_second", "LLM 生成速率（completion tokens / 秒）",
+                                  ("model", "endpoint", "path"), buckets=RATE_BUCKETS)
+LLM_TOKENS = Counter("testagent_llm_tokens_total", "LLM token 用量", ("model", "endpoint", "kind"))
+LLM_ATTEMPTS = Counter("testagent_llm_attempts_total", "LLM 调用尝试次数（含重试）",
+                       ("model", "endpoint", "outcome"))
+PLAN_REPAIRS = Counter("testagent_plan_repairs_total", "模型输出经容错修复后才可用的次数（按修复类型）",
+                       ("model", "repair"))
+
+
+def render_latest() -> str:
+    lines: List[str] = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# ---------- 请求级上下文 ----------
+class RequestTimings:
+    __slots__ = ("scope", "start", "server_timing", "entries")
+
+    def __init__(self, scope: Dict[str, Any], server_timing: bool):
+        self.scope = scope
+        self.start = time.perf_counter()
+        self.server_timing = server_timing
+        self.entries: List[Tuple[str, float]] = []
+
+    @property
+    def path(self) -> str:
+        # 用路由模板而非原始路径，避免 /plan/thinking/{id} 之类的标签爆炸
+        route = self.scope.get("route")
+        return getattr(route, "path", None) or self.scope.get("path", "")
+
+
+_timings_var: contextvars.ContextVar[Optional[RequestTimings]] = contextvars.ContextVar("request_timings", default=None)
+
+
+def current_path() -> str:
+    rt = _timings_var.get()
+    return rt.path if rt is not None else ""
+
+
+def observe_stage(stage: str, seconds: float, model: str = "") -> None:
+    rt = _timings_var.get()
+    STAGE_SECONDS.observe(seconds, stage=stage, path=rt.path if rt else "", model=model)
+    if rt is not None and rt.server_timing:
+        rt.entries.append((stage, seconds))
+
+
+@contextlib.contextmanager
+def span(stage: str, model: str = ""):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - start, model)
+
+
+def mark_handler_start() -> None:
+    """
+    在处理函数入口调用：记录从请求到达到处理函数开始执行之间的排队时间（线程池等待等）。
+    """
+    rt = _timings_var.get()
+    if rt is not None:
+        observe_stage("queue", time.perf_counter() - rt.start)
+
+
+def observe_llm(model: str, endpoint: str, stream: bool, duration: float,
+                ttft: Optional[float] = None, usage: Optional[Dict[str, Any]] = None,
+                outcome: str = "ok") -> None:
+    path = current_path()
+    LLM_ATTEMPTS.inc(model=model, endpoint=endpoint, outcome=outcome)
+    LLM_SECONDS.observe(duration, model=model, endpoint=endpoint, path=path, stream=str(stream).lower())
+    if ttft is not None:
+        LLM_TTFT_SECONDS.observe(ttft, model=model, endpoint=endpoint, path=path)
+    for kind, value in (usage or {}).items():
+        if value:
+            LLM_TOKENS.inc(value, model=model, endpoint=endpoint, kind=kind.removesuffix("_tokens"))
+    completion = (usage or {}).get("completion_tokens")
+    gen_time = duration - (ttft or 0.0)
+    if completion and gen_time > 0:
+        LLM_TOKENS_PER_SECOND.observe(completion / gen_time, model=model, endpoint=endpoint, path=path)
+
+
+class MetricsMiddleware:
+    """
+    纯 ASGI 中间件：记录 HTTP 耗时，建立请求级阶段计时上下文；
+    开启时在响应头附带 Server-Timing（仅包含响应开始前完成的阶段）。
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        wants_timing = SERVER_TIMING_ALWAYS or dict(scope.get("headers") or []).get(b"x-server-timing") == b"1"
+        rt = RequestTimings(scope, wants_timing)
+        token = _timings_var.set(rt)
+        status = {"code": 500}
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                if rt.server_timing:
+                    totals: Dict[str, float] = {}
+                    for stage, seconds in rt.entries:
+                        totals[stage] = totals.get(stage, 0.0) + seconds
+                    totals["total"] = time.perf_counter() - rt.start
+                    value = ", ".join(f"{k};dur={v * 1000:.1f}" for k, v in totals.items())
+                    message["headers"] = list(message.get("headers") or []) + [(b"server-timing", value.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _timings_var.reset(token)
+            HTTP_SECONDS.observe(time.perf_counter() - rt.start, path=rt.path,
+                                 method=scope.get("method", ""), status=status["code"])
@@ -0,0 +1,27 @@
+from typing import Any, Dict
+
+# JSON Schema：用于程序端严格校验（保持不变）。单独成模块，只需要 schema 的地方不必导入 step；step.PLAN_SCHEMA 即此对象
+PLAN_SCHEMA: Dict[str, Any] = {
+    "type": "object",
+    "properties": {
+        "case_name": {"type": "string"},
+        "case_desc": {"type": "string"},
+        "type": {"type": "integer", "enum": [1, 2]},
+        "steps": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "order": {"type": "integer", "minimum": 1},
+                    "action": {"type": "string"},
+                    "tool": {"type": "string"},
+                    "params": {"type": "string"},
+                    "note": {"type": "string"}
+                },
+                "required": ["order", "action", "tool", "params", "note"]
+            },
+            "minItems": 1
+        }
+    },
+    "required": ["case_name", "case_desc", "steps"]
+}
@@ -0,0 +1,173 @@
+import os
+import io
+import json
+import re
+import time
+import uuid
+import random
+import pstats
+import cProfile
+import functools
+import contextvars
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from app.auth import is_admin
+from app.log import request_id_var
+
+# 按需性能剖析：
+# - 单个请求：带 X-Profile: 1 且 X-Admin-Token 正确；
+# - 全局抽样：TESTAGENT_PROFILE_SAMPLE_RATE（0~1），默认 0 关闭。
+# 未启用时被装饰的处理函数只多一次 contextvar 读取。
+# 结果写入 TESTAGENT_PROFILE_DIR，默认为仓库根目录下的 profiles；相对路径按仓库根目录解析（与启动时的工作目录无关）。
+_ROOT = Path(__file__).resolve().parent.parent
+PROFILE_DIR = (_ROOT / os.environ.get("TESTAGENT_PROFILE_DIR", "profiles")).resolve()
+PROFILE_SAMPLE_RATE = float(os.getenv("TESTAGENT_PROFILE_SAMPLE_RATE", "0"))
+PROFILE_MAX_FILES = int(os.getenv("TESTAGENT_PROFILE_MAX_FILES", "200"))
+
+_profile_var: contextvars.ContextVar[bool] = contextvars.ContextVar("profile_request", default=False)
+
+
+def _save(profiler: cProfile.Profile, label: str, wall_seconds: float) -> None:
+    # 文件名用服务端生成的 id，request_id（来自客户端请求头）只写进元数据
+    profile_id = uuid.uuid4().hex
+    PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+    profiler.dump_stats(str(PROFILE_DIR / f"{profile_id}.prof"))
+    meta = {"id": profile_id, "request_id": request_id_var.get(), "handler": label, "ts": time.time(),
+            "wall_ms": round(wall_seconds * 1000, 1)}
+    (PROFILE_DIR / f"{profile_id}.json").write_text(json.dumps(meta, ensure_ascii=False), encoding="utf-8")
+    _prune()
+
+
+def _prune() -> None:
+    metas = sorted(PROFILE_DIR.glob("*.json"), key=lambda p: p.stat().st_mtime)
+    for meta in metas[:max(0, len(metas) - PROFILE_MAX_FILES)]:
+        meta.unlink(missing_ok=True)
+        meta.with_suffix(".prof").unlink(missing_ok=True)
+
+
+class _ActiveProfile:
+    __slots__ = ("profiler", "started", "label", "deferred")
+
+    def __init__(self, label: str):
+        self.profiler = cProfile.Profile()
+        self.started = time.perf_counter()
+        self.label = label
+        self.deferred = False
+
+    def save(self) -> None:
+        _save(self.profiler, self.label, time.perf_counter() - self.started)
+
+
+_active_var: contextvars.ContextVar[Optional[_ActiveProfile]] = contextvars.ContextVar("active_profile", default=None)
+
+
+def profiled(func):
+    """
+    装饰同步处理函数：本请求开启剖析时用 cProfile 覆盖整个处理过程
+    （含 generate_or_edit_full_plan → run_plan_chat → 校验 → 保存）。
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not _profile_var.get():
+            return func(*args, **kwargs)
+        active = _ActiveProfile(func.__qualname__)
+        token = _active_var.set(active)
+        active.profiler.enable()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            active.profiler.disable()
+            _active_var.reset(token)
+            if not active.deferred:
+                active.save()
+    return wrapper
+
+
+def profile_stream(iterator):
+    """
+    流式接口在构造 StreamingResponse 前包一层：剖析延续到生成器的每次迭代，结束时落盘。
+    未开启剖析时原样返回。
+    """
+    active = _active_var.get()
+    if active is None:
+        return iterator
+    active.deferred = True
+    return _profile_iter(iterator, active)
+
+
+def _profile_iter(iterator, active: _ActiveProfile):
+    # 同步生成器由线程池逐次推进，每次迭代都在当前线程上开关剖析器
+    try:
+        while True:
+            active.profiler.enable()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                active.profiler.disable()
+            yield item
+    finally:
+        active.save()
+
+
+class ProfilingMiddleware:
+    """
+    纯 ASGI 中间件：判定本请求是否需要剖析，结果放入 contextvar 供 @profiled 读取。
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        enabled = PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+        if not enabled:
+            headers = dict(scope.get("headers") or [])
+            if headers.get(b"x-profile") == b"1":
+                token = headers.get(b"x-admin-token")
+                enabled = is_admin(token.decode("latin-1") if token else None)
+        if not enabled:
+            await self.app(scope, receive, send)
+            return
+        token = _profile_var.set(True)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _profile_var.reset(token)
+
+
+def list_profiles() -> List[Dict[str, Any]]:
+    if not PROFILE_DIR.exists():
+        return []
+    out = []
+    for meta in PROFILE_DIR.glob("*.json"):
+        try:
+            out.append(json.loads(meta.read_text(encoding="utf-8")))
+        except Exception:
+            continue
+    return sorted(out, key=lambda m: m.get("ts", 0), reverse=True)
+
+
+def profile_path(key: str) -> Optional[Path]:
+    """
+    按剖析 id 查找 .prof 文件；不是 id 时按 request_id 查找该请求最近的一份。
+    """
+    if re.fullmatch(r"[0-9a-f]{32}", key):
+        path = PROFILE_DIR / f"{key}.prof"
+        return path if path.exists() else None
+    for meta in list_profiles():
+        if meta.get("request_id") == key and re.fullmatch(r"[0-9a-f]{32}", str(meta.get("id", ""))):
+            path = PROFILE_DIR / f"{meta['id']}.prof"
+            if path.exists():
+                return path
+    return None
+
+
+def profile_text(path: Path, sort: str = "cumulative", limit: int = 60) -> str:
+    buf = io.StringIO()
+    pstats.Stats(str(path), stream=buf).sort_stats(sort).print_stats(limit)
+    return buf.getvalue()
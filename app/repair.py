@@ -0,0 +1,186 @@
+import re
+import json
+from typing import Any, Dict, List, Tuple
+
+# 模型输出的容错修复：在判定“输出不合格”并整轮重试之前，先尝试把接近合法的输出救回来。
+# 每个修复都有名字，调用方把实际生效的修复记入 trace，便于统计哪些问题最常见。
+
+_THINK_BLOCK_RE = re.compile(r"<think>.*?</think>", re.S | re.I)
+_FENCE_RE = re.compile(r"```[a-zA-Z0-9_-]*\s*\n?(.*?)```", re.S)
+_PY_LITERALS = {"True": "true", "False": "false", "None": "null"}
+
+
+def _strip_think(text: str) -> str:
+    text = _THINK_BLOCK_RE.sub("", text)
+    # 只有结束标签（开头被截掉）时，取其后的内容
+    idx = text.lower().rfind("</think>")
+    return text[idx + len("</think>"):] if idx >= 0 else text
+
+
+def _strip_fence(text: str) -> str:
+    for m in _FENCE_RE.finditer(text):
+        if "{" in m.group(1):
+            return m.group(1)
+    # 只有开头的 ```json（输出被截断）
+    if text.lstrip().startswith("```"):
+        return text.lstrip()[3:].split("\n", 1)[-1]
+    return text
+
+
+def _extract_object(text: str) -> str:
+    """
+    从第一个 { 起按括号配对（跳过字符串内容）截取最外层对象；没有配对的 } 时原样取到末尾。
+    """
+    start = text.find("{")
+    if start < 0:
+        return text
+    depth = 0
+    in_str = escape = False
+    for i in range(start, len(text)):
+        ch = text[i]
+        if in_str:
+            if escape:
+                escape = False
+            elif ch == "\\":
+                escape = True
+            elif ch == '"':
+                in_str = False
+        elif ch == '"':
+            in_str = True
+        elif ch in "{[":
+            depth += 1
+        elif ch in "}]":
+            depth -= 1
+            if depth == 0:
+                return text[start:i + 1]
+    return text[start:]
+
+
+def _fix_syntax(text: str, fired: List[str]) -> str:
+    """
+    字符串之外：去掉 } / ] 前多余的逗号、把 Python 的 True/False/None 换成 JSON 字面量。
+    不补齐被截断的输出：补出来的计划可能恰好通过校验却少了后面的步骤，宁可重试。
+    """
+    out: List[str] = []
+    in_str = escape = False
+    i, n = 0, len(text)
+    while i < n:
+        ch = text[i]
+        if in_str:
+            out.append(ch)
+            if escape:
+                escape = False
+            elif ch == "\\":
+                escape = True
+            elif ch == '"':
+                in_str = False
+            i += 1
+            continue
+        if ch == '"':
+            in_str = True
+        elif ch == ",":
+            j = i + 1
+            while j < n and text[j].isspace():
+                j += 1
+            if j >= n or text[j] in "}]":
+                fired.append("trailing_comma")
+                i += 1
+                continue
+        elif ch.isalpha():
+            j = i
+            while j < n and (text[j].isalnum() or text[j] == "_"):
+                j += 1
+            word = text[i:j]
+            if word in _PY_LITERALS:
+                fired.append("python_literal")
+                word = _PY_LITERALS[word]
+            out.append(word)
+            i = j
+            continue
+        out.append(ch)
+        i += 1
+    return "".join(out)
+
+
+def salvage_json(text: str) -> Tuple[Any, List[str]]:
+    """
+    解析模型输出的 JSON，必要时逐级修复：去 <think> 块 → 去 markdown 代码块 → 截取最外层对象
+    → 放宽控制字符 → 语法修补。返回 (对象, 生效的修复名列表)；都救不回来时抛出原始的解析错误。
+    """
+    try:
+        return json.loads(text), []
+    except ValueError as e:
+        first_err = e
+    fired: List[str] = []
+    for name, fn in (("strip_think", _strip_think), ("strip_fence", _strip_fence),
+                     ("extract_object", _extract_object)):
+        fixed = fn(text)
+        if fixed.strip() != text.strip():
+            fired.append(name)
+            text = fixed
+            try:
+                return json.loads(text), fired
+            except ValueError:
+                pass
+    # 字符串里的裸换行/制表符
+    try:
+        return json.loads(text, strict=False), fired + ["control_chars"]
+    except ValueError:
+        pass
+    syntax: List[str] = []
+    fixed = _fix_syntax(text, syntax)
+    if syntax:
+        try:
+            return json.loads(fixed, strict=False), fired + sorted(set(syntax), key=syntax.index)
+        except ValueError:
+            pass
+    raise first_err
+
+
+def _params_to_str(value: Any) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, list):
+        return " ".join(s for s in (_params_to_str(v) for v in value) if s)
+    if isinstance(value, dict):
+        # 与上下文示例一致的 {"_args": [...]} 直接拼接；其余按 "--键 值" 展开
+        if set(value) == {"_args"}:
+            return _params_to_str(value["_args"])
+        parts = []
+        for k, v in value.items():
+            v = _params_to_str(v)
+            parts.append(f"--{k} {v}" if v else f"--{k}")
+        return " ".join(parts)
+    return str(value)
+
+
+def coerce_plan(plan: Any) -> List[str]:
+    """
+    原地修正常见的类型偏差：params 为数组/对象/数字时转成单一字符串，order 为数字字符串时转成整数。
+    返回生效的修复名列表。
+    """
+    fired: List[str] = []
+    steps = plan.get("steps") if isinstance(plan, dict) else None
+    if not isinstance(steps, list):
+        return fired
+    for s in steps:
+        if not isinstance(s, dict):
+            continue
+        if "params" in s and not isinstance(s["params"], str):
+            s["params"] = _params_to_str(s["params"])
+            fired.append("params_to_string")
+        order = s.get("order")
+        if isinstance(order, str) and order.strip().isdigit():
+            s["order"] = int(order.strip())
+            fired.append("order_to_int")
+    return sorted(set(fired), key=fired.index)
+
+
+def parse_plan(text: str) -> Tuple[Dict[str, Any], List[str]]:
+    """
+    salvage_json + coerce_plan：返回 (计划, 生效的修复名列表)。
+    """
+    data, fired = salvage_json(text)
+    return data, fired + coerce_plan(data)
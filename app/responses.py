@@ -0,0 +1,99 @@
+import os
+import json
+import gzip
+from typing import Any, Dict, Optional
+
+from fastapi import Request, Response
+
+# 可选依赖：orjson 比标准库 json 快一个数量级；brotli 压缩率优于 gzip
+try:
+    import orjson  # type: ignore
+except Exception:  # pragma: no cover
+    orjson = None
+
+try:
+    import brotli  # type: ignore
+except Exception:  # pragma: no cover
+    brotli = None
+
+# 小于该字节数的响应不压缩（压缩头开销 + CPU 不划算）
+COMPRESS_MIN_BYTES = int(os.getenv("TESTAGENT_COMPRESS_MIN_BYTES", "1024"))
+GZIP_LEVEL = int(os.getenv("TESTAGENT_GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("TESTAGENT_BROTLI_QUALITY", "5"))
+
+
+def dumps_bytes(content: Any) -> bytes:
+    """
+    序列化为紧凑 UTF-8 JSON（与 starlette JSONResponse 的格式一致）；orjson 缺失时回退标准库 json。
+    """
+    if orjson is not None:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+
+def _accepted_encodings(accept_encoding: Optional[str]) -> Dict[str, float]:
+    out: Dict[str, float] = {}
+    for part in (accept_encoding or "").split(","):
+        token, _, params = part.strip().partition(";")
+        if not token:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        out[token.strip().lower()] = q
+    return out
+
+
+def accepts_encoding(accept_encoding: Optional[str], encoding: str) -> bool:
+    accepted = _accepted_encodings(accept_encoding)
+    return accepted.get(encoding, accepted.get("*", 0.0)) > 0
+
+
+def choose_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """
+    按 Accept-Encoding 协商压缩算法：br（已安装 brotli 时）优先，其次 gzip。
+    """
+    for enc in ("br", "gzip"):
+        if enc == "br" and brotli is None:
+            continue
+        if accepts_encoding(accept_encoding, enc):
+            return enc
+    return None
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+def plan_json_response(request: Request, content: Any, status_code: int = 200,
+                       headers: Optional[Dict[str, str]] = None) -> Response:
+    """
+    plan 类接口的快速响应路径：
+    - content 已是可直接序列化的 dict（plan 在入库前已校验），不再经过 response_model 二次校验；
+    - 超过 COMPRESS_MIN_BYTES 时按 Accept-Encoding 压缩。
+    """
+    return json_bytes_response(request, dumps_bytes(content), status_code, headers)
+
+
+def json_bytes_response(request: Request, body: bytes, status_code: int = 200,
+                        headers: Optional[Dict[str, str]] = None) -> Response:
+    """
+    已序列化好的 JSON 正文（如缓存的工具注册表）直接按 Accept-Encoding 压缩后返回。
+    """
+    out_headers = dict(headers or {})
+    out_headers["Vary"] = "Accept-Encoding"
+    encoding = choose_encoding(request.headers.get("accept-encoding")) if len(body) >= COMPRESS_MIN_BYTES else None
+    if encoding is not None:
+        body = compress(body, encoding)
+        out_headers["Content-Encoding"] = encoding
+        # 压缩后的表示不再逐字节一致，ETag 降级为弱校验
+        etag = out_headers.get("ETag")
+        if etag and not etag.startswith("W/"):
+            out_headers["ETag"] = "W/" + etag
+    return Response(content=body, status_code=status_code, headers=out_headers, media_type="application/json")
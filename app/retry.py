@@ -0,0 +1,167 @@
+import os
+import json
+import time
+import random
+import email.utils
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+import httpx
+from jsonschema import ValidationError
+
+from app.llm_client import request_timeout
+
+# LLM 调用的统一重试策略：错误分类 + 指数退避（full jitter）+ Retry-After + 整个请求的截止时间。
+#
+# 环境变量：
+#   TESTAGENT_RETRY_BASE_DELAY   退避基数（秒），默认 0.5
+#   TESTAGENT_RETRY_MAX_DELAY    单次退避上限（秒），默认 20
+#   TESTAGENT_LLM_DEADLINE       单个请求内所有尝试的总时限（秒），默认 600
+
+BASE_DELAY = float(os.getenv("TESTAGENT_RETRY_BASE_DELAY", "0.5"))
+MAX_DELAY = float(os.getenv("TESTAGENT_RETRY_MAX_DELAY", "20"))
+DEADLINE_SECONDS = float(os.getenv("TESTAGENT_LLM_DEADLINE", "600"))
+
+# 错误类别
+TRANSIENT = "transient"      # 网络/超时/5xx：退避后重试
+RATE_LIMIT = "rate_limit"    # 429：至少等到 Retry-After
+BAD_OUTPUT = "bad_output"    # 输出不是合法 JSON 或未通过校验：带上错误信息重新提示，不退避
+FATAL = "fatal"              # 鉴权/参数错误/超出截止时间等：重试无意义，立即失败
+
+# 重新提示时回传给模型的上次输出最多保留多少字符
+REPROMPT_OUTPUT_CHARS = 4000
+
+
+class BadOutputError(ValueError):
+    """
+    模型输出无法使用（如内容为空）。
+    """
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+def classify(exc: BaseException) -> str:
+    # SDK 较重，导入推迟到第一次分类（此时客户端已创建，openai 已加载）
+    import openai
+    if isinstance(exc, openai.RateLimitError):
+        return RATE_LIMIT
+    if isinstance(exc, openai.APIConnectionError):  # 含 APITimeoutError
+        return TRANSIENT
+    if isinstance(exc, openai.APIStatusError):
+        status = exc.status_code
+        return TRANSIENT if status in (408, 409) or status >= 500 else FATAL
+    if isinstance(exc, (ValueError, ValidationError)):  # json.JSONDecodeError 是 ValueError 的子类
+        return BAD_OUTPUT
+    return FATAL
+
+
+def retry_after(exc: BaseException) -> Optional[float]:
+    """
+    从响应头读取服务端要求的等待时间：retry-after-ms，或 retry-after（秒数或 HTTP 日期）。
+    """
+    response = getattr(exc, "response", None)
+    if not isinstance(response, httpx.Response):
+        return None
+    headers = response.headers
+    try:
+        if "retry-after-ms" in headers:
+            return float(headers["retry-after-ms"]) / 1000
+    except ValueError:
+        pass
+    raw = headers.get("retry-after")
+    if not raw:
+        return None
+    try:
+        return max(0.0, float(raw))
+    except ValueError:
+        pass
+    try:
+        parsed = email.utils.parsedate_to_datetime(raw)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, parsed.timestamp() - time.time())
+
+
+class Deadline:
+    """
+    请求级截止时间：所有尝试与退避共享。
+    """
+
+    def __init__(self, seconds: float = DEADLINE_SECONDS):
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def check(self) -> None:
+        if self.expired():
+            raise DeadlineExceeded("已超过请求截止时间")
+
+    def timeout(self, stream: bool) -> httpx.Timeout:
+        """
+        单次调用的超时，读超时不超过剩余时间。
+        """
+        base = request_timeout(stream)
+        remaining = max(0.1, self.remaining())
+        return httpx.Timeout(connect=min(base.connect, remaining), read=min(base.read, remaining),
+                             write=min(base.write, remaining), pool=min(base.pool, remaining))
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    max_attempts: int = 3
+    base_delay: float = BASE_DELAY
+    max_delay: float = MAX_DELAY
+
+    def backoff(self, attempt: int) -> float:
+        # full jitter：在 [0, min(上限, 基数 × 2^(n-1))] 内均匀取值，避免多个请求同时重试
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+    def next_delay(self, attempt: int, kind: str, exc: BaseException, deadline: Deadline) -> Optional[float]:
+        """
+        第 attempt 次尝试失败后应等待的秒数；返回 None 表示不再重试
+        （致命错误、次数用尽，或等待后已没有时间完成下一次尝试）。
+        """
+        if kind == FATAL or attempt >= self.max_attempts:
+            return None
+        if kind == BAD_OUTPUT:
+            delay = 0.0
+        elif kind == RATE_LIMIT:
+            delay = max(retry_after(exc) or 0.0, self.backoff(attempt))
+        else:
+            delay = self.backoff(attempt)
+        if delay >= deadline.remaining():
+            return None
+        return delay
+
+
+def reprompt_messages(messages: List[Dict[str, str]], output: Optional[str],
+                      error: BaseException) -> List[Dict[str, str]]:
+    """
+    输出不合格时的下一轮消息：原始消息 + 上次输出 + 具体错误，要求模型修正而不是重新抽样。
+    每次都基于原始消息构造，不会越重试越长。
+    """
+    out = list(messages)
+    if output:
+        out.append({"role": "assistant", "content": output[:REPROMPT_OUTPUT_CHARS]})
+    if isinstance(error, ValidationError):
+        path = "/".join(str(p) for p in error.absolute_path) or "(根)"
+        detail = f"{path}: {error.message}"
+    elif isinstance(error, json.JSONDecodeError):
+        detail = f"JSON 解析失败（第 {error.lineno} 行第 {error.colno} 列）：{error.msg}"
+    else:
+        detail = str(error)
+    out.append({"role": "user", "content": f"上一次输出未通过校验：{detail}\n请修正上述问题，仅输出完整的计划 JSON。"})
+    return out
+
+
+def describe(exc: BaseException) -> Dict[str, Any]:
+    """
+    写入 trace 的错误摘要。
+    """
+    return {"error": f"{type(exc).__name__}: {exc}", "kind": classify(exc)}
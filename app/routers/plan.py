@@ -1,19 +1,37 @@
-from fastapi import APIRouter, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
 import json
-from fastapi.responses import StreamingResponse
+import asyncio
+import time
+import logging
+from fastapi.responses import StreamingResponse, PlainTextResponse, FileResponse
 from pydantic import BaseModel, ConfigDict, ValidationError
-from typing import Optional
+from typing import Optional, Dict, Any
 
-from step import PLAN_SCHEMA
+from app.plan_schema import PLAN_SCHEMA
 
 from jsonschema import validate, ValidationError
 from app.state import EditRequest, PlanResponse, PlanResponseWithState, PlanStatus
 from app.storage import load_plan, save_plan_and_bump, load_state, set_status, clear_all
+from app.storage import plan_etag, current_revision, wait_for_change
+from app.responses import plan_json_response, json_bytes_response, accepts_encoding
+from app.thinking import save_thinking, compressed_path, load_thinking_bytes, parse_range
+from app.journal import journal
+from app.log import request_id_var, session_var
+from app import metrics
+from app.metrics import span, mark_handler_start, PLAN_REPAIRS
+from app.auth import require_admin
+from app import context_store, context_upload
+from app.llm_client import llm_clients
+from app.llm_pool import llm_pool
+from app.repair import parse_plan
+from app.speculative import failure_stats
+from app.retry import RetryPolicy, Deadline, BadOutputError, classify, describe, reprompt_messages, BAD_OUTPUT
+from app.profiling import profiled, profile_stream, list_profiles, profile_path, profile_text
 from app.llm import generate_or_edit_full_plan, DEFAULT_MODEL, DEFAULT_MAX_RETRIES
 import step
-from step import client as llm_client, CONTEXT_JSON
-from utils import validate_plan
+from step import plan_validator, tool_registry
 router = APIRouter()
+logger = logging.getLogger(__name__)
 
 class FallbackPlan(BaseModel):
     model_config = ConfigDict(extra="allow")  # 允许任意字段
@@ -22,12 +40,41 @@ class FallbackPlan(BaseModel):
 def health_check():
     return {"status": "ok"}
 
+@router.get("/metrics", response_class=PlainTextResponse)
+def prometheus_metrics():
+    return PlainTextResponse(metrics.render_latest(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+def _record_generation(request: Request, payload: EditRequest, mode: str, trace: Dict[str, Any],
+                       started: float, plan: Optional[dict] = None,
+                       validation: Optional[Dict[str, Any]] = None, error: Optional[str] = None,
+                       context_version: Optional[str] = None):
+    """
+    写一条生成日志（异步落盘，见 app.journal）；context_version 默认为本请求固定的上下文版本。
+    """
+    journal.record({
+        "request_id": request_id_var.get(),
+        "session": session_var.get(),
+        "route": request.url.path,
+        "mode": mode,
+        "case_name": payload.case_name or (plan or {}).get("case_name") or None,
+        "request": payload.model_dump(),
+        "context_version": context_version or context_store.current().version,
+        **trace,
+        "total_ms": round((time.perf_counter() - started) * 1000, 1),
+        "validation": validation,
+        "plan": plan,
+        "error": error,
+    })
+
 @router.post("/plan", response_model=PlanResponse)
-def create_or_edit_plan(payload: EditRequest):
+@profiled
+def create_or_edit_plan(payload: EditRequest, request: Request,
+                        inline_thinking: bool = Query(default=False, description="兼容旧客户端：在响应中内联完整 thinking")):
     """
     统一入口：状态 EMPTY → 创建；否则 → 修改。
     仅返回 plan（不返回 meta/patch/action）。
     """
+    mark_handler_start()
     state = load_state()
     current = load_plan()
     '''
@@ -35,26 +82,244 @@ def create_or_edit_plan(payload: EditRequest):
         # 已锁定需先解锁
         raise HTTPException(status_code=423, detail="Plan is ACCEPTED (locked). Use /plan/unlock to modify.")
     '''
-    new_plan,thinking= generate_or_edit_full_plan(current_plan=current,case_desc=payload.case_desc)
-    # 校验
-    validate_plan(new_plan)
+    mode = "create" if current is None else "edit"
+    trace: Dict[str, Any] = {}
+    started = time.perf_counter()
+    # 生成、校验、日志固定使用同一个上下文版本（处理中替换上下文不影响本请求）
+    with context_store.pinned():
+        try:
+            new_plan,thinking= generate_or_edit_full_plan(current_plan=current,case_desc=payload.case_desc,trace=trace)
+        except Exception as e:
+            _record_generation(request, payload, mode, trace, started, error=str(e))
+            raise
+        # 校验（schema / order / 工具白名单 / 参数键）；计划仍保存为草稿，问题随响应返回
+        with span("validate"):
+            validation = plan_validator().validate(new_plan).to_dict()
+        if not validation["ok"]:
+            logger.warning("计划未通过语义校验", extra={"errors": validation["errors"]})
+        _record_generation(request, payload, mode, trace, started, plan=new_plan, validation=validation)
 
+    # 思考过程单独压缩存储，响应中只带引用
+    with span("thinking.save"):
+        thinking_ref = save_thinking(thinking)
     # 保存 + 版本自增 + 状态置 DRAFT
     try:
-        save_plan_and_bump(plan=new_plan, status=PlanStatus.DRAFT, base_version=payload.base_version)
+        save_plan_and_bump(plan=new_plan, status=PlanStatus.DRAFT, base_version=payload.base_version,
+                           thinking_id=thinking_ref.id if thinking_ref else None)
     except ValueError as e:
         raise HTTPException(status_code=409, detail=str(e))  # 版本冲突（If-Match 失败）
 
-    return {"plan":new_plan,"thinking":thinking}
+    return plan_json_response(request, {
+        "plan": new_plan,
+        "thinking": thinking if inline_thinking else None,
+        "thinking_ref": thinking_ref.model_dump() if thinking_ref else None,
+        "validation": validation,
+    })
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # 弱比较：忽略 W/ 前缀
+    candidates = [t.strip().removeprefix("W/") for t in if_none_match.split(",")]
+    return etag in candidates
 
 @router.get("/plan", response_model=PlanResponse | PlanResponseWithState)
-def get_plan(include_state: bool = Query(default=False, description="调试用途：附带状态")):
+def get_plan(request: Request,
+             include_state: bool = Query(default=False, description="调试用途：附带状态")):
+    """
+    支持 If-None-Match：计划未变化时直接返回 304，不读取也不序列化计划。
+    """
+    mark_handler_start()
+    etag = plan_etag(include_state=include_state)
+    if etag is None:
+        raise HTTPException(status_code=404, detail="No current plan")
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={"ETag": etag})
     plan = load_plan()
     if plan is None:
         raise HTTPException(status_code=404, detail="No current plan")
+    headers = {"ETag": etag}
     if include_state:
-        return PlanResponseWithState(plan=plan, state=load_state())
-    return PlanResponse(plan=plan)
+        content = {"plan": plan, "state": load_state().model_dump(mode="json")}
+    else:
+        content = {"plan": plan, "thinking": None}
+    return plan_json_response(request, content, headers=headers)
+
+@router.get("/plan/watch")
+async def watch_plan(request: Request,
+                     heartbeat: float = Query(default=15.0, gt=0, le=300, description="心跳间隔（秒）")):
+    """
+    SSE 变更通知：仅在 save_plan_and_bump / set_status / clear_all 提交变更后推送 change 事件，
+    空闲时只按心跳间隔发送注释行。客户端收到 change 后再带 If-None-Match 拉取 GET /plan。
+    多 worker 部署下其他进程的提交会在下一次心跳时通过 ETag 比对发现。
+    """
+    async def event_stream():
+        last_etag = plan_etag(include_state=True)
+        revision = current_revision()
+        yield f"event: ready\ndata: {json.dumps({'etag': last_etag})}\n\n"
+        while not await request.is_disconnected():
+            revision = await wait_for_change(revision, heartbeat)
+            etag = plan_etag(include_state=True)
+            if etag == last_etag:
+                yield ": ping\n\n"
+                continue
+            last_etag = etag
+            state = load_state()
+            payload = {"etag": etag, "status": state.status.value, "updated_at": state.updated_at.isoformat()}
+            yield f"event: change\ndata: {json.dumps(payload)}\n\n"
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache"})
+
+def _thinking_response(request: Request, thinking_id: Optional[str]) -> Response:
+    path = compressed_path(thinking_id) if thinking_id else None
+    if path is None:
+        raise HTTPException(status_code=404, detail="Thinking not found")
+    etag = f'"{thinking_id}"'
+    headers = {
+        "ETag": etag,
+        "Accept-Ranges": "bytes",
+        "Vary": "Accept-Encoding",
+        # 内容寻址，永不变化
+        "Cache-Control": "public, max-age=31536000, immutable",
+    }
+    media_type = "text/plain; charset=utf-8"
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    range_header = request.headers.get("range")
+    if range_header is None and accepts_encoding(request.headers.get("accept-encoding"), "gzip"):
+        # 直接下发落盘的 gzip 字节，无需解压再压缩
+        return Response(path.read_bytes(), headers={**headers, "Content-Encoding": "gzip"}, media_type=media_type)
+    data = load_thinking_bytes(thinking_id)
+    if range_header is None:
+        return Response(data, headers=headers, media_type=media_type)
+    rng = parse_range(range_header, len(data))
+    if rng is None:
+        return Response(status_code=416, headers={"Content-Range": f"bytes */{len(data)}"})
+    start, end = rng
+    return Response(data[start:end + 1], status_code=206, media_type=media_type,
+                    headers={**headers, "Content-Range": f"bytes {start}-{end}/{len(data)}"})
+
+@router.get("/plan/thinking")
+def get_current_thinking(request: Request):
+    """
+    当前版本计划对应的思考过程（支持 Range）。
+    """
+    return _thinking_response(request, load_state().thinking_id)
+
+@router.get("/plan/thinking/{thinking_id}")
+def get_thinking(thinking_id: str, request: Request):
+    """
+    按引用获取思考过程（支持 Range / If-None-Match）。
+    """
+    return _thinking_response(request, thinking_id)
+
+@router.get("/generations", dependencies=[Depends(require_admin)])
+def list_generations(start: Optional[float] = Query(default=None, description="起始时间（epoch 秒）"),
+                     end: Optional[float] = Query(default=None, description="结束时间（epoch 秒）"),
+                     case_name: Optional[str] = None,
+                     session: Optional[str] = None,
+                     limit: int = Query(default=20, ge=1, le=500)):
+    """
+    按时间范围 / case_name / session 查询生成日志（走侧车索引）。记录含完整请求与计划，需要管理员令牌。
+    """
+    return {"items": journal.query(start=start, end=end, case_name=case_name, session=session, limit=limit)}
+
+@router.get("/tools")
+def list_tools(request: Request):
+    """
+    结构化工具注册表（参数键、取值类型/示例、返回码、触发说法、用例中的写法）。
+    ETag 即上下文版本，上下文未变化时带 If-None-Match 直接 304。
+    """
+    registry = tool_registry()
+    etag = registry.etag
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    return json_bytes_response(request, registry.body, headers={"ETag": etag})
+
+@router.get("/tools/{name}")
+def get_tool(name: str, request: Request):
+    registry = tool_registry()
+    sig = registry.get(name)
+    if sig is None:
+        raise HTTPException(status_code=404, detail=f"未知工具：{name}")
+    etag = registry.etag
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    return plan_json_response(request, sig.to_dict(), headers={"ETag": etag})
+
+@router.get("/admin/profiles", dependencies=[Depends(require_admin)])
+def get_profiles():
+    """
+    已采集的剖析记录（按时间倒序）。
+    """
+    return {"items": list_profiles()}
+
+@router.get("/admin/profiles/{profile_id}", dependencies=[Depends(require_admin)])
+def download_profile(profile_id: str,
+                     format: str = Query(default="prof", pattern="^(prof|text)$",
+                                         description="prof：pstats 二进制（snakeviz 等可视化）；text：文本摘要"),
+                     sort: str = Query(default="cumulative")):
+    """
+    下载剖析结果：profile_id 为列表中的 id，也可直接传请求的 X-Request-ID。
+    """
+    path = profile_path(profile_id)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    if format == "text":
+        return PlainTextResponse(profile_text(path, sort=sort))
+    return FileResponse(path, media_type="application/octet-stream", filename=path.name)
+
+@router.get("/admin/llm", dependencies=[Depends(require_admin)])
+def llm_connection_stats():
+    """
+    各 LLM 端点的连接复用统计与健康状态（EWMA 延迟、错误率、熔断），以及推测生成的各模型不合格率。
+    """
+    health = {h["endpoint"]: h for h in llm_pool.stats()}
+    return {"endpoints": [{**s, **health.get(s["endpoint"], {})} for s in llm_clients.stats()],
+            "speculative": failure_stats.snapshot()}
+
+@router.get("/admin/context", dependencies=[Depends(require_admin)])
+def context_info():
+    """
+    当前规划上下文的版本、来源与加载时间。
+    """
+    return context_store.latest().info()
+
+@router.post("/admin/context/excel", dependencies=[Depends(require_admin)])
+async def upload_context_excel(request: Request,
+                               config: Optional[str] = Query(default=None, description="转换配置（YAML/JSON 文本），逐项覆盖默认配置"),
+                               sheet: Optional[str] = Query(default=None, description="用例表：名称、序号、通配或 all"),
+                               tools_sheet: Optional[str] = Query(default=None, description="工具表；不给出时沿用当前 tools"),
+                               tool_name_col: Optional[str] = Query(default=None, description="工具表中的工具名列，默认第一列"),
+                               dry_run: bool = Query(default=False, description="只转换与检查，不替换")):
+    """
+    上传用例 Excel（请求体为 xlsx 原始字节），在工作进程中转换、检查后原子替换规划上下文；
+    替换时仍在处理的请求用旧版本完成。响应给出新旧版本、用例/工具数、警告与各阶段耗时。
+    """
+    limit = int(context_upload.UPLOAD_MAX_MB * 1024 * 1024)
+    length = request.headers.get("content-length")
+    if length and length.isdigit() and int(length) > limit:
+        raise HTTPException(status_code=413, detail=f"文件超过 {context_upload.UPLOAD_MAX_MB:g}MB")
+    started = time.perf_counter()
+    data = await request.body()
+    if len(data) > limit:
+        raise HTTPException(status_code=413, detail=f"文件超过 {context_upload.UPLOAD_MAX_MB:g}MB")
+    if not data:
+        raise HTTPException(status_code=400, detail="请求体为空（应为 xlsx 文件内容）")
+    received_ms = round((time.perf_counter() - started) * 1000, 1)
+    source = f"upload:{request.headers.get('x-filename') or 'workbook.xlsx'}"
+    try:
+        result = await asyncio.to_thread(context_upload.update_from_excel, data, config, sheet, tools_sheet,
+                                         tool_name_col, source, dry_run)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    result["timing_ms"] = {"receive": received_ms, **result["timing_ms"]}
+    logger.info("上下文已%s：%s → %s（%d 个用例）", "检查" if dry_run else "替换",
+                result["previous_version"], result["version"], result["cases"], extra={"timing_ms": result["timing_ms"]})
+    return result
 
 @router.post("/plan/accept")
 def accept_plan():
@@ -90,7 +355,9 @@ def clear_plan():
     return {"ok": True, "status": "EMPTY"}
 
 @router.post("/plan_stream")
-def create_or_edit_plan(payload: EditRequest):
+@profiled
+def create_or_edit_plan(payload: EditRequest, request: Request,
+                        inline_thinking: bool = Query(default=False, description="兼容旧客户端：结束时再输出一次完整 thinking")):
     """
     统一入口（流式）：
     - 状态 EMPTY → 走“生成计划”提示词
@@ -98,13 +365,18 @@ def create_or_edit_plan(payload: EditRequest):
     以 text/event-stream 流式返回模型输出的 JSON 文本；
     完成后解析/校验并保存，最后输出一个保存完成的事件。
     """
+    mark_handler_start()
     state = load_state()
     current = load_plan()
 
+    started = time.perf_counter()
+    # 流在线程池中逐段执行，不依赖 contextvar：在入口处取定上下文版本，整个流显式使用它
+    ctx = context_store.current()
+
     def event_stream():
         model = DEFAULT_MODEL
         max_retries = DEFAULT_MAX_RETRIES
-        user_context = "【上下文JSON】\n" + CONTEXT_JSON
+        user_context = step.context_prompt(ctx=ctx)
         attempt_err: Exception | None = None
 
         # 区分新建/编辑，准备 messages 与系统提示词
@@ -199,73 +471,131 @@ def create_or_edit_plan(payload: EditRequest):
             ]
             editor_mode = True
 
-        # 流式调用 + 累积文本
+        # 流式调用 + 累积文本（重试策略见 app.retry；JSON 解析失败时带上错误重新提示）
         full_txt = ""
         think_full_txt = ""
         yield f"event: start\n\n"
+        trace: Dict[str, Any] = {"model": model, "endpoint": None, "attempts": [], "usage": {}}
+        outcome: Dict[str, Any] = {}
+        policy = RetryPolicy(max_attempts=max_retries)
+        deadline = Deadline()
+        attempt_messages = messages
+        try:
+            for attempt in range(1, max_retries + 1):
+                # 每次尝试重新累积，避免上一次的残缺输出混进来
+                full_txt = ""
+                think_full_txt = ""
+                attempt_started = time.perf_counter()
+                attempt_info: Dict[str, Any] = {"attempt": attempt}
+                trace["attempts"].append(attempt_info)
+                try:
+                    deadline.check()
+                    with llm_pool.stream(
+                        model=model,
+                        messages=attempt_messages,
+                        temperature=0,
+                        stream_options={"include_usage": True},
+                        timeout=deadline.timeout(stream=True),
+                    ) as stream_obj:
+                        attempt_info["endpoint"] = stream_obj.endpoint.name
+                        trace["endpoint"] = stream_obj.endpoint.base_url
+                        for chunk in stream_obj:
+                            deadline.check()
+                            # include_usage：最后一个 chunk 携带 usage 且 choices 为空
+                            if getattr(chunk, "usage", None) is not None:
+                                attempt_info["usage"] = step._usage_dict(chunk)
+                            try:
+                                choice0 = chunk.choices[0]
+                            except Exception:
+                                continue
+                            delta = getattr(choice0, "delta", None)
+                            if delta is None:
+                                continue
+                            piece = getattr(delta, "content", None)
+                            think_piece = getattr(delta, "reasoning_content", None)
+                            if piece:
+                                full_txt += piece
+                                # 以 SSE 的 data 行输出片段
+                                # yield f"data: {piece}\n\n"
+                            if logger.isEnabledFor(logging.DEBUG):
+                                logger.debug("stream chunk", extra={"sample": "stream_chunk", "model": model,
+                                                                    "attempt": attempt,
+                                                                    "chars": len(piece or "") + len(think_piece or "")})
+                            if (piece or think_piece) and "ttft_ms" not in attempt_info:
+                                attempt_info["ttft_ms"] = round((time.perf_counter() - attempt_started) * 1000, 1)
+                            if think_piece:
+                                # thinking_buf.append(think_piece)
+                                think_full_txt += think_piece
+                                 # 以 SSE 的 data 行输出片段
+                                yield f"thinking: {think_piece}"
+                    attempt_info["duration_ms"] = round((time.perf_counter() - attempt_started) * 1000, 1)
+                    for k, v in attempt_info.get("usage", {}).items():
+                        if v is not None:
+                            trace["usage"][k] = trace["usage"].get(k, 0) + v
+                    if not full_txt:
+                        raise BadOutputError("模型输出为空")
+                    with span("parse", model):
+                        data, repairs = parse_plan(full_txt)
+                    for name in repairs:
+                        PLAN_REPAIRS.inc(model=model, repair=name)
+                    step.autofix(data, model, repairs, ctx=ctx)
+                    if repairs:
+                        attempt_info["repairs"] = repairs
+                    attempt_err = None
+                    break
+                except Exception as e:
+                    attempt_info.setdefault("duration_ms", round((time.perf_counter() - attempt_started) * 1000, 1))
+                    attempt_info.update(describe(e))
+                    attempt_err = e
+                    kind = classify(e)
+                    if kind == BAD_OUTPUT:
+                        attempt_info["output"] = full_txt
+                    logger.warning("流式生成第 %d/%d 次失败（%s）：%s", attempt, max_retries, kind, e,
+                                   extra={"model": model, "attempt": attempt})
+                    delay = policy.next_delay(attempt, kind, e, deadline)
+                    if delay is None:
+                        break
+                    if kind == BAD_OUTPUT:
+                        attempt_messages = reprompt_messages(messages, full_txt, e)
+                    # 向客户端报告重试，但不中断
+                    yield f"event: retry 第 {attempt}/{max_retries} 次失败：{str(e)}\n\n"
+                    time.sleep(delay)
+            if attempt_err is not None:
+                # 全部失败
+                outcome["error"] = f"重试后仍失败：{attempt_err}"
+                yield f"event: error 重试后仍失败：{str(attempt_err)}\n\n"
+                return
 
-        for attempt in range(1, max_retries + 1):
+            # 校验与修复
+            outcome["plan"] = data
+            with span("validate", model):
+                report = plan_validator(ctx).validate(data)
+            outcome["validation"] = report.to_dict()
+            if not report.ok:
+                yield f"event: warn 计划校验警告/错误：{report.summary()}\n\n"
+            # 保存（思考过程单独存储并关联到本版本）
+            with span("thinking.save"):
+                thinking_ref = save_thinking(think_full_txt)
             try:
-                with llm_client.chat.completions.create(
-                    model=model,
-                    messages=messages,
-                    temperature=0,
-                    stream=True,
-                ) as stream_obj:
-                    for chunk in stream_obj:
-                        try:
-                            choice0 = chunk.choices[0]
-                        except Exception:
-                            continue
-                        delta = getattr(choice0, "delta", None)
-                        if delta is None:
-                            continue
-                        piece = getattr(delta, "content", None)
-                        think_piece = getattr(delta, "reasoning_content", None)
-                        if piece:
-                            full_txt += piece
-                            # 以 SSE 的 data 行输出片段
-                            # yield f"data: {piece}\n\n"
-                        if think_piece:
-                            # thinking_buf.append(think_piece)
-                            think_full_txt += think_piece
-                             # 以 SSE 的 data 行输出片段
-                            yield f"thinking: {think_piece}"
-                attempt_err = None
-                break
-            except Exception as e:
-                attempt_err = e
-                # 向客户端报告重试，但不中断
-                yield f"event: retry 第 {attempt}/{max_retries} 次失败：{str(e)}\n\n"
-        if attempt_err is not None:
-            # 全部失败
-            yield f"event: error 重试后仍失败：{str(attempt_err)}\n\n"
-            return
-
-        # 尝试解析 JSON
-        try:
-            data = json.loads(full_txt)
-        except Exception:
-            yield f"event: error JSON解析失败：{str(e)}\n\n"
-            return
+                save_plan_and_bump(plan=data, status=PlanStatus.DRAFT, base_version=payload.base_version,
+                                   thinking_id=thinking_ref.id if thinking_ref else None)
+                yield "event: saved 计划已保存为DRAFT\n\n"
+            except ValueError as e:
+                outcome["error"] = f"保存失败（版本冲突）：{e}"
+                yield f"event: error 保存失败（版本冲突）：{str(e)}\n\n"
+                return
+            # 输出最终结果
+            if data:
+                yield f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+                # 片段已逐条推送过，默认只给引用；inline_thinking 时保持旧行为
+                if inline_thinking:
+                    yield f"think: {think_full_txt}\n\n"
+                elif thinking_ref is not None:
+                    yield f"think_ref: {thinking_ref.model_dump_json()}\n\n"
+            yield "event: end\n"
+        finally:
+            # 生成日志：包括中途失败与客户端断开
+            _record_generation(request, payload, "create" if current is None else "edit", trace, started,
+                               context_version=ctx.version, **outcome)
 
-        # 校验与修复
-        try:
-            validate_plan(data)
-        except Exception as e:
-            yield f"event: warn 计划校验警告/错误：{str(e)}\n\n"
-        # 保存
-        try:
-            save_plan_and_bump(plan=data, status=PlanStatus.DRAFT, base_version=payload.base_version)
-            yield "event: saved 计划已保存为DRAFT\n\n"
-        except ValueError as e:
-            yield f"event: error 保存失败（版本冲突）：{str(e)}\n\n"
-            return
-        # 输出最终结果
-        if data:
-            yield f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
-            # 输出thinking（如有）
-            yield f"think: {think_full_txt}\n\n"
-        yield "event: end\n"
-
-    return StreamingResponse(event_stream(), media_type="text/event-stream")
+    return StreamingResponse(profile_stream(event_stream()), media_type="text/event-stream")
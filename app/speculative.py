@@ -0,0 +1,193 @@
+import os
+import math
+import time
+import queue
+import logging
+import threading
+import contextvars
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+from app.llm_pool import llm_pool
+from app.retry import Deadline, DeadlineExceeded, BAD_OUTPUT, classify, describe
+
+logger = logging.getLogger(__name__)
+
+# 推测式并发生成：同时发起 N 个候选，边完成边校验，取第一个合格的并取消其余候选。
+# N 按各模型观测到的输出不合格率自适应：取使“N 个全部不合格”的概率不超过目标值的最小 N。
+#
+# 环境变量：
+#   TESTAGENT_SPECULATIVE             1 开启（默认关闭，仍走顺序重试）
+#   TESTAGENT_SPECULATIVE_MIN / _MAX  候选数上下限，默认 1 / 3
+#   TESTAGENT_SPECULATIVE_TARGET      一轮候选全部不合格的目标概率，默认 0.05
+#   TESTAGENT_SPECULATIVE_PRIOR       尚无样本时假定的不合格率，默认 0.3
+#   TESTAGENT_SPECULATIVE_TEMP_STEP   第 i 个候选的温度为 i × 该值（第 0 个保持 0），默认 0.1
+
+SPECULATIVE = os.getenv("TESTAGENT_SPECULATIVE", "0") == "1"
+SPEC_MIN = int(os.getenv("TESTAGENT_SPECULATIVE_MIN", "1"))
+SPEC_MAX = int(os.getenv("TESTAGENT_SPECULATIVE_MAX", "3"))
+SPEC_TARGET = float(os.getenv("TESTAGENT_SPECULATIVE_TARGET", "0.05"))
+SPEC_PRIOR = float(os.getenv("TESTAGENT_SPECULATIVE_PRIOR", "0.3"))
+SPEC_TEMP_STEP = float(os.getenv("TESTAGENT_SPECULATIVE_TEMP_STEP", "0.1"))
+SPEC_EWMA_ALPHA = 0.1
+
+
+class FailureStats:
+    """
+    按模型统计单个候选不合格（解析/校验失败或用了白名单外的工具）的 EWMA 比例。
+    网络/限流等端点错误与输出质量无关，不计入。
+    """
+
+    def __init__(self, prior: float = SPEC_PRIOR):
+        self.prior = prior
+        self._rates: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def record(self, model: str, failed: bool) -> None:
+        with self._lock:
+            rate = self._rates.get(model, self.prior)
+            self._rates[model] = SPEC_EWMA_ALPHA * float(failed) + (1 - SPEC_EWMA_ALPHA) * rate
+
+    def rate(self, model: str) -> float:
+        with self._lock:
+            return self._rates.get(model, self.prior)
+
+    def candidates(self, model: str) -> int:
+        p = self.rate(model)
+        if p <= 0:
+            n = SPEC_MIN
+        elif p >= 1:
+            n = SPEC_MAX
+        else:
+            n = math.ceil(math.log(SPEC_TARGET) / math.log(p))
+        return max(SPEC_MIN, min(SPEC_MAX, n))
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            models = list(self._rates)
+        return {m: {"failure_rate": round(self.rate(m), 4), "candidates": self.candidates(m)} for m in models}
+
+
+failure_stats = FailureStats()
+
+
+def candidate_params(index: int) -> Dict[str, Any]:
+    """
+    第 index 个候选的采样参数：第 0 个与顺序模式一致（温度 0），其余略微升温并换 seed 以拉开差异。
+    """
+    return {"temperature": round(index * SPEC_TEMP_STEP, 3), "seed": index}
+
+
+@dataclass
+class CandidateRound:
+    plan: Optional[Dict[str, Any]] = None
+    thinking: Optional[str] = None
+    endpoint: Optional[str] = None
+    attempts: List[Dict[str, Any]] = field(default_factory=list)
+    usage: Dict[str, int] = field(default_factory=dict)
+    # 全部不合格时：用于决定是否重试的错误，以及可用于重新提示的那份输出
+    error: Optional[BaseException] = None
+    bad_output: Optional[str] = None
+
+
+def run_candidates(messages: List[Dict[str, str]], model: str, n: int,
+                   check: Callable[[str, List[str]], Dict[str, Any]],
+                   preferred: Callable[[Dict[str, Any]], bool],
+                   deadline: Deadline) -> CandidateRound:
+    """
+    并发生成 n 个候选（流式，便于随时关闭）。check(输出, repairs) 负责解析+校验，不合格时抛异常，
+    生效的容错修复追加到 repairs。preferred 为 False 的合格候选（如含白名单外工具）只作后备：若所有候选都结束仍没有更好的才采用。
+    """
+    results: "queue.Queue[Dict[str, Any]]" = queue.Queue()
+    cancelled = threading.Event()
+    out = CandidateRound()
+
+    def run(index: int):
+        started = time.perf_counter()
+        info: Dict[str, Any] = {"candidate": index, **candidate_params(index)}
+        txt, think = "", ""
+        result: Dict[str, Any] = {"info": info}
+        try:
+            with llm_pool.stream(model=model, messages=messages, stream_options={"include_usage": True},
+                                 timeout=deadline.timeout(stream=True), **candidate_params(index)) as stream:
+                info["endpoint"] = stream.endpoint.name
+                result["base_url"] = stream.endpoint.base_url
+                for chunk in stream:
+                    if cancelled.is_set():
+                        info["cancelled"] = True
+                        break
+                    deadline.check()
+                    usage = getattr(chunk, "usage", None)
+                    if usage is not None:
+                        result["usage"] = {"prompt_tokens": getattr(usage, "prompt_tokens", None),
+                                           "completion_tokens": getattr(usage, "completion_tokens", None)}
+                    choices = getattr(chunk, "choices", None) or []
+                    delta = getattr(choices[0], "delta", None) if choices else None
+                    if delta is None:
+                        continue
+                    txt += getattr(delta, "content", None) or ""
+                    think += getattr(delta, "reasoning_content", None) or ""
+            if not info.get("cancelled"):
+                repairs: List[str] = []
+                try:
+                    result["plan"] = check(txt, repairs)
+                finally:
+                    if repairs:
+                        info["repairs"] = repairs
+                result["thinking"] = think or None
+        except BaseException as e:
+            result["error"] = e
+            info.update(describe(e))
+        info["duration_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        result["output"] = txt
+        results.put(result)
+
+    for i in range(n):
+        ctx = contextvars.copy_context()
+        threading.Thread(target=ctx.run, args=(run, i), daemon=True, name=f"plan-candidate-{i}").start()
+
+    fallback: Optional[Dict[str, Any]] = None
+    for _ in range(n):
+        try:
+            # 候选线程自身受截止时间约束，这里多留一点余量
+            result = results.get(timeout=deadline.remaining() + 5)
+        except queue.Empty:
+            cancelled.set()
+            out.error = DeadlineExceeded("候选生成超过请求截止时间")
+            break
+        info = result["info"]
+        out.attempts.append(info)
+        for k, v in (result.get("usage") or {}).items():
+            if v is not None:
+                out.usage[k] = out.usage.get(k, 0) + v
+        if info.get("cancelled"):
+            continue
+        err = result.get("error")
+        if err is not None:
+            if classify(err) == BAD_OUTPUT:
+                failure_stats.record(model, True)
+                info["output"] = result["output"]
+                # 优先保留不合格输出及其错误，下一轮据此重新提示
+                if out.bad_output is None:
+                    out.error, out.bad_output = err, result["output"]
+            elif out.error is None:
+                out.error = err
+            continue
+        ok = preferred(result["plan"])
+        failure_stats.record(model, not ok)
+        info["preferred"] = ok
+        if ok:
+            cancelled.set()
+            fallback = result
+            break
+        if fallback is None:
+            fallback = result
+
+    if fallback is not None:
+        cancelled.set()
+        out.plan, out.thinking = fallback["plan"], fallback["thinking"]
+        out.endpoint = fallback.get("base_url")
+        out.error = out.bad_output = None
+        logger.info("推测生成采用候选 %d/%d", fallback["info"]["candidate"] + 1, n,
+                    extra={"model": model, "preferred": fallback["info"].get("preferred")})
+    return out
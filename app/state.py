@@ -14,6 +14,9 @@ class State(BaseModel):
 
     status: PlanStatus = PlanStatus.EMPTY
     updated_at: datetime = Field(default_factory=datetime.utcnow)
+    # 每次保存 plan 自增；thinking_id 指向该版本对应的思考过程（见 app.thinking）
+    version: int = 0
+    thinking_id: Optional[str] = None
 
 class EditRequest(BaseModel):
     case_name:Optional[str]
@@ -21,9 +24,20 @@ class EditRequest(BaseModel):
     user_input: Optional[str]
     base_version: Optional[int] = None
 
+class ThinkingRef(BaseModel):
+    # 思考过程的内容寻址引用：id 为原文 UTF-8 字节的 sha256
+    id: str
+    size: int
+    compressed_size: int
+    url: str
+
 class PlanResponse(BaseModel):
     plan: Dict[str, Any]
+    # 仅在 inline_thinking=true 时内联；默认通过 thinking_ref 按需获取
     thinking: Optional[str] = None
+    thinking_ref: Optional[ThinkingRef] = None
+    # 语义校验结果（errors / warnings 按步骤定位），仅生成/修改接口返回
+    validation: Optional[Dict[str, Any]] = None
 
 class PlanResponseWithState(BaseModel):
     # 可选地返回状态（调试/后端查看）
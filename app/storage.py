@@ -1,18 +1,28 @@
 import json
 import os
+import asyncio
 import tempfile
+import threading
 import contextlib
 from pathlib import Path
 from typing import Any, Optional
 from datetime import datetime
 
 from app.state import State, PlanStatus
+from app.metrics import span
 
 # 基础路径：仅保留 current_plan 与 state
-BASE_DIR = Path(os.environ.get("PLAN_STORAGE_DIR", "plans")).resolve()
+# PLAN_STORAGE_DIR 默认为仓库根目录下的 plans；相对路径按仓库根目录解析（与启动时的工作目录无关）
+_ROOT = Path(__file__).resolve().parent.parent
+BASE_DIR = (_ROOT / os.environ.get("PLAN_STORAGE_DIR", "plans")).resolve()
 CURRENT_PLAN = BASE_DIR / "current_plan.json"
 STATE_FILE = BASE_DIR / "state.json"
 
+# 变更通知：save_plan_and_bump / set_status / clear_all 提交后递增 revision 并唤醒等待者
+_change_lock = threading.Lock()
+_revision = 0
+_watchers: set = set()
+
 def _atomic_write_json(path: Path, data: Any):
     """
     原子写入，避免半写坏文件。
@@ -28,6 +38,60 @@ def _atomic_write_json(path: Path, data: Any):
             os.remove(tmp_path)
         raise
 
+def _file_signature(path: Path) -> str:
+    """
+    inode + mtime + size；原子写入每次都会换新文件，足以判断内容是否变化。
+    """
+    try:
+        st = path.stat()
+    except FileNotFoundError:
+        return "0"
+    return f"{st.st_ino:x}-{st.st_mtime_ns:x}-{st.st_size:x}"
+
+def plan_etag(include_state: bool = False) -> Optional[str]:
+    """
+    仅依据文件元数据计算当前 plan 的 ETag（不读取、不序列化内容）；无计划时返回 None。
+    """
+    plan_sig = _file_signature(CURRENT_PLAN)
+    if plan_sig == "0":
+        return None
+    if include_state:
+        return f'"{plan_sig}.{_file_signature(STATE_FILE)}"'
+    return f'"{plan_sig}"'
+
+def current_revision() -> int:
+    return _revision
+
+def _notify_change():
+    global _revision
+    with _change_lock:
+        _revision += 1
+        watchers = list(_watchers)
+    for loop, event in watchers:
+        # 事件循环可能已关闭
+        with contextlib.suppress(RuntimeError):
+            loop.call_soon_threadsafe(event.set)
+
+async def wait_for_change(since: int, timeout: float) -> int:
+    """
+    挂起直到 revision 不再等于 since 或超时，返回最新 revision。
+    等待期间不占用线程、不做任何 IO。
+    """
+    loop = asyncio.get_running_loop()
+    entry = (loop, asyncio.Event())
+    with _change_lock:
+        if _revision != since:
+            return _revision
+        _watchers.add(entry)
+    try:
+        with contextlib.suppress(asyncio.TimeoutError):
+            await asyncio.wait_for(entry[1].wait(), timeout)
+    finally:
+        with _change_lock:
+            _watchers.discard(entry)
+    return _revision
+
+@span("storage.load_state")
 def load_state() -> State:
     if not STATE_FILE.exists():
         return State()
@@ -41,6 +105,7 @@ def load_state() -> State:
 def save_state(state: State):
     _atomic_write_json(STATE_FILE, json.loads(state.model_dump_json()))
 
+@span("storage.load_plan")
 def load_plan() -> Optional[dict]:
     if not CURRENT_PLAN.exists():
         return None
@@ -49,32 +114,41 @@ def load_plan() -> Optional[dict]:
     except Exception:
         return None
 
-def save_plan_and_bump(plan: dict, status: Optional[PlanStatus] = None, base_version: Optional[int] = None) -> State:
+@span("storage.save_plan")
+def save_plan_and_bump(plan: dict, status: Optional[PlanStatus] = None, base_version: Optional[int] = None,
+                       thinking_id: Optional[str] = None) -> State:
     """
-    写入当前 plan，并更新状态与时间戳。
+    写入当前 plan，并更新状态、版本号与时间戳；thinking_id 关联本版本的思考过程。
     """
     _atomic_write_json(CURRENT_PLAN, plan)
 
     state = load_state()
     if status is not None:
         state.status = status
+    state.version += 1
+    state.thinking_id = thinking_id
     state.updated_at = datetime.utcnow()
     save_state(state)
+    _notify_change()
     return state
 
+@span("storage.set_status")
 def set_status(new_status: PlanStatus) -> State:
     state = load_state()
     state.status = new_status
     state.updated_at = datetime.utcnow()
     save_state(state)
+    _notify_change()
     return state
 
 def clear_all():
     """
-    清空当前计划与状态：回到 EMPTY
+    清空当前计划与状态：回到 EMPTY（版本号保持单调递增）
     """
+    version = load_state().version
     with contextlib.suppress(FileNotFoundError):
         CURRENT_PLAN.unlink()
     with contextlib.suppress(FileNotFoundError):
         STATE_FILE.unlink()
-    save_state(State())
+    save_state(State(version=version))
+    _notify_change()
@@ -0,0 +1,86 @@
+import os
+import re
+import gzip
+import hashlib
+import tempfile
+import contextlib
+from functools import lru_cache
+from pathlib import Path
+from typing import Optional, Tuple
+
+from app.state import ThinkingRef
+from app.storage import BASE_DIR
+
+# 思考过程单独存放：gzip 压缩、按 sha256 内容寻址，同一段文本只存一份
+THINKING_DIR = BASE_DIR / "thinking"
+_ID_RE = re.compile(r"^[0-9a-f]{64}$")
+
+
+def _path_for(thinking_id: str) -> Path:
+    return THINKING_DIR / f"{thinking_id}.txt.gz"
+
+
+def _ref(thinking_id: str, size: int, compressed_size: int) -> ThinkingRef:
+    return ThinkingRef(id=thinking_id, size=size, compressed_size=compressed_size,
+                       url=f"/plan/thinking/{thinking_id}")
+
+
+def save_thinking(text: Optional[str]) -> Optional[ThinkingRef]:
+    """
+    压缩并落盘思考过程，返回引用；空文本返回 None。已存在相同内容时不重复写入。
+    """
+    if not text:
+        return None
+    raw = text.encode("utf-8")
+    thinking_id = hashlib.sha256(raw).hexdigest()
+    path = _path_for(thinking_id)
+    if not path.exists():
+        THINKING_DIR.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix=".tmp-", dir=str(THINKING_DIR))
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(gzip.compress(raw, compresslevel=6, mtime=0))
+            os.replace(tmp_path, path)
+        except Exception:
+            with contextlib.suppress(Exception):
+                os.remove(tmp_path)
+            raise
+    return _ref(thinking_id, len(raw), path.stat().st_size)
+
+
+def compressed_path(thinking_id: str) -> Optional[Path]:
+    if not _ID_RE.match(thinking_id or ""):
+        return None
+    path = _path_for(thinking_id)
+    return path if path.exists() else None
+
+
+@lru_cache(maxsize=8)
+def load_thinking_bytes(thinking_id: str) -> Optional[bytes]:
+    """
+    解压后的原文字节；内容寻址不可变，可安全缓存。
+    """
+    path = compressed_path(thinking_id)
+    if path is None:
+        return None
+    return gzip.decompress(path.read_bytes())
+
+
+def parse_range(range_header: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    解析单段 Range（bytes=a-b / bytes=a- / bytes=-n），返回闭区间 (start, end)；
+    不满足时返回 None（调用方回复 416）。
+    """
+    m = re.fullmatch(r"\s*bytes=(\d*)-(\d*)\s*", range_header or "")
+    if not m or (not m.group(1) and not m.group(2)):
+        return None
+    if not m.group(1):
+        length = int(m.group(2))
+        if length == 0:
+            return None
+        return max(size - length, 0), size - 1
+    start = int(m.group(1))
+    end = int(m.group(2)) if m.group(2) else size - 1
+    if start >= size or end < start:
+        return None
+    return start, min(end, size - 1)
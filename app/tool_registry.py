@@ -0,0 +1,417 @@
+import re
+import json
+import hashlib
+from collections import Counter
+from dataclasses import dataclass, field, asdict
+from typing import Any, Dict, FrozenSet, Iterator, List, Optional, Tuple
+
+from app.cli_params import EMPTY_ARGS as _EMPTY_ARGS, STRAY_QUOTES as _STRAY_QUOTES, parse_cli
+from app.context_store import VersionCache
+
+# 结构化工具注册表：context.json 中每个工具只有一段自由文本“工具描述”，返回码语义、触发说法、
+# 参数（/V、TestTime、/ID……）都埋在文字里。这里在加载时解析一次，得到每个工具的类型化签名，
+# 并合并用例步骤中实际出现过的参数写法；校验、提示词构造与确定性规划都通过它按名字 O(1) 查询。
+# 描述文本格式并不统一，解析是尽力而为：解析不出的部分保留原文（raw），不会丢信息。
+
+_INPUT_RE = re.compile(r"\binput\s*[:：]+", re.I)
+_OUTPUT_RE = re.compile(r"\boutput\s*[:：]+", re.I)
+_DESC_PREFIX_RE = re.compile(r"^\s*(?:name\s*[:：]\s*\"[^\"]*\"\s*)?\"?des?cription\"?\s*[:：]\s*", re.I)
+_RET_OK_RE = re.compile(r"返回\s*0\s*(?:表示|为)?\s*([^，,；;。]+)")
+_RET_FAIL_RE = re.compile(r"非\s*0\s*(?:表示|为)?\s*([^，,；;。]+)")
+_TRIGGER_SPAN_RE = re.compile(r"(?:出现|说)(.+?)(?:时|等时)")
+_QUOTED_RE = re.compile(r"[‘“\"']([^’”\"']+)[’”\"']")
+# 输入说明按“引号-逗号-引号”切成各个参数段
+_SEGMENT_SPLIT_RE = re.compile(r"[”\"]\s*[,，]?\s*[“\"]")
+_BOUND_RE = re.compile(r"与\s*(?:命令行|脚本参数)?\s*((?:--?|/)[A-Za-z][\w.-]*|[A-Za-z][\w.]*)\s*(?:\{(\w+)\})?\s*(?:参数)?\s*对应")
+_PLACEHOLDER_RE = re.compile(r"((?:--?|/)[A-Za-z][\w.-]*)\s*\{(\w+)\}")
+_INLINE_FIXED_RE = re.compile(r"对应\s*((?:--?|/)[A-Za-z][\w.-]*)\s+([^\s）)]+)\s*[）)]")
+_FIXED_ARGS_RE = re.compile(r"固定参数为?\s*[:：]?\s*(.+)")
+_FIXED_RE = re.compile(r"固定(?:值)?\s*[:：]?\s*([^，,；;。\"“”（(]+)")
+_CHOICE_RE = re.compile(r"值\s+([^，,；;。\"“”（(\s]+(?:或者|或)[^，,；;。\"“”（(\s]+)")
+_RANGE_RE = re.compile(r"范围\s*(-?\d+)\s*[-~～]\s*(-?\d+)")
+_MIN_RE = re.compile(r"最小\s*(-?\d+)")
+_DEFAULT_RE = re.compile(r"默认\s*[:：]?\s*([^\s，,；;。\"“”]+)")
+_EXAMPLE_RE = re.compile(r"(?:例如|例|如)\s*[:：]\s*(.+)|例如\s+(.+)")
+_ALT_SPLIT_RE = re.compile(r"\s*(?:或者|或)\s*")
+_CJK_TAIL_RE = re.compile(r"\s+[一-鿿].*$")
+# 用例 params 为对象时，只把像参数名的键当作参数键
+_KEY_RE = re.compile(r"^(?:--?|/)?[A-Za-z][\w.-]*$")
+_INT_RE = re.compile(r"^-?\d+$")
+_NUM_RE = re.compile(r"^-?\d+\.\d+$")
+
+# 每个工具最多保留的观测写法 / 每个参数键最多保留的观测取值
+MAX_PATTERNS = 5
+MAX_VALUES = 8
+
+
+def param_flags(params: str) -> List[str]:
+    """
+    params 字符串中的参数键（--TestFunction、/V、-stress），按出现顺序；分词见 app.cli_params。
+    """
+    return list(parse_cli(params).flags)
+
+
+def _clean(text: str) -> str:
+    return text.strip().strip(_STRAY_QUOTES + "\"\\，,；;。. ").strip()
+
+
+@dataclass(frozen=True)
+class ToolParam:
+    # 参数键（/ID、--IgnoredDevices、TestTime）；描述里没有给出键名的位置参数为 None
+    flag: Optional[str]
+    description: str = ""
+    # string / integer / number / boolean / path / json / flag（无取值的开关）
+    value_type: str = "string"
+    placeholder: Optional[str] = None
+    fixed: bool = False
+    choices: Tuple[str, ...] = ()
+    examples: Tuple[str, ...] = ()
+    default: Optional[str] = None
+    minimum: Optional[int] = None
+    maximum: Optional[int] = None
+
+
+@dataclass(frozen=True)
+class ToolSignature:
+    name: str
+    description: str
+    returns: Dict[str, str] = field(default_factory=dict)
+    # 描述里“当测试步骤出现‘…’时”引出的说法
+    triggers: Tuple[str, ...] = ()
+    params: Tuple[ToolParam, ...] = ()
+    # 用例步骤中观测到的：参数键 → 取值示例、完整写法 → 次数
+    observed: Dict[str, Tuple[str, ...]] = field(default_factory=dict)
+    patterns: Tuple[Tuple[str, int], ...] = ()
+    uses: int = 0
+    raw: str = ""
+
+    @property
+    def known_flags(self) -> FrozenSet[str]:
+        """
+        描述中给出的参数键（以 - / -- / / 开头的）与用例中出现过的参数键之并集。
+        """
+        described = {p.flag for p in self.params if p.flag}
+        return frozenset(described | set(self.observed))
+
+    def param(self, flag: str) -> Optional[ToolParam]:
+        for p in self.params:
+            if p.flag == flag:
+                return p
+        return None
+
+    def summary(self) -> str:
+        """
+        一行紧凑签名，供提示词使用，如：BurnIn10Install(/V <string> 例 10.2.1015.0)：安装指定版本的 BurnInTest 10…
+        """
+        args = []
+        for p in self.params:
+            if p.value_type == "flag":
+                args.append(p.flag or "")
+                continue
+            if p.choices:
+                value = "|".join(p.choices)
+            elif p.minimum is not None or p.maximum is not None:
+                value = f"<{p.value_type} {'' if p.minimum is None else p.minimum}-{'' if p.maximum is None else p.maximum}>"
+            else:
+                value = f"<{p.value_type}>"
+            hint = f" 例 {p.examples[0]}" if p.examples and not p.choices and p.value_type != "json" else ""
+            args.append(f"{p.flag} {value}{hint}" if p.flag else f"{value}{hint}")
+        if not args and self.patterns:
+            args.append(f"用例写法 {self.patterns[0][0]}")
+        return f"{self.name}({', '.join(args)})：{self.description}"
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = asdict(self)
+        data["observed"] = {k: list(v) for k, v in self.observed.items()}
+        data["patterns"] = [{"params": p, "count": n} for p, n in self.patterns]
+        data["known_flags"] = sorted(self.known_flags)
+        return data
+
+
+def _split_text(text: str) -> Tuple[str, str]:
+    m = _INPUT_RE.search(text)
+    desc, rest = (text[:m.start()], text[m.end():]) if m else (text, "")
+    out = _OUTPUT_RE.search(rest)
+    return desc, rest[:out.start()] if out else rest
+
+
+def _description(desc: str) -> str:
+    desc = _DESC_PREFIX_RE.sub("", desc.strip())
+    return desc.strip().strip("\"，, ").strip()
+
+
+def _returns(desc: str) -> Dict[str, str]:
+    out: Dict[str, str] = {}
+    ok, fail = _RET_OK_RE.search(desc), _RET_FAIL_RE.search(desc)
+    if ok:
+        out["0"] = _clean(ok.group(1))
+    if fail:
+        out["非0"] = _clean(fail.group(1))
+    return out
+
+
+def _triggers(desc: str) -> Tuple[str, ...]:
+    found: List[str] = []
+    for span in _TRIGGER_SPAN_RE.finditer(desc):
+        for q in _QUOTED_RE.findall(span.group(1)):
+            q = q.strip()
+            if q and q not in found:
+                found.append(q)
+    return tuple(found)
+
+
+def _alternatives(value: str) -> Tuple[str, ...]:
+    return tuple(v for v in (_clean(x) for x in _ALT_SPLIT_RE.split(value)) if v)
+
+
+def _examples(segment: str, flag: Optional[str]) -> Tuple[str, ...]:
+    m = _EXAMPLE_RE.search(segment)
+    if not m:
+        return ()
+    out: List[str] = []
+    for v in _alternatives(m.group(1) or m.group(2)):
+        if flag and v.startswith(flag):
+            v = v[len(flag):].lstrip("=： :")
+        v = _clean(_CJK_TAIL_RE.sub("", v))
+        if v and v not in out:
+            out.append(v)
+    return tuple(out)
+
+
+def _value_type(segment: str, values: List[str], bounded: bool) -> str:
+    if "json" in segment.lower():
+        return "json"
+    if "路径" in segment or "path" in segment.lower():
+        return "path"
+    if values and all(v.lower() in ("true", "false") for v in values):
+        return "boolean"
+    if bounded or (values and all(_INT_RE.match(v) for v in values)):
+        return "integer"
+    if values and all(_INT_RE.match(v) or _NUM_RE.match(v) for v in values):
+        return "number"
+    return "string"
+
+
+def _param(segment: str, flag: Optional[str], placeholder: Optional[str] = None,
+           inline_fixed: Optional[str] = None) -> ToolParam:
+    fixed = _FIXED_RE.search(segment)
+    choice = _CHOICE_RE.search(segment)
+    choices: Tuple[str, ...] = ()
+    if inline_fixed is not None:
+        choices = (inline_fixed,)
+    elif fixed:
+        choices = _alternatives(fixed.group(1))
+    elif choice:
+        choices = _alternatives(choice.group(1))
+    rng, lo = _RANGE_RE.search(segment), _MIN_RE.search(segment)
+    default = _DEFAULT_RE.search(segment)
+    examples = _examples(segment, flag)
+    minimum = int(rng.group(1)) if rng else (int(lo.group(1)) if lo else None)
+    maximum = int(rng.group(2)) if rng else None
+    values = list(choices) + list(examples) + ([default.group(1)] if default else [])
+    # 描述文字：去掉参数键之后的部分（“与 /V 参数对应，如：…”）
+    text = _BOUND_RE.split(segment, maxsplit=1)[0] if flag else segment
+    return ToolParam(
+        flag=flag,
+        description=_clean(text.split("：")[0] if "：" in text and flag else text),
+        value_type=_value_type(segment, values, rng is not None or lo is not None),
+        placeholder=placeholder,
+        fixed=bool(fixed) or inline_fixed is not None,
+        choices=choices,
+        examples=examples,
+        default=default.group(1) if default else None,
+        minimum=minimum,
+        maximum=maximum,
+    )
+
+
+def _json_example(text: str) -> Tuple[str, Optional[str]]:
+    """
+    输入说明里内嵌的 JSON 配置示例（如 DeviceNetRequest）：整体取出，避免被按引号切碎。
+    """
+    idx = text.find('{"')
+    if idx < 0:
+        return text, None
+    try:
+        obj, end = json.JSONDecoder().raw_decode(text, idx)
+    except ValueError:
+        return text, None
+    return text[:idx] + text[end:], json.dumps(obj, ensure_ascii=False)
+
+
+def _params(input_text: str) -> Tuple[ToolParam, ...]:
+    text = input_text.strip().rstrip(",，").replace('\\"', '"')
+    if _clean(text).lower() in _EMPTY_ARGS:
+        return ()
+    text, json_example = _json_example(text)
+    out: List[ToolParam] = []
+    if json_example is not None:
+        out.append(ToolParam(flag=None, description="JSON 配置", value_type="json", examples=(json_example,)))
+    for segment in _SEGMENT_SPLIT_RE.split(text):
+        segment = _clean(segment)
+        if not segment or segment.lower() in _EMPTY_ARGS:
+            continue
+        if json_example is not None and "json" in segment.lower():
+            continue  # 即上面的 JSON 配置参数本身
+        fixed_args = _FIXED_ARGS_RE.search(segment)
+        if fixed_args:
+            for flag in param_flags(fixed_args.group(1)):
+                out.append(ToolParam(flag=flag, value_type="flag", fixed=True))
+            continue
+        bound = list(_BOUND_RE.finditer(segment))
+        if bound:
+            for m in bound:
+                out.append(_param(segment, m.group(1), m.group(2)))
+            continue
+        placeholder = _PLACEHOLDER_RE.search(segment)
+        if placeholder:
+            out.append(_param(segment, placeholder.group(1), placeholder.group(2)))
+            continue
+        inline = _INLINE_FIXED_RE.search(segment)
+        if inline:
+            out.append(_param(segment, inline.group(1), inline_fixed=inline.group(2)))
+            continue
+        out.append(_param(segment, None))
+    return tuple(out)
+
+
+def _step_args(params: Any) -> Tuple[List[str], Dict[str, Any]]:
+    """
+    用例步骤的 params：{"_args": [...]} 为命令行片段；其它对象（如 {"TestTime": "120"}）按键值对处理。
+    """
+    if isinstance(params, dict):
+        if "_args" in params:
+            args = params["_args"] if isinstance(params["_args"], list) else [params["_args"]]
+            return [str(a) for a in args], {}
+        return [], params
+    if isinstance(params, str):
+        return [params], {}
+    return [], {}
+
+
+class _Observations:
+    def __init__(self):
+        self.uses = 0
+        self.patterns: Counter = Counter()
+        self.values: Dict[str, List[str]] = {}
+
+    def add_value(self, flag: str, value: Optional[str]) -> None:
+        bucket = self.values.setdefault(flag, [])
+        if value:
+            value = value.strip(_STRAY_QUOTES + "\"")
+            if value and value not in bucket and len(bucket) < MAX_VALUES:
+                bucket.append(value)
+
+    def add(self, params: Any) -> None:
+        self.uses += 1
+        args, pairs = _step_args(params)
+        joined = " ".join(a.strip().lstrip(_STRAY_QUOTES) for a in args).strip()
+        if joined.lower() not in _EMPTY_ARGS:
+            self.patterns[joined] += 1
+            for arg in parse_cli(joined):
+                if arg.kind == "flag":
+                    self.add_value(arg.key, arg.raw_value)
+        for k, v in pairs.items():
+            if not _KEY_RE.match(str(k)):
+                continue
+            self.add_value(k, v if isinstance(v, str) else json.dumps(v, ensure_ascii=False))
+
+
+def parse_tool(name: str, spec: Any, observed: Optional[_Observations] = None) -> ToolSignature:
+    raw = spec.get("工具描述", "") if isinstance(spec, dict) else str(spec or "")
+    raw = raw if isinstance(raw, str) else ""
+    desc, input_text = _split_text(raw)
+    obs = observed or _Observations()
+    return ToolSignature(
+        name=name,
+        description=_description(desc),
+        returns=_returns(desc),
+        triggers=_triggers(desc),
+        params=_params(input_text),
+        observed={k: tuple(v) for k, v in obs.values.items()},
+        patterns=tuple(obs.patterns.most_common(MAX_PATTERNS)),
+        uses=obs.uses,
+        raw=raw,
+    )
+
+
+class ToolRegistry:
+    """
+    一版上下文的工具注册表：名字 → ToolSignature（字典，O(1) 查询）。
+    """
+
+    def __init__(self, context: Dict[str, Any], context_version: str = ""):
+        self.context_version = context_version
+        tools = context.get("tools") or {}
+        observations: Dict[str, _Observations] = {}
+        for case in (context.get("cases") or {}).values():
+            for s in case.get("steps") or []:
+                tool = s.get("tool")
+                if isinstance(tool, str) and tool:
+                    observations.setdefault(tool, _Observations()).add(s.get("params"))
+        self._tools: Dict[str, ToolSignature] = {
+            name: parse_tool(name, spec, observations.get(name)) for name, spec in tools.items()}
+        self.names: FrozenSet[str] = frozenset(self._tools)
+        self._param_keys = {name: sig.known_flags for name, sig in self._tools.items()}
+        # 触发说法（小写）→ 工具名，供确定性规划按步骤文本直接定位工具
+        self._triggers: Dict[str, str] = {}
+        for name, sig in self._tools.items():
+            for t in sig.triggers:
+                self._triggers.setdefault(t.lower(), name)
+        self._body: Optional[bytes] = None
+
+    def __contains__(self, name: object) -> bool:
+        return name in self._tools
+
+    def __len__(self) -> int:
+        return len(self._tools)
+
+    def __iter__(self) -> Iterator[ToolSignature]:
+        return iter(self._tools.values())
+
+    def get(self, name: str) -> Optional[ToolSignature]:
+        return self._tools.get(name)
+
+    def param_keys(self) -> Dict[str, FrozenSet[str]]:
+        return self._param_keys
+
+    def match_triggers(self, text: str) -> List[str]:
+        """
+        步骤/需求文本中出现了哪些工具的触发说法（按说法长度降序，长说法更具体）。
+        """
+        text = text.lower()
+        hits = [(len(t), name) for t, name in self._triggers.items() if t in text]
+        out: List[str] = []
+        for _, name in sorted(hits, reverse=True):
+            if name not in out:
+                out.append(name)
+        return out
+
+    def prompt_catalog(self) -> str:
+        return "\n".join(sig.summary() for sig in self._tools.values())
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"context_version": self.context_version,
+                "tools": {name: sig.to_dict() for name, sig in self._tools.items()}}
+
+    @property
+    def etag(self) -> str:
+        # 注册表完全由上下文内容决定，上下文指纹即可作为强校验 ETag
+        version = self.context_version or hashlib.sha256(self.body).hexdigest()[:12]
+        return f'"tools-{version}"'
+
+    @property
+    def body(self) -> bytes:
+        if self._body is None:
+            self._body = json.dumps(self.to_dict(), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        return self._body
+
+
+_cache: VersionCache[ToolRegistry] = VersionCache()
+
+
+def get_registry(context_version: str, context_json: str) -> ToolRegistry:
+    """
+    按上下文版本取（必要时解析）工具注册表。
+    """
+    return _cache.get(context_version, lambda: ToolRegistry(json.loads(context_json), context_version))
@@ -0,0 +1,215 @@
+import json
+from dataclasses import dataclass, field, asdict
+from typing import Any, Callable, Dict, FrozenSet, List, Optional, Tuple
+
+from jsonschema.validators import validator_for
+
+from app.context_store import VersionCache
+from app.tool_registry import ToolRegistry, get_registry, param_flags
+
+# 计划的语义校验：JSON Schema + order 连续性 + 工具名白名单 + 已知参数键，一次遍历完成。
+# 校验器按上下文版本（context.json 内容指纹）编译一次后复用；单步校验可用于流式逐步检查与批量处理。
+# 工具白名单与参数键来自工具注册表（app.tool_registry）。
+
+
+_TYPE_EXPR = {
+    "object": "isinstance({v}, dict)",
+    "array": "isinstance({v}, list)",
+    "string": "isinstance({v}, str)",
+    "integer": "(isinstance({v}, int) and not isinstance({v}, bool))",
+    "number": "(isinstance({v}, (int, float)) and not isinstance({v}, bool))",
+    "boolean": "isinstance({v}, bool)",
+    "null": "({v} is None)",
+}
+_FAST_KEYWORDS = {"type", "properties", "required", "enum", "minimum", "minItems", "items"}
+
+
+def _fast_expr(schema: Any, v: str, consts: Dict[str, Any], depth: int = 0) -> Optional[str]:
+    if not isinstance(schema, dict) or set(schema) - _FAST_KEYWORDS:
+        return None
+    parts: List[str] = []
+    if "type" in schema:
+        types = schema["type"] if isinstance(schema["type"], list) else [schema["type"]]
+        if any(t not in _TYPE_EXPR for t in types):
+            return None
+        parts.append("(" + " or ".join(_TYPE_EXPR[t].format(v=v) for t in types) + ")")
+    if "enum" in schema:
+        name = f"_enum{len(consts)}"
+        consts[name] = tuple(schema["enum"])
+        parts.append(f"(not isinstance({v}, bool) and {v} in {name})")
+    if "minimum" in schema:
+        parts.append(f"(not isinstance({v}, (int, float)) or {v} >= {schema['minimum']!r})")
+    if "minItems" in schema:
+        parts.append(f"(not isinstance({v}, list) or len({v}) >= {int(schema['minItems'])})")
+    obj: List[str] = []
+    for k in schema.get("required", ()):
+        obj.append(f"{k!r} in {v}")
+    for k, sub in (schema.get("properties") or {}).items():
+        sub_expr = _fast_expr(sub, f"{v}[{k!r}]", consts, depth)
+        if sub_expr is None:
+            return None
+        obj.append(f"({k!r} not in {v} or {sub_expr})")
+    if obj:
+        parts.append(f"(not isinstance({v}, dict) or ({' and '.join(obj)}))")
+    if "items" in schema:
+        item = f"_i{depth}"
+        sub_expr = _fast_expr(schema["items"], item, consts, depth + 1)
+        if sub_expr is None:
+            return None
+        parts.append(f"(not isinstance({v}, list) or all({sub_expr} for {item} in {v}))")
+    return " and ".join(parts) or "True"
+
+
+def _compile_fast(schema: Dict[str, Any]) -> Optional[Callable[[Any], bool]]:
+    """
+    把 PLAN_SCHEMA 用到的关键字子集生成为一个 Python 表达式并编译，合法实例无需经过 jsonschema。
+    返回 False 只表示“需要细查”：随后由 jsonschema 给出权威结论与错误信息。含不支持的关键字时返回 None。
+    """
+    consts: Dict[str, Any] = {}
+    expr = _fast_expr(schema, "x", consts)
+    if expr is None:
+        return None
+    return eval(compile(f"lambda x: {expr}", "<plan-schema>", "eval"), consts)
+
+
+@dataclass
+class PlanIssue:
+    code: str
+    message: str
+    # 步骤在 steps 中的下标（0 起）；计划级问题为 None
+    step: Optional[int] = None
+    field: Optional[str] = None
+    severity: str = "error"
+
+
+@dataclass
+class ValidationReport:
+    errors: List[PlanIssue] = field(default_factory=list)
+    warnings: List[PlanIssue] = field(default_factory=list)
+
+    @property
+    def ok(self) -> bool:
+        return not self.errors
+
+    def add(self, issue: PlanIssue) -> None:
+        (self.errors if issue.severity == "error" else self.warnings).append(issue)
+
+    def summary(self) -> Optional[str]:
+        if not self.errors:
+            return None
+        return "; ".join(self._where(e) + e.message for e in self.errors)
+
+    @staticmethod
+    def _where(issue: PlanIssue) -> str:
+        if issue.step is None:
+            return f"{issue.field}: " if issue.field else ""
+        return f"steps[{issue.step}].{issue.field}: " if issue.field else f"steps[{issue.step}]: "
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"ok": self.ok,
+                "errors": [asdict(e) for e in self.errors],
+                "warnings": [asdict(w) for w in self.warnings]}
+
+
+class PlanValidator:
+    """
+    针对某一版上下文编译好的校验器。
+    """
+
+    def __init__(self, schema: Dict[str, Any], context: Dict[str, Any], context_version: str = "",
+                 registry: Optional[ToolRegistry] = None):
+        cls = validator_for(schema)
+        cls.check_schema(schema)
+        self.schema_validator = cls(schema)
+        step_schema = schema.get("properties", {}).get("steps", {}).get("items")
+        self.step_validator = cls(step_schema) if step_schema else None
+        # 计划级字段（不含步骤内部）与单步的快速判定
+        plan_level = dict(schema)
+        if "properties" in plan_level and "steps" in plan_level["properties"]:
+            steps_schema = {k: v for k, v in plan_level["properties"]["steps"].items() if k != "items"}
+            plan_level["properties"] = {**plan_level["properties"], "steps": steps_schema}
+        self._fast_plan = _compile_fast(plan_level)
+        self._fast_step = _compile_fast(step_schema) if step_schema else None
+        self.context_version = context_version
+        self.registry = registry if registry is not None else ToolRegistry(context, context_version)
+        self.tools: FrozenSet[str] = self.registry.names
+        # 描述中给出的与用例中出现过的参数键
+        self.param_keys: Dict[str, FrozenSet[str]] = self.registry.param_keys()
+
+    # ---------- 单步 ----------
+    def check_step(self, step: Any, index: int, report: Optional[ValidationReport] = None,
+                   expected_order: Optional[int] = None) -> ValidationReport:
+        """
+        校验单个步骤（流式生成时每解析出一步即可调用）。expected_order 给出时同时检查 order 连续性。
+        """
+        report = report if report is not None else ValidationReport()
+        if self.step_validator is not None and not (self._fast_step is not None and self._fast_step(step)):
+            for err in self.step_validator.iter_errors(step):
+                path = "/".join(str(p) for p in err.absolute_path)
+                report.add(PlanIssue("schema", err.message, index, path or None))
+        if not isinstance(step, dict):
+            return report
+        order = step.get("order")
+        if expected_order is not None and isinstance(order, int) and order != expected_order:
+            report.add(PlanIssue("order", f"order 应为 {expected_order}，实际为 {order}", index, "order"))
+        tool = step.get("tool")
+        if isinstance(tool, str) and tool not in self.tools:
+            report.add(PlanIssue("unknown_tool", f"工具 {tool!r} 不在上下文工具清单中", index, "tool"))
+        params = step.get("params")
+        known = self.param_keys.get(tool) if isinstance(tool, str) else None
+        if known and isinstance(params, str):
+            unknown = [f for f in param_flags(params) if f not in known]
+            if unknown:
+                # 描述与示例未必覆盖全部合法参数，只作提示
+                report.add(PlanIssue("unknown_param", f"参数 {', '.join(unknown)} 未在工具 {tool} 的描述或示例中出现",
+                                     index, "params", severity="warning"))
+        return report
+
+    # ---------- 整个计划 ----------
+    def validate(self, plan: Any) -> ValidationReport:
+        report = ValidationReport()
+        if not isinstance(plan, dict):
+            report.add(PlanIssue("schema", "计划必须是 JSON 对象"))
+            return report
+        # 计划级字段（case_name / case_desc / type / steps 本身）
+        if not (self._fast_plan is not None and self._fast_plan(plan)):
+            for err in self.schema_validator.iter_errors(plan):
+                if err.absolute_path and err.absolute_path[0] == "steps" and len(err.absolute_path) > 1:
+                    continue  # 步骤内的错误交给 check_step，避免重复
+                path = "/".join(str(p) for p in err.absolute_path)
+                report.add(PlanIssue("schema", err.message, None, path or None))
+        steps = plan.get("steps")
+        if isinstance(steps, list):
+            for i, s in enumerate(steps):
+                self.check_step(s, i, report, expected_order=i + 1)
+        return report
+
+    def check_schema(self, plan: Any) -> None:
+        """
+        仅做 schema 校验，不合格时抛出 jsonschema.ValidationError（供“不合格即重试”的路径使用）。
+        """
+        if self._fast_plan is not None and self._fast_step is not None and self._fast_plan(plan) \
+                and all(self._fast_step(s) for s in plan["steps"]):
+            return
+        self.schema_validator.validate(plan)
+
+    def tools_known(self, plan: Dict[str, Any]) -> bool:
+        return all(s.get("tool") in self.tools for s in plan.get("steps", []) if isinstance(s, dict))
+
+
+_cache: VersionCache[PlanValidator] = VersionCache()
+
+
+def get_validator(context_version: str, context_json: str, schema: Dict[str, Any]) -> PlanValidator:
+    """
+    按上下文版本取（必要时编译）校验器；上下文更新后版本变化，自动编译新的。
+    """
+    return _cache.get(context_version, lambda: PlanValidator(
+        schema, json.loads(context_json), context_version, registry=get_registry(context_version, context_json)))
+
+
+def as_tuple(report: ValidationReport) -> Tuple[bool, Optional[str]]:
+    """
+    兼容旧的 (ok, err) 返回形式。
+    """
+    return report.ok, report.summary()
@@ -0,0 +1,165 @@
+"""
+Excel→JSON 转换器（get_json/excel_to_json2.py）build_cases 基准：对比原先的 groupby.apply + iterrows 实现
+与列式实现，在 10k / 100k / 1M 行的合成 SOP 表上输出耗时，并逐字节比较两者写出的 JSON。
+
+原实现保留在本文件（legacy_*）仅作对照；pandas 3 起 groupby.apply 不再把分组列传给函数，
+这里用等价的逐组拼接代替，行为与 pandas 2 下的原实现一致。
+
+用法（仓库根目录）：python bench/bench_excel_to_json.py [--rows 10000 100000 1000000] [--legacy-max 100000]
+"""
+import sys
+import json
+import time
+import random
+import pathlib
+import argparse
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent / "get_json"))
+
+import numpy as np
+import pandas as pd
+
+import excel_to_json2 as conv
+
+TOOLS = ["BurnInTestStress", "SxPowerTest", "OSAgingTool", "PXA", "SetBrightness", "  AutoSet "]
+PARAMS = ["/ID CinebenchR20", "TestTime=120", "a=1; b=two, c=3.5", '{"k": 1, "v": [1, 2]}', "",
+          np.nan, "--TestFunction Wb --TestTimes 1", 5, "true", " -r "]
+NOTES = [np.nan, "", "  ", "检查返回码", " 需人工确认 "]
+
+
+def make_frame(rows: int, seed: int = 0) -> pd.DataFrame:
+    """
+    合成“合并单元格”风格的 SOP 表（空单元格为 NaN，与 read_excel(dtype=object) 一致）：Case名称/Case描述 只写在每个用例的首行，用例顺序打乱；
+    约 1/10 的用例没有序号（走 autostep），少量序号是 "3." 之类的字符串，夹杂空白分隔行。
+    """
+    rnd = random.Random(seed)
+    data = {k: [] for k in ("Case名称", "Case描述", "序号", "测试步骤", "测试工具", "参数", "备注")}
+    case_no = 0
+    while len(data["序号"]) < rows:
+        case_no += 1
+        n = rnd.randint(3, 30)
+        name = f" Case_{rnd.randrange(10 ** 7):07d}_{case_no} "
+        numbered = rnd.random() > 0.1
+        order = list(range(1, n + 1))
+        rnd.shuffle(order)
+        for i, o in enumerate(order):
+            first = i == 0
+            data["Case名称"].append(name if first else np.nan)
+            data["Case描述"].append(f" 描述 {case_no} " if first else np.nan)
+            data["序号"].append((f"{o}." if rnd.random() < 0.05 else o) if numbered else np.nan)
+            data["测试步骤"].append(f" 步骤 {o} 运行工具 ")
+            data["测试工具"].append(rnd.choice(TOOLS))
+            data["参数"].append(rnd.choice(PARAMS))
+            data["备注"].append(rnd.choice(NOTES))
+        if rnd.random() < 0.05:
+            # 分隔行：内容列全空
+            for k in data:
+                data[k].append(np.nan)
+    return pd.DataFrame({k: v[:rows] for k, v in data.items()}, dtype=object)
+
+
+def make_config() -> conv.Config:
+    return conv.Config(
+        case_id="Case名称", step_col="序号", action_col="测试步骤", tool_col="测试工具",
+        params_col="参数", notes_col="备注", ffill_cols=["Case名称", "Case描述"],
+        case_level_cols=["Case描述"], case_level_rename={"Case描述": "case_desc"}, infer_columns=False,
+    )
+
+
+# ---------- 原实现（对照） ----------
+def legacy_normalize(df, cfg):
+    df.columns = [str(c).strip() for c in df.columns]
+    cfg = cfg.resolve(df.columns)
+    for c in df.columns:
+        df[c] = df[c].map(conv._strip)
+    for c in cfg.ffill_cols:
+        if c in df.columns:
+            df[c] = df[c].ffill()
+    to_check = [c for c in [cfg.action_col, cfg.tool_col, cfg.params_col, cfg.notes_col] if c and c in df.columns]
+    if to_check:
+        df = df.loc[~df[to_check].isna().all(axis=1)].copy()
+    return df
+
+
+def legacy_build_cases(df, cfg):
+    cfg = cfg.resolve(df.columns)
+    step_col = cfg.step_col if cfg.step_col in df.columns else None
+    df["_step_idx"] = df[step_col].map(conv._coerce_int) if step_col else None
+
+    def assign_autostep(group):
+        if group["_step_idx"].isna().all() and cfg.autostep:
+            group = group.copy()
+            group["_step_idx"] = range(1, len(group) + 1)
+        return group
+
+    groups = [assign_autostep(g) for _, g in df.groupby(cfg.case_id, dropna=False, sort=False)]
+    df = pd.concat(groups) if groups else df
+    df = df.sort_values(by=[cfg.case_id, "_step_idx"], kind="mergesort")
+    cases_out = {}
+    for case_id, g in df.groupby(cfg.case_id, dropna=False, sort=False):
+        case_obj = {"case_id": case_id}
+        for col in cfg.case_level_cols or []:
+            if col in g.columns:
+                case_obj[cfg.case_level_rename.get(col, col)] = conv._first_non_empty(g[col])
+        steps = []
+        excluded_from_step = set(cfg.case_level_cols or [])
+        for _, row in g.iterrows():
+            step_obj = {
+                "step": int(row["_step_idx"]) if not pd.isna(row["_step_idx"]) else None,
+                "action": row.get(cfg.action_col),
+            }
+            if cfg.tool_col and cfg.tool_col in g.columns:
+                step_obj["tool"] = row.get(cfg.tool_col)
+            if cfg.params_col and cfg.params_col in g.columns:
+                step_obj["params"] = conv._parse_params(row.get(cfg.params_col))
+            if cfg.notes_col and cfg.notes_col in g.columns:
+                note_val = row.get(cfg.notes_col)
+                if isinstance(note_val, str) and note_val.strip():
+                    step_obj["notes"] = note_val
+            for extra in (cfg.extra_cols or []):
+                if extra in g.columns and extra not in excluded_from_step:
+                    step_obj[extra] = row.get(extra)
+            steps.append(step_obj)
+        case_obj["num_steps"] = len(steps)
+        case_obj["steps"] = steps
+        cases_out[case_id] = case_obj
+    return cases_out
+
+
+def run(normalize, build, frame: pd.DataFrame):
+    cfg = make_config()
+    t0 = time.perf_counter()
+    df = normalize(frame.copy(), cfg)
+    t1 = time.perf_counter()
+    cases = build(df, cfg)
+    t2 = time.perf_counter()
+    body = json.dumps(cases, ensure_ascii=False, indent=2).encode("utf-8")
+    return body, t1 - t0, t2 - t1, len(cases)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, nargs="*", default=[10_000, 100_000, 1_000_000])
+    ap.add_argument("--legacy-max", type=int, default=100_000, help="超过该行数不再跑原实现（太慢）")
+    args = ap.parse_args()
+
+    print(f"pandas {pd.__version__}, numpy {np.__version__}")
+    print(f"{'rows':>10}{'cases':>9}{'impl':>10}{'normalize s':>13}{'build s':>10}{'total s':>10}{'speedup':>9}  identical")
+    for rows in args.rows:
+        frame = make_frame(rows)
+        body, norm_s, build_s, ncases = run(conv.normalize_dataframe, conv.build_cases, frame)
+        total = norm_s + build_s
+        legacy = None
+        if rows <= args.legacy_max:
+            legacy = run(legacy_normalize, legacy_build_cases, frame)
+            l_total = legacy[1] + legacy[2]
+            print(f"{rows:>10,}{ncases:>9,}{'legacy':>10}{legacy[1]:>13.3f}{legacy[2]:>10.3f}{l_total:>10.3f}")
+        speedup = f"{(legacy[1] + legacy[2]) / total:>8.1f}x" if legacy else f"{'-':>9}"
+        same = ("yes" if legacy[0] == body else "NO") if legacy else "-"
+        print(f"{rows:>10,}{ncases:>9,}{'columnar':>10}{norm_s:>13.3f}{build_s:>10.3f}{total:>10.3f}{speedup}  {same}")
+        if legacy and legacy[0] != body:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
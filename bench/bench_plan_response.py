@@ -0,0 +1,85 @@
+"""
+plan 响应序列化/压缩基准：对比 FastAPI 默认路径（response_model 校验 + jsonable_encoder + json）
+与 app.responses 的快速路径（orjson + gzip/br），输出线上字节数与单次序列化 CPU 时间。
+
+用法（仓库根目录）：python bench/bench_plan_response.py [--thinking-kb 300] [--steps 60]
+"""
+import sys
+import json
+import time
+import pathlib
+import argparse
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+from fastapi.encoders import jsonable_encoder
+
+from app.state import PlanResponse
+from app import responses
+
+
+def make_payload(steps: int, thinking_kb: int) -> dict:
+    plan = {
+        "case_name": "bench",
+        "case_desc": "先把机器重启，然后跑Burnin测试30分钟，做1次S4，再跑burnin 30分钟",
+        "type": 1,
+        "steps": [
+            {
+                "order": i,
+                "action": f"运行 BurnInTest 压力测试第 {i} 轮，时长 30 分钟",
+                "tool": "BurnInTestStress",
+                "params": "TestTime=30",
+                "note": "对应上下文条目：BurnIn Test 120 分钟；推断：时长=30min（可被覆盖）",
+            }
+            for i in range(1, steps + 1)
+        ],
+    }
+    sentence = "首先分析用户的需求，需要重启、BurnIn 30 分钟、S4 一次，再 BurnIn 30 分钟。"
+    thinking = (sentence * (thinking_kb * 1024 // len(sentence.encode("utf-8")) + 1))
+    return {"plan": plan, "thinking": thinking}
+
+
+def baseline(content: dict) -> bytes:
+    # FastAPI serialize_response 的等价路径
+    validated = PlanResponse.model_validate(content)
+    encoded = jsonable_encoder(validated)
+    return json.dumps(encoded, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+
+def timed(fn, n: int) -> float:
+    start = time.perf_counter()
+    for _ in range(n):
+        fn()
+    return (time.perf_counter() - start) / n * 1000
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--steps", type=int, default=60)
+    ap.add_argument("--thinking-kb", type=int, default=300)
+    ap.add_argument("-n", type=int, default=50)
+    args = ap.parse_args()
+
+    content = make_payload(args.steps, args.thinking_kb)
+    raw = baseline(content)
+    fast = responses.dumps_bytes(content)
+    assert json.loads(raw) == json.loads(fast)
+
+    rows = [
+        ("baseline (pydantic + json)", len(raw), timed(lambda: baseline(content), args.n)),
+        (f"fast ({'orjson' if responses.orjson else 'json'})", len(fast), timed(lambda: responses.dumps_bytes(content), args.n)),
+        ("fast + gzip", len(responses.compress(fast, "gzip")),
+         timed(lambda: responses.compress(responses.dumps_bytes(content), "gzip"), args.n)),
+    ]
+    if responses.brotli is not None:
+        rows.append(("fast + br", len(responses.compress(fast, "br")),
+                     timed(lambda: responses.compress(responses.dumps_bytes(content), "br"), args.n)))
+
+    print(f"payload: {args.steps} steps, thinking≈{args.thinking_kb}KB")
+    print(f"{'path':<30}{'bytes on wire':>15}{'ms / response':>16}")
+    for name, size, ms in rows:
+        print(f"{name:<30}{size:>15,}{ms:>16.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+启动耗时基准：在仓库外的临时目录中启动全新的解释器（与部署/测试收集时一样不依赖工作目录），测量
+  1) 各入口模块（utils / step / main）的导入耗时，以及导入后是否已加载 openai / 读入上下文；
+  2) 服务就绪：导入 main → lifespan（step.init：加载上下文、预编译校验器、创建客户端）→ 第一个请求
+     （/healthz 与依赖上下文的 /tools）各阶段耗时，以及从启动子进程到第一个请求返回的总时长。
+默认关闭连接预热（TESTAGENT_LLM_WARMUP=0，预热耗时取决于网络），--warmup 打开。
+未设置 OPENAI_API_KEY 时填入占位值：只创建客户端，不发请求。
+
+用法（任意目录）：python bench/bench_startup.py [-n 5] [--warmup] [--importtime 15]
+"""
+import os
+import sys
+import json
+import time
+import pathlib
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+
+IMPORT_SNIPPET = """
+import sys, time, json
+t0 = time.perf_counter()
+import {module}
+ms = (time.perf_counter() - t0) * 1000
+from app import context_store
+print(json.dumps({{"ms": ms, "openai": "openai" in sys.modules,
+                  "context_loaded": context_store._current is not None}}))
+"""
+
+READY_SNIPPET = """
+import time, json
+t0 = time.perf_counter()
+import main
+t1 = time.perf_counter()
+from fastapi.testclient import TestClient
+with TestClient(main.app) as c:
+    t2 = time.perf_counter()
+    assert c.get("/healthz").status_code == 200
+    t3 = time.perf_counter()
+    assert c.get("/tools").status_code == 200
+    t4 = time.perf_counter()
+    ready_at = time.time()
+    import step
+    init = step.init()
+print(json.dumps({"import": (t1 - t0) * 1000, "lifespan": (t2 - t1) * 1000,
+                  "healthz": (t3 - t2) * 1000, "tools": (t4 - t3) * 1000,
+                  **{f"init.{k}": v for k, v in init.items()}, "ready_at": ready_at}))
+"""
+
+
+def run(code: str, env: dict, cwd: str) -> dict:
+    """
+    在新解释器中执行 code，返回其最后一行输出的 JSON；"spawn -> first request" 为启动子进程到子进程记录 ready_at 的墙钟时间。
+    """
+    started = time.time()
+    out = subprocess.run([sys.executable, "-c", code], env=env, cwd=cwd, capture_output=True, text=True)
+    if out.returncode != 0:
+        raise SystemExit(f"子进程失败：\n{out.stderr[-2000:]}")
+    result = json.loads(out.stdout.strip().splitlines()[-1])
+    if "ready_at" in result:
+        result["spawn -> first request"] = (result.pop("ready_at") - started) * 1000
+    return result
+
+
+def importtime(module: str, env: dict, cwd: str, top: int) -> None:
+    """
+    打印 -X importtime 中累计耗时最高的 top 个模块。
+    """
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                         env=env, cwd=cwd, capture_output=True, text=True)
+    rows = []
+    for line in out.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        rows.append((int(cumulative), name.rstrip()))
+    print(f"\n{module}: -X importtime 累计耗时前 {top}")
+    for us, name in sorted(rows, reverse=True)[:top]:
+        print(f"{us / 1000:>10.1f} ms  {name}")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-n", type=int, default=5, help="每项重复次数（取中位数）")
+    ap.add_argument("--modules", default="utils,step,main")
+    ap.add_argument("--warmup", action="store_true", help="lifespan 中预热 LLM 连接")
+    ap.add_argument("--importtime", type=int, default=0, metavar="TOP", help="再列出 main 导入耗时最高的模块")
+    args = ap.parse_args()
+
+    env = {**os.environ, "PYTHONPATH": str(ROOT), "TESTAGENT_LLM_WARMUP": "1" if args.warmup else "0"}
+    env.setdefault("OPENAI_API_KEY", "bench")
+    with tempfile.TemporaryDirectory(prefix="bench-startup-") as cwd:
+        print(f"{'import':<12}{'median ms':>12}{'min ms':>10}{'openai':>8}{'context':>9}")
+        for module in args.modules.split(","):
+            runs = [run(IMPORT_SNIPPET.format(module=module), env, cwd) for _ in range(args.n)]
+            ms = [r["ms"] for r in runs]
+            print(f"{module:<12}{statistics.median(ms):>12.1f}{min(ms):>10.1f}"
+                  f"{'yes' if runs[0]['openai'] else 'no':>8}{'yes' if runs[0]['context_loaded'] else 'no':>9}")
+
+        runs = [run(READY_SNIPPET, env, cwd) for _ in range(args.n)]
+        print(f"\n{'ready':<24}{'median ms':>12}{'min ms':>10}")
+        for key in runs[0]:
+            ms = [r[key] for r in runs]
+            print(f"{key:<24}{statistics.median(ms):>12.1f}{min(ms):>10.1f}")
+
+        if args.importtime:
+            importtime("main", env, cwd, args.importtime)
+
+
+if __name__ == "__main__":
+    main()
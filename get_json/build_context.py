@@ -0,0 +1,356 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+build_context.py
+
+Incremental build of the planner's context.json ({"tools": {...}, "cases": {...}})
+from the source spreadsheets.
+- Cases: sheets of the case workbooks, converted row-wise with excel_to_json2
+  (same config fields as config.case.yaml); a case's rows need not be contiguous
+- Tools: a sheet with a tool-name column plus description columns, or a JSON file
+  holding a "tools" mapping; without --tools the current tools section is kept
+- A manifest next to the output records file stats, a hash per sheet and a hash per
+  case's rows; a rebuild only re-reads changed files, only reconverts cases whose rows
+  changed, and takes everything else from the previous context.json
+- context.json and the manifest are written atomically (temp file + rename), and a
+  change summary (added / changed / removed cases and tools) is printed
+
+Usage
+-----
+python build_context.py --config config.case.yaml --input "sources/*.xlsx" \
+    --tools tools.xlsx --output ../context.json
+
+Use --force to ignore the manifest and rebuild everything.
+"""
+from __future__ import annotations
+import argparse
+import glob
+import hashlib
+import json
+import os
+import sys
+import time
+from dataclasses import asdict, replace
+from typing import Any, Dict, List, Optional, Tuple
+
+from excel_to_json2 import (
+    Config, _case_from_rows, _is_glob, _is_missing, _stream_header, _stream_sheet, load_config,
+    normalize_rows, openpyxl, write_json,
+)
+
+# Bump when the conversion itself changes, so old manifests stop matching
+BUILD_FORMAT = 2
+
+# Converter settings that do not affect case objects
+_NOT_HASHED = {"input", "sheet", "output", "per_case", "output_mode", "stream", "stream_format",
+               "jobs", "on_collision", "compact"}
+
+
+def _config_hash(cfg: Config) -> str:
+    data = {k: v for k, v in asdict(cfg).items() if k not in _NOT_HASHED}
+    data["_format"] = BUILD_FORMAT
+    return hashlib.sha256(json.dumps(data, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()[:16]
+
+
+def _json_key(cid: Any) -> str:
+    # The key json.dump writes for a case ID
+    return cid if isinstance(cid, str) else json.dumps(cid)
+
+
+def _rows_hash(head: Any, rows: List[Tuple[Any, ...]]) -> str:
+    h = hashlib.sha256(repr(head).encode("utf-8"))
+    for row in rows:
+        h.update(repr(row).encode("utf-8"))
+    return h.hexdigest()[:16]
+
+
+def _load_json(path: str) -> Any:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _input_files(pattern: str) -> List[str]:
+    if _is_glob(pattern):
+        # "~$..." are Excel's lock files for workbooks that are open
+        return [p for p in sorted(glob.glob(pattern, recursive=True))
+                if os.path.isfile(p) and not os.path.basename(p).startswith("~$")]
+    return [pattern]
+
+
+def _selected_sheets(wb, sheet: Any) -> List[Any]:
+    if sheet is None or str(sheet).strip().lower() == "all":
+        return list(wb.worksheets)
+    return [_stream_sheet(wb, sheet)]
+
+
+class _Build:
+    """
+    State of one incremental build: the previous manifest/context and what is being produced.
+    """
+
+    def __init__(self, cfg: Config, old_manifest: Dict[str, Any], old_cases: Dict[str, Any]):
+        self.cfg = cfg
+        self.old_files: Dict[str, Any] = old_manifest.get("files") or {}
+        self.old_cases = old_cases
+        # case key -> rows hash, across all sheets, so a case moved between sheets is still reused
+        self.old_hashes: Dict[str, str] = {}
+        for f in self.old_files.values():
+            for s in (f.get("sheets") or {}).values():
+                self.old_hashes.update(s.get("cases") or {})
+        self.files: Dict[str, Any] = {}
+        self.cases: Dict[str, Any] = {}
+        self.source: Dict[str, str] = {}
+        self.collisions: List[Tuple[str, str, str]] = []
+        self.rebuilt: List[str] = []
+        self.stats = {"files": 0, "files_read": 0, "sheets": 0, "sheets_parsed": 0}
+
+    def _cached(self, keys) -> bool:
+        return all(k in self.old_cases for k in keys)
+
+    def _add(self, key: str, obj: Any, label: str) -> bool:
+        if key in self.cases:
+            self.collisions.append((key, self.source[key], label))
+            return False
+        self.cases[key] = obj
+        self.source[key] = label
+        return True
+
+    def add_file(self, path: str) -> None:
+        self.stats["files"] += 1
+        st = os.stat(path)
+        old = self.old_files.get(path)
+        if (old and old.get("mtime_ns") == st.st_mtime_ns and old.get("size") == st.st_size
+                and old.get("sheet") == str(self.cfg.sheet)
+                and all(self._cached(s.get("cases") or {}) for s in old["sheets"].values())):
+            # Untouched file: nothing to read
+            for name, s in old["sheets"].items():
+                self.stats["sheets"] += 1
+                for key in s["cases"]:
+                    self._add(key, self.old_cases[key], f"{path}[{name}]")
+            self.files[path] = old
+            return
+
+        self.stats["files_read"] += 1
+        old_sheets = (old or {}).get("sheets") or {}
+        sheets: Dict[str, Any] = {}
+        wb = openpyxl.load_workbook(path, read_only=True, data_only=True)
+        try:
+            for ws in _selected_sheets(wb, self.cfg.sheet):
+                self.stats["sheets"] += 1
+                raw = list(ws.iter_rows(values_only=True))
+                sheet_hash = _rows_hash(ws.title, raw)
+                prev = old_sheets.get(ws.title)
+                label = f"{path}[{ws.title}]"
+                if prev and prev.get("hash") == sheet_hash and self._cached(prev.get("cases") or {}):
+                    for key in prev["cases"]:
+                        self._add(key, self.old_cases[key], label)
+                    sheets[ws.title] = prev
+                    continue
+                self.stats["sheets_parsed"] += 1
+                sheets[ws.title] = {"hash": sheet_hash, "cases": self._parse_sheet(raw, label)}
+        finally:
+            wb.close()
+        self.files[path] = {"mtime_ns": st.st_mtime_ns, "size": st.st_size, "sheet": str(self.cfg.sheet),
+                            "sheets": sheets}
+
+    def _parse_sheet(self, raw: List[Tuple[Any, ...]], label: str) -> Dict[str, str]:
+        cfg, idx, rows = normalize_rows(self.cfg, iter(raw))
+        if not idx:
+            return {}
+        groups: Dict[Any, List[Tuple[Any, ...]]] = {}
+        case_i = idx[cfg.case_id]
+        for _, row in rows:
+            groups.setdefault(row[case_i], []).append(row)
+        head = sorted(idx.items())
+        hashes: Dict[str, str] = {}
+        for cid, case_rows in groups.items():
+            key = _json_key(cid)
+            h = _rows_hash(head, case_rows)
+            hashes[key] = h
+            if self.old_hashes.get(key) == h and key in self.old_cases:
+                self._add(key, self.old_cases[key], label)
+            elif self._add(key, _case_from_rows(cid, case_rows, idx, cfg), label):
+                self.rebuilt.append(key)
+        return hashes
+
+
+def _tools_from_sheet(path: str, sheet: Any, name_col: Optional[str]) -> Dict[str, Dict[str, Any]]:
+    wb = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = _stream_sheet(wb, sheet).iter_rows(values_only=True)
+        cols: Optional[List[str]] = None
+        for raw in rows:
+            if any(v is not None for v in raw):
+                cols = _stream_header(raw)
+                break
+        if cols is None:
+            return {}
+        name_i = cols.index(name_col) if name_col else 0
+        tools: Dict[str, Dict[str, Any]] = {}
+        for raw in rows:
+            name = raw[name_i] if name_i < len(raw) else None
+            if name is None or not str(name).strip():
+                continue
+            entry = {}
+            for i, col in enumerate(cols):
+                v = raw[i] if i < len(raw) else None
+                if i == name_i or v is None or _is_missing(v):
+                    continue
+                entry[col] = v.strip() if isinstance(v, str) else v
+            tools[str(name).strip()] = entry
+        return tools
+    finally:
+        wb.close()
+
+
+def _load_tools(path: str, sheet: Any, name_col: Optional[str]) -> Dict[str, Any]:
+    if path.lower().endswith(".json"):
+        data = _load_json(path)
+        if not isinstance(data, dict):
+            raise ValueError(f"Tools file is not a JSON object: {path}")
+        return data["tools"] if isinstance(data.get("tools"), dict) else data
+    return _tools_from_sheet(path, sheet, name_col)
+
+
+def _file_hash(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()[:16]
+
+
+def _same(a: Any, b: Any) -> bool:
+    # Compare as written: missing cells are NaN and NaN != NaN, so == would report them as changed
+    return json.dumps(a, ensure_ascii=False) == json.dumps(b, ensure_ascii=False)
+
+
+def _diff(old: Dict[str, Any], new: Dict[str, Any], touched=None) -> Dict[str, List[str]]:
+    keys = new if touched is None else [k for k in touched if k in new]
+    return {
+        "added": [k for k in new if k not in old],
+        "changed": [k for k in keys if k in old and not _same(old[k], new[k])],
+        "removed": [k for k in old if k not in new],
+    }
+
+
+def build_context(cfg: Config, output: str, tools_path: Optional[str] = None, tools_sheet: Any = 0,
+                  tool_name_col: Optional[str] = None, manifest_path: Optional[str] = None,
+                  force: bool = False) -> Dict[str, Any]:
+    """
+    Rebuild ``output`` from cfg.input (file or glob) and the tools source; returns the change
+    summary. Files are rewritten only when something changed.
+    """
+    if openpyxl is None:
+        raise RuntimeError("openpyxl is required. Install with: pip install openpyxl")
+    t0 = time.perf_counter()
+    manifest_path = manifest_path or f"{output}.manifest.json"
+    config_hash = _config_hash(cfg)
+    old_ctx = _load_json(output)
+    old_ctx = old_ctx if isinstance(old_ctx, dict) else {}
+    old_manifest = _load_json(manifest_path)
+    if force or not isinstance(old_manifest, dict) or old_manifest.get("config") != config_hash:
+        old_manifest = {}
+    old_cases = old_ctx.get("cases") if isinstance(old_ctx.get("cases"), dict) else {}
+    old_tools = old_ctx.get("tools") if isinstance(old_ctx.get("tools"), dict) else {}
+
+    files = _input_files(cfg.input)
+    if not files:
+        raise FileNotFoundError(f"No workbooks match {cfg.input}")
+    build = _Build(cfg, old_manifest, old_cases if old_manifest else {})
+    for path in files:
+        build.add_file(path)
+
+    tools_entry = old_manifest.get("tools") or {}
+    if tools_path:
+        tools_hash = f"{_file_hash(tools_path)}:{tools_sheet}:{tool_name_col}"
+        if tools_entry.get("source") == tools_path and tools_entry.get("hash") == tools_hash and old_tools:
+            tools = old_tools
+        else:
+            tools = _load_tools(tools_path, tools_sheet, tool_name_col)
+        tools_entry = {"source": tools_path, "hash": tools_hash}
+    else:
+        tools = old_tools
+
+    if build.collisions and cfg.on_collision == "error":
+        raise ValueError(f"{len(build.collisions)} case IDs appear in more than one sheet, nothing written: "
+                         + ", ".join(f"{cid} ({kept} / {dropped})" for cid, kept, dropped in build.collisions[:5]))
+
+    case_diff = _diff(old_cases, build.cases, build.rebuilt)
+    tool_diff = _diff(old_tools, tools)
+    changed = (list(old_cases) != list(build.cases) or any(case_diff.values())
+               or list(old_tools) != list(tools) or any(tool_diff.values()))
+    write = changed or not os.path.exists(output)
+    if write:
+        write_json({"tools": tools, "cases": build.cases}, output)
+    manifest = {"format": BUILD_FORMAT, "config": config_hash, "tools": tools_entry, "files": build.files}
+    if manifest != old_manifest:
+        write_json(manifest, manifest_path)
+
+    return {
+        "output": output,
+        "written": write,
+        "cases": len(build.cases),
+        "cases_rebuilt": len(build.rebuilt),
+        "cases_reused": len(build.cases) - len(build.rebuilt),
+        "case_changes": case_diff,
+        "tools": len(tools),
+        "tool_changes": tool_diff,
+        "collisions": build.collisions,
+        **build.stats,
+        "seconds": round(time.perf_counter() - t0, 3),
+    }
+
+
+def print_summary(summary: Dict[str, Any], out=sys.stdout) -> None:
+    cc, tc = summary["case_changes"], summary["tool_changes"]
+    state = "updated" if summary["written"] else "unchanged"
+    out.write(f"{summary['output']} {state}: {summary['cases']} cases "
+              f"({summary['cases_rebuilt']} converted, {summary['cases_reused']} reused; "
+              f"+{len(cc['added'])} ~{len(cc['changed'])} -{len(cc['removed'])}), "
+              f"{summary['tools']} tools (+{len(tc['added'])} ~{len(tc['changed'])} -{len(tc['removed'])}); "
+              f"read {summary['files_read']}/{summary['files']} files, "
+              f"parsed {summary['sheets_parsed']}/{summary['sheets']} sheets in {summary['seconds']:.3f}s\n")
+    for kind, diff in (("case", cc), ("tool", tc)):
+        for sign, key in (("+", "added"), ("~", "changed"), ("-", "removed")):
+            for name in diff[key]:
+                out.write(f"  {sign} {kind} {name}\n")
+    for cid, kept, dropped in summary["collisions"]:
+        out.write(f"  ! case {cid} in {dropped} already came from {kept}; kept the first\n")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Incremental context.json build from source spreadsheets")
+    ap.add_argument("--config", type=str, default=None, help="Converter YAML config (e.g. config.case.yaml)")
+    ap.add_argument("--input", type=str, help="Case workbook or glob (overrides config input)")
+    ap.add_argument("--sheet", type=str, default="all", help='Sheet name or index, or "all" (default)')
+    ap.add_argument("--tools", type=str, default=None, help="Tools source: .xlsx sheet or .json (default: keep current tools)")
+    ap.add_argument("--tools-sheet", type=str, default="0", help="Sheet of the tools workbook")
+    ap.add_argument("--tool-name-col", type=str, default=None, help="Tool name column (default: first column)")
+    ap.add_argument("--output", type=str, default="context.json", help="context.json to update")
+    ap.add_argument("--manifest", type=str, default=None, help="Manifest path (default: <output>.manifest.json)")
+    ap.add_argument("--force", action="store_true", help="Ignore the manifest and reconvert everything")
+    ap.add_argument("--on-collision", type=str, choices=["report", "error"], default=None,
+                    help="Same case ID in several sheets: keep the first and report (default), or abort")
+    args = ap.parse_args()
+
+    cfg = load_config(args.config)
+    cfg = replace(cfg, input=args.input or cfg.input, sheet=args.sheet,
+                  on_collision=args.on_collision or cfg.on_collision)
+    if not cfg.input:
+        ap.error("Input workbook is required (use --input or config input)")
+    tools_sheet = int(args.tools_sheet) if args.tools_sheet.isdigit() else args.tools_sheet
+    try:
+        summary = build_context(cfg, args.output, args.tools, tools_sheet, args.tool_name_col,
+                                args.manifest, args.force)
+    except (OSError, ValueError, KeyError, RuntimeError) as e:
+        sys.stderr.write(f"ERROR: {e}\n")
+        sys.exit(2)
+    print_summary(summary)
+
+
+if __name__ == "__main__":
+    main()
@@ -8,8 +8,13 @@ A robust, configurable Excel→JSON converter for "operation steps" tables.
 - Orders by step index (numeric or lexicographic)
 - Normalizes/ffill IDs from merged-like layouts
 - Parses params as JSON or "k=v; k2=v2" strings
-- Emits one combined JSON (default) or per-case JSON files
+- Emits one combined JSON (default) or per-case JSON files; per-case files are written
+  in parallel and only when their content changed (--compact drops the indentation)
 - NEW: promote selected columns to CASE-LEVEL fields (not repeated in steps)
+- Streaming mode (--stream): reads rows with openpyxl read-only mode and writes each
+  case as soon as its rows end, so memory is bounded by the largest case
+- Batch mode: --sheet all and/or a glob --input convert one sheet per process and
+  merge the results in a fixed (file, sheet) order, reporting case IDs that collide
 
 Usage
 -----
@@ -21,18 +26,38 @@ python excel_to_json.py --input my.xlsx --sheet "Sheet1" --output out.json \
 Or drive it with a YAML config:
 python excel_to_json.py --config config.yaml
 
+Huge workbooks whose rows are grouped by case (.xlsx only):
+python excel_to_json.py --config config.yaml --stream [--stream-format ndjson]
+
+Every sheet of every matching workbook, merged into one output:
+python excel_to_json.py --config config.yaml --input "catalog/*.xlsx" --sheet all [--jobs 8]
+
+As a library (one import, no subprocess per conversion):
+    from excel_to_json2 import Config, convert, convert_frame, load_config
+    cfg = load_config("config.case.yaml")
+    cases = convert(cfg, "my.xlsx", sheet=0)   # load -> normalize -> build -> emit
+
 Dependencies: pandas, openpyxl (for .xlsx). Install if missing:
 pip install pandas openpyxl pyyaml
 """
 from __future__ import annotations
 import argparse
+import collections
+import contextlib
+import functools
+import gc
+import glob
+import hashlib
 import json
 import math
 import os
 import re
 import sys
-from dataclasses import dataclass, field
-from typing import Any, Dict, List, Optional, Tuple, Union
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field, fields, replace
+from itertools import repeat
+from typing import Any, Dict, Iterable, Iterator, List, Mapping, Optional, Tuple, Union
 
 # Optional deps handling
 try:
@@ -40,8 +65,14 @@ try:
 except Exception:  # pragma: no cover
     yaml = None
 
+try:
+    import openpyxl  # type: ignore
+except Exception:  # pragma: no cover
+    openpyxl = None
+
 try:
     import pandas as pd  # type: ignore
+    import numpy as np  # type: ignore
 except Exception as e:  # pragma: no cover
     sys.stderr.write("ERROR: pandas is required. Install with: pip install pandas\n")
     raise
@@ -66,20 +97,25 @@ def _coerce_int(x: Any) -> Optional[int]:
             pass
     return None
 
+# Cells meaning "no params", and stray curly quotes around pasted command lines
+_EMPTY_PARAMS = {"", "nan", "无", "null", "none"}
+_EDGE_QUOTES = "‘’“”"
+
 def _parse_params(s: Any) -> Dict[str, Any]:
     """
     Try multiple formats:
     1) JSON object string: {"k":"v", "n":1}
     2) Semicolon/comma separated k=v pairs: a=1; b=two, c=3
-    3) Empty -> {}
+    3) Empty, missing (NaN) or a "no params" placeholder (nan / 无 / null / none) -> {}
+    Curly quotes left at either end by copy-paste (‘--TestTimes 1) are dropped.
     """
-    if s is None:
+    if s is None or (isinstance(s, float) and math.isnan(s)):
         return {}
     if isinstance(s, (dict, list)):
         # Already structured (e.g., from previous reads)
         return dict(s) if isinstance(s, dict) else {"_list": s}
-    text = str(s).strip()
-    if not text:
+    text = str(s).strip().strip(_EDGE_QUOTES).strip()
+    if text.lower() in _EMPTY_PARAMS:
         return {}
 
     # Try JSON
@@ -106,6 +142,14 @@ def _parse_params(s: Any) -> Dict[str, Any]:
             out.setdefault("_args", []).append(_coerce_scalar(p.strip()))
     return out
 
+def _raw_params(s: Any) -> str:
+    """
+    raw_params mode: the params cell text as read (stripped unless strip_cells is off), "" when missing.
+    """
+    if s is None or (isinstance(s, float) and math.isnan(s)):
+        return ""
+    return s if isinstance(s, str) else str(s)
+
 def _coerce_scalar(v: str) -> Any:
     # Try int
     try:
@@ -127,8 +171,32 @@ def _coerce_scalar(v: str) -> Any:
         return None
     return v
 
-@dataclass
+class _FrozenDict(dict):
+    """
+    Read-only, hashable dict for Config's mapping fields (still a dict for json / yaml / asdict).
+    """
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError("Config is immutable; derive a new one with dataclasses.replace")
+
+    __setitem__ = __delitem__ = __ior__ = _read_only
+    clear = pop = popitem = setdefault = update = _read_only
+
+    def __hash__(self) -> int:
+        return hash(frozenset(self.items()))
+
+    def __reduce__(self):
+        # pickle / deepcopy would otherwise refill the copy item by item through __setitem__
+        return (type(self), (dict(self),))
+
+
+@dataclass(frozen=True)
 class Config:
+    """
+    Converter settings. Immutable (list settings are stored as tuples, mappings as read-only
+    dicts): derive variants with dataclasses.replace, and Config.resolve(header) for the
+    names matched against a particular sheet.
+    """
     input: str = ""
     sheet: Union[str, int, None] = 0
     output: str = "out.json"
@@ -143,13 +211,13 @@ class Config:
     notes_col: Optional[str] = "notes"
 
     # Extra columns you want copied through into each step object
-    extra_cols: List[str] = field(default_factory=list)
+    extra_cols: Tuple[str, ...] = ()
 
     # Forward-fill these columns (helps with merged cells layouts)
-    ffill_cols: List[str] = field(default_factory=lambda: ["case"])
+    ffill_cols: Tuple[str, ...] = ("case",)
 
     # Drop rows where *all* of these columns are NaN/empty (clean separators)
-    drop_if_all_empty: List[str] = field(default_factory=lambda: ["action", "tool", "params", "notes"])
+    drop_if_all_empty: Tuple[str, ...] = ("action", "tool", "params", "notes")
 
     # Output shape: "mapping" -> {case_id: {case_id, steps:[...]}},
     # "list" -> [{"case_id":..., "steps":[...]}]
@@ -162,55 +230,78 @@ class Config:
     infer_columns: bool = True
 
     # NEW: promote selected columns to case-level fields
-    case_level_cols: List[str] = field(default_factory=list)
+    case_level_cols: Tuple[str, ...] = ()
     # Optional rename mapping for case-level fields: {"原列名": "输出键名"}
-    case_level_rename: Dict[str, str] = field(default_factory=dict)
-
-    def apply_inference(self, df_cols: List[str]) -> None:
+    case_level_rename: Mapping[str, str] = field(default_factory=_FrozenDict)
+
+    # Streaming mode: constant-memory read for sheets whose rows are grouped by case
+    stream: bool = False
+    # Streamed output: "json" (same document as the default mode) or "ndjson" (one case per line)
+    stream_format: str = "json"
+
+    # Batch mode (sheet "all" or a glob input): worker processes (None -> CPU count)
+    jobs: Optional[int] = None
+    # Same case ID in several sheets/files: "report" keeps the first and lists the rest, "error" aborts
+    on_collision: str = "report"
+
+    # Output without indentation or spaces after separators
+    compact: bool = False
+
+    # Keep params as the cell text instead of parsing it (e.g. command-line style params)
+    raw_params: bool = False
+    # Keep cells holding NA-like text ("NA", "N/A", "None", "null", ...) as text; only empty cells are missing
+    keep_na_strings: bool = False
+    # Strip surrounding whitespace from text cells (column names are always stripped)
+    strip_cells: bool = True
+
+    def __post_init__(self):
+        # Lists / dicts from YAML, the CLI or callers become tuples / read-only dicts
+        for f in fields(self):
+            v = getattr(self, f.name)
+            if isinstance(v, list):
+                object.__setattr__(self, f.name, tuple(v))
+            elif isinstance(v, dict) and not isinstance(v, _FrozenDict):
+                object.__setattr__(self, f.name, _FrozenDict(v))
+
+    def resolve(self, columns: Iterable[Any]) -> "Config":
+        """
+        The config with its column names matched against a sheet header (infer_columns) and
+        ffill_cols defaulted to the case column. Returns a new Config (self when nothing
+        changes); the result is cached per header signature.
+        """
         if not self.infer_columns:
-            return
-
-        def find(syns: List[str], default: Optional[str]) -> Optional[str]:
-            # match ignoring case and spaces/underscores
-            norm = {re.sub(r"[\s_]+", "", c).lower(): c for c in df_cols}
-            for s in syns:
-                key = re.sub(r"[\s_]+", "", s).lower()
-                if key in norm:
-                    return norm[key]
-            return default
-
-        self.case_id = find(
-            ["case", "case_id", "用例", "用例id", "场景", "场景id", "scenario", "id", "Case名称"],
-            self.case_id
-        ) or self.case_id
-
-        self.step_col = find(
-            ["step", "step_index", "步骤", "序号", "顺序", "order", "idx"],
-            self.step_col
-        ) or self.step_col
-
-        self.action_col = find(
-            ["action", "操作", "行为", "描述", "instruction", "指令", "内容", "测试步骤"],
-            self.action_col
-        ) or self.action_col
-
-        self.tool_col = find(
-            ["tool", "工具", "函数", "接口", "api", "method", "测试工具"],
-            self.tool_col
-        )
-
-        self.params_col = find(
-            ["params", "参数", "arguments", "args", "payload", "body"],
-            self.params_col
+            return self
+        updates = _infer_columns(
+            tuple(str(c) for c in columns), self.case_id, self.step_col, self.action_col,
+            self.tool_col, self.params_col, self.notes_col, not self.ffill_cols,
         )
-
-        self.notes_col = find(
-            ["notes", "备注", "说明", "comment", "commentary"],
-            self.notes_col
-        )
-
-        if not self.ffill_cols:
-            self.ffill_cols = [self.case_id]
+        return replace(self, **dict(updates)) if updates else self
+
+_SYNONYMS = {
+    "case_id": ("case", "case_id", "用例", "用例id", "场景", "场景id", "scenario", "id", "Case名称"),
+    "step_col": ("step", "step_index", "步骤", "序号", "顺序", "order", "idx"),
+    "action_col": ("action", "操作", "行为", "描述", "instruction", "指令", "内容", "测试步骤"),
+    "tool_col": ("tool", "工具", "函数", "接口", "api", "method", "测试工具"),
+    "params_col": ("params", "参数", "arguments", "args", "payload", "body"),
+    "notes_col": ("notes", "备注", "说明", "comment", "commentary"),
+}
+@functools.lru_cache(maxsize=1024)
+def _infer_columns(columns: Tuple[str, ...], case_id: str, step_col: str, action_col: str,
+                   tool_col: Optional[str], params_col: Optional[str], notes_col: Optional[str],
+                   default_ffill: bool) -> Tuple[Tuple[str, Any], ...]:
+    # Header signature -> changed Config fields, as (field, value) pairs
+    # Match ignoring case and spaces/underscores
+    norm = {re.sub(r"[\s_]+", "", c).lower(): c for c in columns}
+    current = {"case_id": case_id, "step_col": step_col, "action_col": action_col,
+               "tool_col": tool_col, "params_col": params_col, "notes_col": notes_col}
+    # A column without a matching synonym keeps its configured name
+    resolved = {name: next((norm[k] for k in (re.sub(r"[\s_]+", "", s).lower() for s in syns) if k in norm),
+                           current[name])
+                for name, syns in _SYNONYMS.items()}
+    updates = [(k, v) for k, v in resolved.items() if v != current[k]]
+    if default_ffill:
+        updates.append(("ffill_cols", (resolved["case_id"],)))
+    return tuple(updates)
 
 def load_config(path: Optional[str]) -> Config:
     if not path:
@@ -227,15 +318,38 @@ def load_config(path: Optional[str]) -> Config:
     cfg = Config(**cfg_kwargs)
     return cfg
 
+def _strip_column(s):
+    """
+    Column-wise equivalent of ``s.map(_strip)``: only string cells are stripped, and
+    columns without strings get the same numeric dtype inference ``map`` would apply
+    (e.g. [1, None] -> [1.0, nan]), so downstream values are unchanged.
+    """
+    if s.dtype != object:
+        return s.str.strip() if pd.api.types.is_string_dtype(s.dtype) else s
+    values = s.to_numpy(dtype=object)
+    kind = pd.api.types.infer_dtype(values, skipna=True)
+    if kind == "string":
+        is_str = ~pd.isna(values)
+    elif kind in ("mixed", "mixed-integer"):
+        is_str = np.fromiter(map(isinstance, values, repeat(str)), dtype=bool, count=len(values))
+    else:
+        is_str = None
+    if is_str is None or not is_str.any():
+        return s.infer_objects()
+    values = values.copy()
+    values[is_str] = list(map(str.strip, values[is_str]))
+    return pd.Series(values, index=s.index, name=s.name)
+
 def normalize_dataframe(df, cfg: Config):
     # Strip column names
     df.columns = [str(c).strip() for c in df.columns]
-    # Inference
-    cfg.apply_inference(list(df.columns))
+    # Inference (build_cases resolves the same header to the same config)
+    cfg = cfg.resolve(df.columns)
 
     # Strip whitespace from string cells
-    for c in df.columns:
-        df[c] = df[c].map(_strip)
+    if cfg.strip_cells:
+        for c in df.columns:
+            df[c] = _strip_column(df[c])
 
     # Forward fill key cols to handle merged-cell-like layouts
     for c in cfg.ffill_cols:
@@ -243,89 +357,201 @@ def normalize_dataframe(df, cfg: Config):
             df[c] = df[c].ffill()
 
     # Drop separator rows where all key content columns are empty
-    to_check = [c for c in [cfg.action_col, cfg.tool_col, cfg.params_col, cfg.notes_col] if c and c in df.columns]
+    to_check = _empty_check_cols(cfg, df.columns)
     if to_check:
         mask_all_empty = df[to_check].isna().all(axis=1)
         df = df.loc[~mask_all_empty].copy()
 
     return df
 
-def _first_non_empty(series) -> Any:
+def _empty_check_cols(cfg: Config, columns: Iterable[str]) -> List[str]:
+    """
+    Columns of a resolved config that decide whether a row is an empty separator row:
+    drop_if_all_empty entries are column names or the roles "step", "action", "tool",
+    "params", "notes". Falls back to the action/tool/params/notes columns when none match.
+    """
+    present = set(columns)
+    roles = {"step": cfg.step_col, "action": cfg.action_col, "tool": cfg.tool_col,
+             "params": cfg.params_col, "notes": cfg.notes_col}
+    cols = [roles.get(c, c) for c in cfg.drop_if_all_empty]
+    cols = [c for c in dict.fromkeys(cols) if c and c in present]
+    if cols:
+        return cols
+    return [c for c in [cfg.action_col, cfg.tool_col, cfg.params_col, cfg.notes_col] if c and c in present]
+
+
+def _first_non_empty(series, strip: bool = True) -> Any:
+    # strip=False (strip_cells off): whitespace-only text counts as a value
     for v in series:
         if v is None:
             continue
         if isinstance(v, float) and pd.isna(v):
             continue
-        s = str(v).strip()
+        s = str(v).strip() if strip else str(v)
         if s != "":
             return v
     return None
 
+def _map_unique(values, fn) -> List[Any]:
+    """
+    Apply ``fn`` once per distinct cell value instead of once per row.
+    Pure string (+ empty) columns are factorized; anything else goes through a
+    type-aware cache so 1, 1.0 and True are still parsed separately.
+    Rows sharing a value share the (read-only) result object.
+    """
+    values = np.asarray(values, dtype=object)
+    if pd.api.types.infer_dtype(values, skipna=True) in ("string", "empty"):
+        codes, uniques = pd.factorize(values, use_na_sentinel=True)
+        mapped = np.empty(len(uniques) + 1, dtype=object)
+        mapped[:-1] = [fn(u) for u in uniques]
+        # code -1 (missing) picks the last slot
+        na = values[codes == -1]
+        mapped[-1] = fn(na[0]) if len(na) else None
+        return mapped[codes].tolist()
+    cache: Dict[Any, Any] = {}
+    out: List[Any] = []
+    for v in values:
+        key = (v.__class__, v)
+        try:
+            r = cache[key]
+        except KeyError:
+            r = cache[key] = fn(v)
+        except TypeError:  # unhashable
+            r = fn(v)
+        out.append(r)
+    return out
+
+@contextlib.contextmanager
+def _gc_paused():
+    """
+    Building millions of small dicts triggers repeated full GC passes over objects that
+    are all still alive; pause the cyclic collector for the duration (nothing here is cyclic).
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+def _steps_to_int(values) -> List[Optional[int]]:
+    """
+    ``int(v)`` / ``None`` for missing, per row, without a per-row isna call where possible.
+    """
+    na = pd.isna(values)
+    if values.dtype.kind in "iu":
+        return values.tolist()
+    if values.dtype.kind == "f" and (na.all() or np.nanmax(np.abs(values)) < 2 ** 62):
+        out = np.where(na, 0, values).astype(np.int64).tolist()
+        for i in np.flatnonzero(na).tolist():
+            out[i] = None
+        return out
+    return [None if m else int(v) for v, m in zip(values.tolist(), na.tolist())]
+
 def build_cases(df, cfg: Config):
+    """
+    Columnar implementation: step indices and params are computed once per distinct
+    value, auto-steps come from ``groupby().cumcount()``, rows are sorted once by
+    (case, step) and cases are sliced out of the sorted order by group boundaries.
+    Output (including key order, NaN/None handling and case order) matches the
+    original groupby/apply + iterrows implementation.
+    """
+    cfg = cfg.resolve(df.columns)
     # Check mandatory columns
     for col in [cfg.case_id, cfg.action_col]:
         if col not in df.columns:
             raise KeyError(f"Required column missing after inference: {col}")
 
-    # Sort within case by step order if possible
+    n = len(df)
+    grouped = df.groupby(cfg.case_id, dropna=False, sort=False)
+    codes = grouped.ngroup().to_numpy()
+
+    # Step index per row (same dtype inference as Series.map(_coerce_int))
     step_col = cfg.step_col if cfg.step_col in df.columns else None
     if step_col:
-        df["_step_idx"] = df[step_col].map(_coerce_int)
+        step = pd.Series(_map_unique(df[step_col].to_numpy(dtype=object), _coerce_int), index=df.index)
     else:
-        df["_step_idx"] = None
-
-    # Auto-step if needed
-    def assign_autostep(group):
-        if group["_step_idx"].isna().all() and cfg.autostep:
-            group = group.copy()
-            group["_step_idx"] = range(1, len(group) + 1)
-        return group
-
-    df = df.groupby(cfg.case_id, dropna=False, sort=False).apply(assign_autostep).reset_index(drop=True)
-
-    # Now sort within each case
-    df = df.sort_values(by=[cfg.case_id, "_step_idx"], kind="mergesort")
+        step = pd.Series([None] * n, index=df.index, dtype=object)
+
+    # Auto-step cases whose step column is entirely missing
+    if cfg.autostep and n:
+        all_na = step.isna().groupby(codes).transform("all").to_numpy()
+        if all_na.any():
+            auto = grouped.cumcount().to_numpy() + 1
+            step_values = step.to_numpy()
+            if all_na.all():
+                step = pd.Series(auto, index=df.index)
+            else:
+                step = pd.Series(np.where(all_na, auto, step_values), index=df.index)
+
+    # Sort once by (case, step); stable, missing steps last
+    keys = pd.DataFrame({"case": df[cfg.case_id].reset_index(drop=True), "step": step.reset_index(drop=True)})
+    order = keys.sort_values(by=["case", "step"], kind="mergesort").index.to_numpy()
+
+    sorted_codes = codes[order]
+    bounds = np.flatnonzero(np.diff(sorted_codes)) + 1
+    starts = [0] + bounds.tolist()
+    ends = bounds.tolist() + [n]
+
+    def column(col: str) -> List[Any]:
+        return df[col].to_numpy(dtype=object)[order].tolist()
+
+    case_vals = column(cfg.case_id)
+    steps_sorted = _steps_to_int(step.to_numpy()[order])
+    actions = column(cfg.action_col)
+    tools = column(cfg.tool_col) if cfg.tool_col and cfg.tool_col in df.columns else None
+    params = (_map_unique(df[cfg.params_col].to_numpy(dtype=object)[order],
+                          _raw_params if cfg.raw_params else _parse_params)
+              if cfg.params_col and cfg.params_col in df.columns else None)
+    notes = column(cfg.notes_col) if cfg.notes_col and cfg.notes_col in df.columns else None
+
+    # Avoid copying columns that were promoted to case-level
+    excluded_from_step = set(cfg.case_level_cols or [])
+    extras = [(extra, column(extra)) for extra in (cfg.extra_cols or [])
+              if extra in df.columns and extra not in excluded_from_step]
+    case_level = [(cfg.case_level_rename.get(col, col), column(col))
+                  for col in (cfg.case_level_cols or []) if col in df.columns]
 
     # Build case objects
     cases_out: Dict[Any, Dict[str, Any]] = {}
-    for case_id, g in df.groupby(cfg.case_id, dropna=False, sort=False):
-        # CASE-LEVEL FIELDS
-        case_obj: Dict[str, Any] = {
-            "case_id": case_id,
-        }
-        # collect case-level fields (first non-empty)
-        for col in cfg.case_level_cols or []:
-            if col in g.columns:
-                key = cfg.case_level_rename.get(col, col)
-                case_obj[key] = _first_non_empty(g[col])
-
-        steps = []
-        # Avoid copying columns that were promoted to case-level
-        excluded_from_step = set(cfg.case_level_cols or [])
-        for _, row in g.iterrows():
-            step_obj = {
-                "step": int(row["_step_idx"]) if not pd.isna(row["_step_idx"]) else None,
-                "action": row.get(cfg.action_col),
+    with _gc_paused():
+        for start, end in zip(starts, ends):
+            if start >= end:
+                continue
+            case_id = case_vals[start]
+            if pd.isna(case_id):
+                # groupby(dropna=False) keys the missing-case group as NaN
+                case_id = np.nan
+            # CASE-LEVEL FIELDS
+            case_obj: Dict[str, Any] = {
+                "case_id": case_id,
             }
-            if cfg.tool_col and cfg.tool_col in g.columns:
-                step_obj["tool"] = row.get(cfg.tool_col)
-            if cfg.params_col and cfg.params_col in g.columns:
-                step_obj["params"] = _parse_params(row.get(cfg.params_col))
-            if cfg.notes_col and cfg.notes_col in g.columns:
-                note_val = row.get(cfg.notes_col)
-                if isinstance(note_val, str) and note_val.strip():
-                    step_obj["notes"] = note_val
-
-            # Copy extra columns except those promoted to case-level
-            for extra in (cfg.extra_cols or []):
-                if extra in g.columns and extra not in excluded_from_step:
-                    step_obj[extra] = row.get(extra)
-
-            steps.append(step_obj)
-
-        case_obj["num_steps"] = len(steps)
-        case_obj["steps"] = steps
-        cases_out[case_id] = case_obj
+            # collect case-level fields (first non-empty)
+            for key, vals in case_level:
+                case_obj[key] = _first_non_empty(vals[start:end], cfg.strip_cells)
+
+            steps = []
+            for i in range(start, end):
+                step_obj = {
+                    "step": steps_sorted[i],
+                    "action": actions[i],
+                }
+                if tools is not None:
+                    step_obj["tool"] = tools[i]
+                if params is not None:
+                    step_obj["params"] = params[i]
+                if notes is not None:
+                    note_val = notes[i]
+                    if isinstance(note_val, str) and (note_val.strip() or not cfg.strip_cells and note_val):
+                        step_obj["notes"] = note_val
+                for extra, vals in extras:
+                    step_obj[extra] = vals[i]
+                steps.append(step_obj)
+
+            case_obj["num_steps"] = len(steps)
+            case_obj["steps"] = steps
+            cases_out[case_id] = case_obj
 
     return cases_out
 
@@ -335,17 +561,480 @@ def emit_output(cases: Dict[Any, Dict[str, Any]], cfg: Config) -> Union[Dict, Li
     # default: mapping
     return cases
 
-def write_json(obj, path: str):
+# Per-case files are small and I/O bound, so threads (not processes) overlap the writes
+_WRITE_THREADS = min(32, (os.cpu_count() or 1) * 4)
+
+def _dumps(obj: Any, compact: bool = False) -> str:
+    if compact:
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+    return json.dumps(obj, ensure_ascii=False, indent=2)
+
+def _indented(obj: Any) -> str:
+    # json.dump(..., indent=2) of one mapping item / list element, as it appears inside the document
+    return json.dumps(obj, ensure_ascii=False, indent=2)[2:-2]
+
+def _write_document(f, items: Iterable[Tuple[Any, Any]], as_list: bool, compact: bool = False) -> int:
+    """
+    Write a mapping ({key: obj, ...}) or list ([obj, ...]) one item at a time; the text is
+    the same as json.dump of the whole object with indent=2 (or compact separators).
+    Returns the number of items.
+    """
+    open_, close = ("[", "]") if as_list else ("{", "}")
+    n = 0
+    for key, obj in items:
+        if compact:
+            f.write("," if n else open_)
+            f.write(_dumps(obj, True) if as_list else _dumps({key: obj}, True)[1:-1])
+        else:
+            f.write(",\n" if n else open_ + "\n")
+            f.write(_indented([obj] if as_list else {key: obj}))
+        n += 1
+    if compact:
+        f.write(close if n else open_ + close)
+    else:
+        f.write("\n" + close if n else open_ + close)
+    return n
+
+@contextlib.contextmanager
+def _atomic_open(path: str, mode: str = "w"):
+    # Write next to the target and rename at the end, so a failed run leaves no truncated output
+    tmp = f"{path}.tmp"
+    try:
+        with open(tmp, mode, **({} if "b" in mode else {"encoding": "utf-8"})) as f:
+            yield f
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+def write_json(obj, path: str, compact: bool = False):
+    """
+    Write obj to path atomically; mappings and lists are written item by item instead of being
+    rendered into one string first.
+    """
     os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(obj, f, ensure_ascii=False, indent=2)
+    with _atomic_open(path) as f:
+        if isinstance(obj, dict):
+            _write_document(f, obj.items(), False, compact)
+        elif isinstance(obj, list):
+            _write_document(f, ((None, o) for o in obj), True, compact)
+        else:
+            f.write(_dumps(obj, compact))
+
+def _case_filename(cid: Any) -> str:
+    safe = re.sub(r"[^\w\-.]+", "_", str(cid) if cid is not None else "null")
+    return f"{safe}.json"
+
+def _write_if_changed(path: str, obj: Any, compact: bool) -> bool:
+    """
+    Write one case file unless the file already holds exactly these bytes (same size, same
+    sha256), so untouched cases keep their mtime. Returns whether the file was written.
+    """
+    data = _dumps(obj, compact).encode("utf-8")
+    try:
+        if os.path.getsize(path) == len(data):
+            with open(path, "rb") as f:
+                if hashlib.sha256(f.read()).digest() == hashlib.sha256(data).digest():
+                    return False
+    except OSError:
+        pass
+    with _atomic_open(path, "wb") as f:
+        f.write(data)
+    return True
 
-def write_per_case(cases: Dict[Any, Dict[str, Any]], out_dir: str):
+def write_per_case(cases: Union[Dict[Any, Dict[str, Any]], Iterable[Tuple[Any, Dict[str, Any]]]], out_dir: str,
+                   compact: bool = False, threads: Optional[int] = None) -> Tuple[int, int]:
+    """
+    One <case>.json per case in out_dir, written by a thread pool as cases arrive (a dict or an
+    iterator of (case_id, case) pairs). Each file is replaced atomically and skipped when its
+    content is unchanged. Returns (written, unchanged).
+    """
     os.makedirs(out_dir, exist_ok=True)
-    for cid, obj in cases.items():
-        safe = re.sub(r"[^\w\-.]+", "_", str(cid) if cid is not None else "null")
-        path = os.path.join(out_dir, f"{safe}.json")
-        write_json(obj, path)
+    items = cases.items() if isinstance(cases, dict) else cases
+    threads = threads or _WRITE_THREADS
+    written = unchanged = 0
+    pending: collections.deque = collections.deque()
+    # Latest write per file name: two IDs that sanitize to the same name keep the later one
+    by_name: Dict[str, Future] = {}
+
+    def drain(limit: int) -> None:
+        nonlocal written, unchanged
+        while len(pending) > limit:
+            if pending.popleft().result():
+                written += 1
+            else:
+                unchanged += 1
+
+    with ThreadPoolExecutor(max_workers=threads) as ex:
+        try:
+            for cid, obj in items:
+                name = _case_filename(cid)
+                if name in by_name:
+                    by_name[name].result()
+                fut = ex.submit(_write_if_changed, os.path.join(out_dir, name), obj, compact)
+                by_name[name] = fut
+                pending.append(fut)
+                # Bound the cases held in memory while a slow disk catches up
+                drain(threads * 4)
+            drain(0)
+        finally:
+            for fut in pending:
+                fut.cancel()
+    return written, unchanged
+
+# ---------- Streaming mode ----------
+
+# pandas' default na_values: read_excel turns cells holding exactly these strings into NaN
+_NA_STRINGS = frozenset([
+    "", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND", "1.#QNAN",
+    "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null",
+])
+# Missing cells are this one NaN object, so grouping can compare keys by identity
+_NAN = float("nan")
+
+# keep_na_strings: only empty text is missing, as with read_excel(keep_default_na=False, na_values=[""])
+_EMPTY_STRINGS = frozenset([""])
+
+def _stream_cell(v: Any, na_strings: frozenset = _NA_STRINGS, strip: bool = True) -> Any:
+    """
+    One openpyxl cell value as read_excel(dtype=object) + _strip would see it
+    (na_strings / strip follow keep_na_strings / strip_cells).
+    """
+    if v is None:
+        return _NAN
+    if isinstance(v, str):
+        return _NAN if v in na_strings else v.strip() if strip else v
+    if isinstance(v, float):
+        if math.isnan(v):
+            return _NAN
+        # read_excel returns integral numbers as int
+        return int(v) if v.is_integer() else v
+    return v
+
+def _is_missing(v: Any) -> bool:
+    return v is _NAN or v is None or (isinstance(v, float) and math.isnan(v))
+
+def _stream_sheet(wb, sheet: Union[str, int, None]):
+    if sheet is None:
+        return wb.worksheets[0]
+    if isinstance(sheet, int):
+        return wb.worksheets[sheet]
+    if sheet in wb.sheetnames:
+        return wb[sheet]
+    if str(sheet).strip().isdigit():
+        return wb.worksheets[int(sheet)]
+    raise KeyError(f"Worksheet {sheet!r} not found in {wb.sheetnames}")
+
+def _stream_header(row: Tuple[Any, ...]) -> List[str]:
+    # Same column labels as read_excel: blanks become "Unnamed: i", duplicates get ".1", ".2", ...
+    cells = list(row)
+    while cells and cells[-1] is None:
+        cells.pop()
+    cols: List[str] = []
+    seen: Dict[str, int] = {}
+    for i, c in enumerate(cells):
+        name = f"Unnamed: {i}" if c is None else str(c).strip()
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        else:
+            seen[name] = 0
+        cols.append(name)
+    return cols
+
+def _case_from_rows(case_id: Any, rows: List[Tuple[Any, ...]], idx: Dict[str, int], cfg: Config) -> Dict[str, Any]:
+    """
+    Build one case object from its (already normalized) rows, with the same field order,
+    step sorting and autostep rules as build_cases.
+    """
+    step_i = idx.get(cfg.step_col)
+    steps_idx = [_coerce_int(r[step_i]) for r in rows] if step_i is not None else [None] * len(rows)
+    if cfg.autostep and all(s is None for s in steps_idx):
+        steps_idx = list(range(1, len(rows) + 1))
+    # Stable sort by step, missing steps last
+    order = sorted(range(len(rows)), key=lambda i: (steps_idx[i] is None, steps_idx[i] or 0))
+
+    case_obj: Dict[str, Any] = {"case_id": case_id}
+    for col in cfg.case_level_cols or []:
+        if col in idx:
+            j = idx[col]
+            case_obj[cfg.case_level_rename.get(col, col)] = _first_non_empty((rows[i][j] for i in order), cfg.strip_cells)
+
+    action_i = idx[cfg.action_col]
+    tool_i = idx.get(cfg.tool_col) if cfg.tool_col else None
+    params_i = idx.get(cfg.params_col) if cfg.params_col else None
+    notes_i = idx.get(cfg.notes_col) if cfg.notes_col else None
+    excluded_from_step = set(cfg.case_level_cols or [])
+    extras = [(extra, idx[extra]) for extra in (cfg.extra_cols or [])
+              if extra in idx and extra not in excluded_from_step]
+
+    steps = []
+    for i in order:
+        row = rows[i]
+        step_obj = {"step": steps_idx[i], "action": row[action_i]}
+        if tool_i is not None:
+            step_obj["tool"] = row[tool_i]
+        if params_i is not None:
+            step_obj["params"] = (_raw_params if cfg.raw_params else _parse_params)(row[params_i])
+        if notes_i is not None:
+            note_val = row[notes_i]
+            if isinstance(note_val, str) and (note_val.strip() or not cfg.strip_cells and note_val):
+                step_obj["notes"] = note_val
+        for extra, j in extras:
+            step_obj[extra] = row[j]
+        steps.append(step_obj)
+    case_obj["num_steps"] = len(steps)
+    case_obj["steps"] = steps
+    return case_obj
+
+def normalize_rows(cfg: Config, rows: Iterator[Tuple[Any, ...]]
+                   ) -> Tuple[Config, Dict[str, int], Iterator[Tuple[int, Tuple[Any, ...]]]]:
+    """
+    Row-wise normalize_dataframe for raw sheet rows (openpyxl values): the header is the first
+    non-blank row, the config is resolved against it, and the returned iterator yields
+    (sheet row number, row) with cells normalized, ffill_cols filled and separator rows dropped.
+    Returns (resolved config, column index, rows); an empty sheet gives an empty index and no rows.
+    """
+    rownum = 0
+    cols: Optional[List[str]] = None
+    for raw in rows:
+        rownum += 1
+        if any(v is not None for v in raw):
+            cols = _stream_header(raw)
+            break
+    if cols is None:
+        return cfg, {}, iter(())
+    cfg = cfg.resolve(cols)
+    for col in [cfg.case_id, cfg.action_col]:
+        if col not in cols:
+            raise KeyError(f"Required column missing after inference: {col}")
+    idx = {c: i for i, c in enumerate(cols)}
+    width = len(cols)
+    ffill = [idx[c] for c in cfg.ffill_cols if c in idx]
+    to_check = [idx[c] for c in _empty_check_cols(cfg, cols)]
+
+    cell = _stream_cell
+    if cfg.keep_na_strings or not cfg.strip_cells:
+        cell = functools.partial(_stream_cell, na_strings=_EMPTY_STRINGS if cfg.keep_na_strings else _NA_STRINGS,
+                                 strip=cfg.strip_cells)
+
+    def gen() -> Iterator[Tuple[int, Tuple[Any, ...]]]:
+        last = {j: _NAN for j in ffill}
+        for num, raw in enumerate(rows, start=rownum + 1):
+            if len(raw) < width:
+                raw = raw + (None,) * (width - len(raw))
+            row = [cell(v) for v in raw[:width]]
+            for j in ffill:
+                if _is_missing(row[j]):
+                    row[j] = last[j]
+                else:
+                    last[j] = row[j]
+            if to_check and all(_is_missing(row[j]) for j in to_check):
+                continue
+            yield num, tuple(row)
+
+    return cfg, idx, gen()
+
+@contextlib.contextmanager
+def open_sheet_rows(path: str, sheet: Union[str, int, None]):
+    """
+    Raw value rows of one sheet, read with openpyxl in read-only mode.
+    """
+    if openpyxl is None:
+        raise RuntimeError("openpyxl is required for streaming mode. Install with: pip install openpyxl")
+    wb = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        yield _stream_sheet(wb, sheet).iter_rows(values_only=True)
+    finally:
+        wb.close()
+
+def iter_cases_stream(cfg: Config) -> Iterator[Tuple[Any, Dict[str, Any]]]:
+    """
+    Yield (case_id, case_obj) while reading the sheet row by row (openpyxl read-only).
+    ffill and separator-row dropping happen on the fly; a case is emitted as soon as a row
+    with a different case ID arrives, so only the current case is held in memory.
+
+    Differs from the default mode in two ways: cases come out in sheet order (the default
+    mode sorts them by case ID), and values keep their per-cell types (no column-wide dtype
+    inference, so an integer ID column with blanks stays int instead of becoming float).
+    Raises ValueError if a case's rows are not contiguous.
+    """
+    with open_sheet_rows(cfg.input, cfg.sheet) as raw_rows:
+        cfg, idx, rows = normalize_rows(cfg, raw_rows)
+        current: List[Tuple[Any, ...]] = []
+        key: Any = None
+        done = set()
+        for rownum, row in rows:
+            cid = row[idx[cfg.case_id]]
+            if current and not (cid is key or cid == key):
+                done.add(key)
+                yield key, _case_from_rows(key, current, idx, cfg)
+                current = []
+            if not current:
+                if cid in done:
+                    raise ValueError(f"Case {cid!r} reappears at row {rownum} after its rows ended; "
+                                     "streaming mode needs rows grouped by case (sort the sheet or drop --stream)")
+                key = cid
+            current.append(row)
+        if current:
+            yield key, _case_from_rows(key, current, idx, cfg)
+
+def write_stream(cases: Iterator[Tuple[Any, Dict[str, Any]]], cfg: Config) -> int:
+    """
+    Write cases as they arrive: per-case files, NDJSON, or the same JSON document
+    (mapping or list) the default mode produces. Returns the number of cases.
+    """
+    if cfg.per_case:
+        return sum(write_per_case(cases, cfg.output, cfg.compact))
+    os.makedirs(os.path.dirname(os.path.abspath(cfg.output)), exist_ok=True)
+    n = 0
+    with _atomic_open(cfg.output) as f:
+        if cfg.stream_format == "ndjson":
+            for _, obj in cases:
+                f.write(json.dumps(obj, ensure_ascii=False))
+                f.write("\n")
+                n += 1
+        else:
+            n = _write_document(f, cases, cfg.output_mode == "list", cfg.compact)
+    return n
+
+# ---------- Batch mode (many sheets / files) ----------
+
+def _is_glob(path: str) -> bool:
+    return any(ch in path for ch in "*?[")
+
+def is_batch(cfg: Config) -> bool:
+    return str(cfg.sheet).strip().lower() == "all" or _is_glob(cfg.input or "")
+
+def expand_tasks(cfg: Config) -> List[Tuple[str, Union[str, int]]]:
+    """
+    (path, sheet) pairs in a fixed order: matching files sorted by path, sheets in workbook order.
+    """
+    if _is_glob(cfg.input):
+        # "~$..." are Excel's lock files for workbooks that are open
+        paths = [p for p in sorted(glob.glob(cfg.input, recursive=True))
+                 if os.path.isfile(p) and not os.path.basename(p).startswith("~$")]
+    else:
+        paths = [cfg.input]
+    tasks: List[Tuple[str, Union[str, int]]] = []
+    for path in paths:
+        if str(cfg.sheet).strip().lower() == "all":
+            with pd.ExcelFile(path) as xf:
+                tasks.extend((path, name) for name in xf.sheet_names)
+        else:
+            sheet = cfg.sheet
+            tasks.append((path, int(sheet) if isinstance(sheet, str) and sheet.strip().isdigit() else sheet))
+    return tasks
+
+def convert_sheet(cfg: Config, path: str, sheet: Union[str, int]) -> Tuple[Dict[Any, Dict[str, Any]], int, float]:
+    """
+    Convert one sheet; returns (cases, rows, seconds). Runs in a worker process, so it only
+    touches its own copy of the config.
+    """
+    t0 = time.perf_counter()
+    cfg = replace(cfg, input=path, sheet=sheet)
+    if cfg.stream:
+        cases = dict(iter_cases_stream(cfg))
+        rows = sum(c["num_steps"] for c in cases.values())
+    else:
+        df = normalize_dataframe(load_sheet(path, sheet, cfg.keep_na_strings), cfg)
+        rows = len(df)
+        cases = build_cases(df, cfg)
+    return cases, rows, time.perf_counter() - t0
+
+def _task_label(path: str, sheet: Union[str, int]) -> str:
+    return f"{path}[{sheet}]"
+
+def convert_many(cfg: Config, tasks: List[Tuple[str, Union[str, int]]], log=sys.stderr
+                 ) -> Tuple[Dict[Any, Dict[str, Any]], List[Tuple[Any, str, str]]]:
+    """
+    Convert all tasks (in a process pool when there is more than one) and merge them in task
+    order, whatever order the workers finish in. Returns (cases, collisions), where each
+    collision is (case_id, kept_from, dropped_from).
+    """
+    jobs = max(1, min(cfg.jobs or os.cpu_count() or 1, len(tasks)))
+    results: List[Any] = [None] * len(tasks)
+    t0 = time.perf_counter()
+
+    def progress(i: int) -> None:
+        cases, rows, secs = results[i]
+        done = sum(r is not None for r in results)
+        log.write(f"[{done}/{len(tasks)}] {_task_label(*tasks[i])}: {rows} rows, {len(cases)} cases, {secs:.2f}s\n")
+
+    if jobs == 1:
+        for i, (path, sheet) in enumerate(tasks):
+            try:
+                results[i] = convert_sheet(cfg, path, sheet)
+            except Exception as e:
+                raise RuntimeError(f"{_task_label(path, sheet)}: {e}") from e
+            progress(i)
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as ex:
+            futures = {ex.submit(convert_sheet, cfg, path, sheet): i for i, (path, sheet) in enumerate(tasks)}
+            for fut in as_completed(futures):
+                i = futures[fut]
+                try:
+                    results[i] = fut.result()
+                except Exception as e:
+                    for f in futures:
+                        f.cancel()
+                    raise RuntimeError(f"{_task_label(*tasks[i])}: {e}") from e
+                progress(i)
+    wall = time.perf_counter() - t0
+
+    merged: Dict[Any, Dict[str, Any]] = {}
+    source: Dict[Any, str] = {}
+    collisions: List[Tuple[Any, str, str]] = []
+    for task, (cases, _, _) in zip(tasks, results):
+        label = _task_label(*task)
+        for cid, obj in cases.items():
+            if cid in merged:
+                collisions.append((cid, source[cid], label))
+                continue
+            merged[cid] = obj
+            source[cid] = label
+
+    rows = sum(r[1] for r in results)
+    busy = sum(r[2] for r in results)
+    files = len({path for path, _ in tasks})
+    log.write(f"Converted {len(tasks)} sheets from {files} files: {rows} rows, {len(merged)} cases "
+              f"in {wall:.2f}s ({rows / wall if wall else 0:.0f} rows/s, {jobs} workers, "
+              f"{busy / wall if wall else 0:.1f}x parallelism)\n")
+    return merged, collisions
+
+# ---------- Library API ----------
+#
+# load_sheet -> normalize_dataframe -> build_cases -> emit_output, with convert_frame / convert
+# chaining them. Config is immutable and column inference is cached per header, so a
+# long-lived process can convert many sheets with one import and no per-call setup.
+
+def load_sheet(source: Any, sheet: Union[str, int, None] = 0, keep_na_strings: bool = False):
+    """
+    Read one sheet (path or file-like object) as a DataFrame of raw cell values.
+    sheet=None reads the first sheet. keep_na_strings: only empty cells become NaN.
+    """
+    if keep_na_strings:
+        df = pd.read_excel(source, sheet_name=sheet, dtype=object, keep_default_na=False, na_values=[""])
+    else:
+        df = pd.read_excel(source, sheet_name=sheet, dtype=object)
+    if isinstance(df, dict):
+        df = next(iter(df.values()))
+    return df
+
+def convert_frame(df, cfg: Config) -> Dict[Any, Dict[str, Any]]:
+    """
+    normalize + build for a DataFrame already in memory; returns {case_id: case}.
+    """
+    return build_cases(normalize_dataframe(df, cfg), cfg)
+
+def convert(cfg: Config, source: Any = None, sheet: Union[str, int, None] = None) -> Union[Dict, List[Dict]]:
+    """
+    load -> normalize -> build -> emit for one sheet; source and sheet default to cfg.input
+    and cfg.sheet. Returns the output object (mapping or list, per cfg.output_mode).
+    """
+    df = load_sheet(cfg.input if source is None else source, cfg.sheet if sheet is None else sheet,
+                    cfg.keep_na_strings)
+    return emit_output(convert_frame(df, cfg), cfg)
 
 def _parse_kv_list(pairs: Optional[List[str]]) -> Dict[str, str]:
     out: Dict[str, str] = {}
@@ -361,7 +1050,7 @@ def main():
     ap = argparse.ArgumentParser(description="Excel→JSON converter for step tables")
     ap.add_argument("--config", type=str, default=None, help="YAML config path")
     ap.add_argument("--input", type=str, help="Excel file (.xlsx/.xls)")
-    ap.add_argument("--sheet", type=str, help="Sheet name or index", default=None)
+    ap.add_argument("--sheet", type=str, help='Sheet name or index, or "all" for every sheet', default=None)
     ap.add_argument("--output", type=str, help="Output JSON path (or directory if --per-case)", default=None)
     ap.add_argument("--per-case", action="store_true", help="Emit one JSON per case to output directory")
 
@@ -383,54 +1072,93 @@ def main():
     ap.add_argument("--case-level-cols", dest="case_level_cols", type=str, nargs="*", help="Columns to promote to case-level (not repeated in steps)")
     ap.add_argument("--case-level-rename", dest="case_level_rename", type=str, nargs="*", help='Rename mapping for case-level fields, e.g. 原=out 原2=out2')
 
+    # Streaming
+    ap.add_argument("--stream", dest="stream", action="store_true", default=None, help="Constant-memory mode for .xlsx sheets whose rows are grouped by case")
+    ap.add_argument("--stream-format", dest="stream_format", type=str, choices=["json", "ndjson"], help="Streamed output: JSON document (default) or one case per line")
+
+    ap.add_argument("--raw-params", dest="raw_params", action="store_true", default=None, help="Keep params as cell text instead of parsing them")
+    ap.add_argument("--keep-na-strings", dest="keep_na_strings", action="store_true", default=None, help='Keep cells like "NA" / "N/A" / "None" as text (only empty cells are missing)')
+    ap.add_argument("--no-strip", dest="strip_cells", action="store_false", default=None, help="Keep surrounding whitespace in text cells")
+    ap.add_argument("--compact", dest="compact", action="store_true", default=None, help="Write JSON without indentation")
+
+    # Batch mode
+    ap.add_argument("--jobs", dest="jobs", type=int, help="Worker processes for --sheet all / glob inputs (default: CPU count)")
+    ap.add_argument("--on-collision", dest="on_collision", type=str, choices=["report", "error"], help="Same case ID in several sheets: keep the first and report (default), or abort")
+
     args = ap.parse_args()
 
     cfg = load_config(args.config)
     # CLI overrides
-    for k, v in vars(args).items():
-        if k in {"config"}:
-            continue
-        if v is not None:
-            if k == "case_level_rename":
-                setattr(cfg, k, _parse_kv_list(v))
-            else:
-                setattr(cfg, k, v)
+    overrides = {k: v for k, v in vars(args).items() if k != "config" and v is not None}
+    if "case_level_rename" in overrides:
+        overrides["case_level_rename"] = _parse_kv_list(overrides["case_level_rename"])
+    cfg = replace(cfg, **overrides)
 
-    if not cfg.input and not args.input:
+    if not cfg.input:
         ap.error("Input Excel file is required (use --input or config input)")
-    if cfg.sheet is None and args.sheet is None:
-        cfg.sheet = 0
+    if cfg.sheet is None:
+        cfg = replace(cfg, sheet=0)
 
     # Default output if not set
     if not cfg.output:
-        cfg.output = "out.json"
+        cfg = replace(cfg, output="out.json")
+
+    if is_batch(cfg):
+        try:
+            tasks = expand_tasks(cfg)
+            if not tasks:
+                sys.stderr.write(f"ERROR: no workbooks match {cfg.input}\n")
+                sys.exit(2)
+            cases, collisions = convert_many(cfg, tasks)
+        except (OSError, ValueError, KeyError, RuntimeError) as e:
+            sys.stderr.write(f"ERROR: {e}\n")
+            sys.exit(2)
+        for cid, kept, dropped in collisions:
+            sys.stderr.write(f"COLLISION: case {cid!r} in {dropped} already came from {kept}; kept the first\n")
+        if collisions and cfg.on_collision == "error":
+            sys.stderr.write(f"ERROR: {len(collisions)} colliding case IDs, nothing written\n")
+            sys.exit(3)
+        if cfg.per_case:
+            written, unchanged = write_per_case(cases, cfg.output, cfg.compact)
+            print(f"Wrote {written} case JSON files to: {cfg.output}  ({unchanged} unchanged, collisions: {len(collisions)})")
+        elif cfg.stream:
+            n = write_stream(iter(cases.items()), cfg)
+            print(f"Wrote {cfg.stream_format.upper()}: {cfg.output}  (cases: {n}, collisions: {len(collisions)})")
+        else:
+            write_json(emit_output(cases, cfg), cfg.output, cfg.compact)
+            print(f"Wrote JSON: {cfg.output}  (cases: {len(cases)}, collisions: {len(collisions)})")
+        return
+
+    if cfg.stream:
+        try:
+            if cfg.per_case:
+                written, unchanged = write_per_case(iter_cases_stream(cfg), cfg.output, cfg.compact)
+            else:
+                n = write_stream(iter_cases_stream(cfg), cfg)
+        except ValueError as e:
+            sys.stderr.write(f"ERROR: {e}\n")
+            sys.exit(2)
+        if cfg.per_case:
+            print(f"Wrote {written} case JSON files to: {cfg.output}  (streamed, {unchanged} unchanged)")
+        else:
+            print(f"Wrote {cfg.stream_format.upper()}: {cfg.output}  (streamed, cases: {n})")
+        return
 
     # Load Excel
     try:
-        df = pd.read_excel(cfg.input, sheet_name=cfg.sheet, dtype=object)
+        df = load_sheet(cfg.input, cfg.sheet, cfg.keep_na_strings)
     except Exception as e:
         sys.stderr.write(f"ERROR reading Excel: {e}\n")
         sys.exit(2)
 
-    # If multiple sheets returned (dict), pick the first one unless sheet specified
-    if isinstance(df, dict):
-        if isinstance(cfg.sheet, (int, str)):
-            df = df[cfg.sheet]
-        else:
-            # pick first
-            first_key = list(df.keys())[0]
-            df = df[first_key]
-
-    df = normalize_dataframe(df, cfg)
-
-    cases = build_cases(df, cfg)
+    cases = convert_frame(df, cfg)
 
     if cfg.per_case:
-        write_per_case(cases, cfg.output)
-        print(f"Wrote {len(cases)} case JSON files to: {cfg.output}")
+        written, unchanged = write_per_case(cases, cfg.output, cfg.compact)
+        print(f"Wrote {written} case JSON files to: {cfg.output}  ({unchanged} unchanged)")
     else:
         obj = emit_output(cases, cfg)
-        write_json(obj, cfg.output)
+        write_json(obj, cfg.output, cfg.compact)
         print(f"Wrote JSON: {cfg.output}  (cases: {len(cases)})")
 
 if __name__ == "__main__":
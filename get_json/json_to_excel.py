@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+json_to_excel.py
+
+Bulk export of generated plans (PLAN_SCHEMA: case_name, case_desc, type, steps[order,
+action, tool, params, note]) into one review workbook, in the converter's column layout.
+- Inputs: plan .json files (a plan, a list of plans, a {name: plan} mapping or a record
+  with a "plan" key), .jsonl/.ndjson files and generation journal segments (.jsonl.gz),
+  directories (their .json/.jsonl files) and globs; read one file / line at a time
+- One row per step; Case名称 / Case描述 / 类型 are repeated on every row so sorting or
+  filtering in Excel never separates a step from its case
+- Written with openpyxl's write-only workbook, so memory stays flat for 100k+ rows
+- Column names come from the converter config (config.plan.yaml: the config.case.yaml
+  columns, params / NA-like text / whitespace kept as written); reading the sheet back with
+  the same config (--to-plans) gives the plans back
+- Steps are written in `order` order, the order the converter reads them back in
+- Plans without a case_name, or repeating one, get a distinct name (case IDs must be unique)
+
+Usage
+-----
+python json_to_excel.py ../plans/current_plan.json "batch/*.json" --output review.xlsx --check
+
+Re-import after review (PLAN_SCHEMA plans; .jsonl output writes one plan per line):
+python json_to_excel.py --to-plans review.xlsx --output plans.json
+
+Dependencies: openpyxl, pyyaml, pandas (--to-plans).
+"""
+from __future__ import annotations
+import argparse
+import glob
+import gzip
+import hashlib
+import json
+import math
+import os
+import sys
+import time
+from dataclasses import replace
+from typing import Any, Dict, Iterable, Iterator, List, Tuple
+
+from excel_to_json2 import (Config, _coerce_int, build_cases, iter_cases_stream, load_config, load_sheet,
+                            normalize_dataframe, openpyxl, write_json)
+
+if openpyxl is not None:
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.cell.cell import ERROR_CODES, ILLEGAL_CHARACTERS_RE
+
+DEFAULT_CONFIG = os.path.join(os.path.dirname(os.path.abspath(__file__)), "config.plan.yaml")
+SHEET_TITLE = "plans"
+# Case-level plan field -> output key used by the converter (case_level_rename)
+_CASE_FIELDS = ("case_desc", "type")
+_STEP_FIELDS = ("order", "action", "tool", "params", "note")
+
+
+def _columns(cfg: Config) -> Tuple[List[str], List[str], List[str]]:
+    """
+    Header row, plan case fields and plan step fields, column for column, from the converter config.
+    """
+    level = {cfg.case_level_rename.get(col, col): col for col in cfg.case_level_cols}
+    case_fields = [f for f in _CASE_FIELDS if f in level]
+    step_cols = [("order", cfg.step_col), ("action", cfg.action_col), ("tool", cfg.tool_col),
+                 ("params", cfg.params_col), ("note", cfg.notes_col)]
+    step_cols = [(f, c) for f, c in step_cols if c]
+    header = [cfg.case_id, *(level[f] for f in case_fields), *(c for _, c in step_cols)]
+    return header, case_fields, [f for f, _ in step_cols]
+
+
+def _input_files(paths: Iterable[str]) -> Iterator[str]:
+    for p in paths:
+        if os.path.isdir(p):
+            yield from sorted(f for f in glob.glob(os.path.join(p, "*"))
+                              if f.endswith((".json", ".jsonl", ".ndjson", ".jsonl.gz")))
+        elif any(ch in p for ch in "*?["):
+            yield from sorted(glob.glob(p))
+        else:
+            yield p
+
+
+def _as_plans(obj: Any) -> Iterator[Dict[str, Any]]:
+    if isinstance(obj, list):
+        for item in obj:
+            yield from _as_plans(item)
+    elif isinstance(obj, dict):
+        if isinstance(obj.get("steps"), list):
+            yield obj
+        elif "plan" in obj:
+            # Generation journal record / API response; failed generations have no plan
+            if isinstance(obj["plan"], dict):
+                yield obj["plan"]
+        else:
+            # {name: plan} mapping; the key stands in for a missing case_name
+            for name, plan in obj.items():
+                if isinstance(plan, dict) and isinstance(plan.get("steps"), list):
+                    yield plan if plan.get("case_name") else {**plan, "case_name": name}
+
+
+def iter_plans(paths: Iterable[str]) -> Iterator[Dict[str, Any]]:
+    """
+    Plans from files, directories and globs, in argument then file-name order.
+    JSON Lines files (optionally gzipped) are read line by line.
+    """
+    for path in _input_files(paths):
+        if path.endswith((".jsonl", ".ndjson", ".jsonl.gz")):
+            opener = gzip.open if path.endswith(".gz") else open
+            with opener(path, "rt", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        yield from _as_plans(json.loads(line))
+        else:
+            with open(path, "r", encoding="utf-8") as f:
+                yield from _as_plans(json.load(f))
+
+
+def _text(v: Any) -> Any:
+    if v is None:
+        return None
+    if isinstance(v, (int, float)) and not isinstance(v, bool):
+        return v
+    return ILLEGAL_CHARACTERS_RE.sub("", v if isinstance(v, str) else json.dumps(v, ensure_ascii=False))
+
+
+def _cell(ws, v: Any):
+    # Text starting with "=" or spelling an error code ("#N/A") stays text instead of becoming
+    # a formula / error cell
+    if isinstance(v, str) and (v.startswith("=") or v in ERROR_CODES):
+        c = WriteOnlyCell(ws, v)
+        c.data_type = "s"
+        return c
+    return v
+
+
+def _sorted_steps(plan: Dict[str, Any]) -> List[Dict[str, Any]]:
+    # Stable sort by order, unparsable orders last: the converter's step order on re-import
+    steps = [s for s in plan.get("steps") or [] if isinstance(s, dict)]
+    orders = [_coerce_int(s.get("order")) for s in steps]
+    return [steps[i] for i in sorted(range(len(steps)), key=lambda i: (orders[i] is None, orders[i] or 0))]
+
+
+def _digest(name: Any, plan: Dict[str, Any], case_fields: List[str], step_fields: List[str]) -> bytes:
+    """
+    Fingerprint of the fields the sheet carries, steps in written order; a missing text field
+    and "" count as the same.
+    """
+    def val(d: Dict[str, Any], f: str) -> Any:
+        v = d.get(f)
+        return "" if _missing(v) and f not in ("order", "type") else v
+
+    data = [name, [val(plan, f) for f in case_fields],
+            [[val(s, f) for f in step_fields] for s in _sorted_steps(plan)]]
+    return hashlib.sha256(json.dumps(data, ensure_ascii=False, sort_keys=True).encode("utf-8")).digest()
+
+
+def export_plans(plans: Iterable[Dict[str, Any]], output: str, cfg: Config,
+                 check: bool = False) -> Dict[str, Any]:
+    """
+    Write plans to a new workbook at ``output`` (temp file + rename). Returns a summary:
+    plans, rows, renamed ([original, written name]) and seconds; with check=True the sheet
+    is read back through the converter and plans that do not come back unchanged are listed.
+    """
+    if openpyxl is None:
+        raise RuntimeError("openpyxl is required. Install with: pip install openpyxl")
+    t0 = time.perf_counter()
+    header, case_fields, step_fields = _columns(cfg)
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet(SHEET_TITLE)
+    ws.append(header)
+    seen: set = set()
+    renamed: List[List[Any]] = []
+    digests: List[Tuple[Any, bytes]] = []
+    n_plans = n_rows = 0
+    for plan in plans:
+        n_plans += 1
+        original = plan.get("case_name")
+        name = _text(original) if original not in (None, "") else f"plan-{n_plans}"
+        if name in seen:
+            k = 2
+            while f"{name} ({k})" in seen:
+                k += 1
+            name = f"{name} ({k})"
+        if name != original:
+            renamed.append([original, name])
+        seen.add(name)
+        head = [name, *(_text(plan.get(f)) for f in case_fields)]
+        for s in _sorted_steps(plan):
+            ws.append([_cell(ws, v) for v in head + [_text(s.get(f)) for f in step_fields]])
+            n_rows += 1
+        if check:
+            digests.append((name, _digest(name, plan, case_fields, step_fields)))
+
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    tmp = f"{output}.tmp"
+    try:
+        wb.save(tmp)
+        os.replace(tmp, output)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    summary: Dict[str, Any] = {"output": output, "plans": n_plans, "rows": n_rows, "renamed": renamed,
+                               "seconds": round(time.perf_counter() - t0, 3)}
+    if check:
+        summary["mismatches"] = check_roundtrip(output, digests, cfg)
+    return summary
+
+
+def _missing(v: Any) -> bool:
+    return v is None or (isinstance(v, float) and math.isnan(v))
+
+
+def _text(v: Any) -> Any:
+    return "" if _missing(v) else v
+
+
+def plan_from_case(case: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    A converter case (raw_params config) back in PLAN_SCHEMA shape. Empty cells come back
+    from the converter as missing (None / NaN); the plan's text fields get "" instead.
+    """
+    plan: Dict[str, Any] = {"case_name": case.get("case_id"), "case_desc": _text(case.get("case_desc"))}
+    if not _missing(case.get("type")):
+        plan["type"] = case["type"]
+    plan["steps"] = [{"order": s.get("step"), "action": _text(s.get("action")), "tool": _text(s.get("tool")),
+                      "params": _text(s.get("params")), "note": _text(s.get("notes"))}
+                     for s in case.get("steps") or []]
+    return plan
+
+
+def check_roundtrip(path: str, expected: List[Tuple[Any, bytes]], cfg: Config) -> List[Any]:
+    """
+    Read the exported sheet back with the converter (streaming, in sheet order) and return
+    the names of plans that differ from what was written, plus any missing or extra ones.
+    """
+    _, case_fields, step_fields = _columns(cfg)
+    got = dict((cid, _digest(cid, plan_from_case(case), case_fields, step_fields))
+               for cid, case in iter_cases_stream(replace(cfg, input=path, sheet=SHEET_TITLE, raw_params=True)))
+    # Plans without steps write no rows, so they come back missing
+    mismatches = [name for name, digest in expected if got.pop(name, None) != digest]
+    return mismatches + list(got)
+
+
+def read_plans(path: str, cfg: Config, sheet: Any = SHEET_TITLE) -> List[Dict[str, Any]]:
+    """
+    Plans from a (reviewed) workbook, in the sheet order of each plan's first row. A plan's
+    rows need not stay together, so the sheet may have been sorted or filtered in Excel.
+    """
+    cfg = replace(cfg, input=path, sheet=sheet, raw_params=True)
+    df = normalize_dataframe(load_sheet(path, sheet, cfg.keep_na_strings), cfg)
+    cases = build_cases(df, cfg)
+    first: Dict[Any, int] = {}
+    for i, cid in enumerate(df[cfg.resolve(df.columns).case_id].tolist()):
+        first.setdefault(cid, i)
+    ordered = sorted(cases.items(), key=lambda kv: first.get(kv[0], len(first)))
+    return [plan_from_case(case) for _, case in ordered]
+
+
+def write_plans(plans: List[Dict[str, Any]], output: str) -> None:
+    if output.endswith((".jsonl", ".ndjson")):
+        os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+        with open(output, "w", encoding="utf-8") as f:
+            for plan in plans:
+                f.write(json.dumps(plan, ensure_ascii=False) + "\n")
+    else:
+        write_json(plans, output)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Export generated plans to an Excel review workbook")
+    ap.add_argument("inputs", nargs="+", help="Plan .json / .jsonl(.gz) files, directories or globs (--to-plans: workbooks)")
+    ap.add_argument("--output", type=str, required=True, help="Workbook to write (.xlsx); with --to-plans a .json or .jsonl file")
+    ap.add_argument("--config", type=str, default=DEFAULT_CONFIG, help="Converter config with the column names (default: config.plan.yaml)")
+    ap.add_argument("--check", action="store_true", help="Read the workbook back through the converter and compare")
+    ap.add_argument("--to-plans", action="store_true", help="Reverse: read review workbooks back into PLAN_SCHEMA plans")
+    ap.add_argument("--sheet", type=str, default=SHEET_TITLE, help=f"Sheet to read with --to-plans (default: {SHEET_TITLE})")
+    args = ap.parse_args()
+
+    cfg = load_config(args.config)
+    if args.to_plans:
+        sheet = int(args.sheet) if args.sheet.isdigit() else args.sheet
+        try:
+            plans = [p for path in _input_files(args.inputs) for p in read_plans(path, cfg, sheet)]
+            write_plans(plans, args.output)
+        except (OSError, ValueError, KeyError) as e:
+            sys.stderr.write(f"ERROR: {e}\n")
+            sys.exit(2)
+        print(f"Wrote {args.output}: {len(plans)} plans")
+        return
+    try:
+        summary = export_plans(iter_plans(args.inputs), args.output, cfg, check=args.check)
+    except (OSError, ValueError, RuntimeError) as e:
+        sys.stderr.write(f"ERROR: {e}\n")
+        sys.exit(2)
+    for original, name in summary["renamed"]:
+        sys.stderr.write(f"RENAMED: plan {original!r} written as {name!r}\n")
+    print(f"Wrote {summary['output']}: {summary['plans']} plans, {summary['rows']} rows in {summary['seconds']:.2f}s")
+    if args.check:
+        bad = summary["mismatches"]
+        if bad:
+            sys.stderr.write(f"ROUND-TRIP: {len(bad)} plans do not read back unchanged: "
+                             + ", ".join(map(str, bad[:10])) + "\n")
+            sys.exit(3)
+        print("Round-trip check passed")
+
+
+if __name__ == "__main__":
+    main()
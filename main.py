@@ -1,6 +1,44 @@
+import asyncio
+import logging
+from pathlib import Path
+from contextlib import asynccontextmanager
+
+from dotenv import load_dotenv
+
+# 仓库根目录的 .env（不覆盖已有环境变量）必须在导入 app.* 之前加载：各模块在导入时读取自己的环境变量
+# （日志、指标、剖析、管理令牌、LLM 连接池……）；导入 app.* 与 step 本身不读 .env
+load_dotenv(dotenv_path=Path(__file__).resolve().parent / ".env")
+
 from fastapi import FastAPI
+from app.log import setup_logging, RequestContextMiddleware
+from app.metrics import MetricsMiddleware
+from app.profiling import ProfilingMiddleware
+from app.llm_client import llm_clients, WARMUP
+from app import context_upload
+from app.journal import journal
 from app.routers.plan import router as plan_router
+import step
 
-app = FastAPI()
-app.include_router(plan_router, prefix="")
+setup_logging()
+logger = logging.getLogger(__name__)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 导入时不加载上下文、不建客户端（见 step.init）：在这里完成，首个请求不必承担
+    logger.info("启动初始化完成", extra={"timing_ms": await asyncio.to_thread(step.init)})
+    # 启动时预热 LLM 连接，避免部署后的首批请求承担 TLS 握手
+    if WARMUP:
+        await asyncio.to_thread(llm_clients.warm_up)
+    # 启动生成日志写线程：压缩已退出进程留下的未压缩段（空闲 worker 也会执行）
+    journal.start()
+    yield
+    llm_clients.close()
+    context_upload.shutdown()
+    journal.close()
 
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(ProfilingMiddleware)
+app.add_middleware(MetricsMiddleware)
+# 最后添加的中间件在最外层：先建立 request_id 上下文，再计时
+app.add_middleware(RequestContextMiddleware)
+app.include_router(plan_router, prefix="")
@@ -1,31 +1,83 @@
 import os 
 import json
 import time
+import logging
 import pathlib
+import threading
 from typing import Dict, Any, List
 
-from openai import OpenAI
-from jsonschema import validate, ValidationError
-from dotenv import load_dotenv
+from jsonschema import ValidationError
+
+from app.metrics import span, PLAN_REPAIRS
+from app.llm_client import llm_clients
+from app.llm_pool import llm_pool
+from app.retry import RetryPolicy, Deadline, BadOutputError, classify, describe, reprompt_messages, BAD_OUTPUT
+from app.repair import parse_plan
+from app.validation import PlanValidator, get_validator
+from app.autofix import ToolIndex, PlanFix, autofix_plan, get_tool_index
+from app.tool_registry import ToolRegistry, get_registry
+from app.speculative import SPECULATIVE, CandidateRound, failure_stats, run_candidates
+from app.plan_schema import PLAN_SCHEMA
+from app import context_store
+from app.context_store import ContextSnapshot
+
+
+logger = logging.getLogger(__name__)
+
+# 导入本模块不读文件、不建客户端：上下文在第一次使用时从 CTX_PATH 加载（见 app.context_store），
+# 客户端在第一次调用时创建（见 app.llm_client）；服务在 lifespan 中调用 init() 提前完成。.env 由 main.py 加载
+CTX_PATH = context_store.CONTEXT_PATH
+
+
+def load_context_json(path: pathlib.Path = CTX_PATH) -> str:
+    return context_store.load_text(path)
+
+
+_init_lock = threading.Lock()
+_init_ms: Dict[str, float] | None = None
+
+
+def init() -> Dict[str, float]:
+    """
+    加载当前上下文、预编译其校验器/工具索引并创建 LLM 客户端；幂等，返回各部分第一次执行的耗时（毫秒）。
+    """
+    global _init_ms
+    with _init_lock:
+        if _init_ms is None:
+            t0 = time.perf_counter()
+            ctx = context_store.latest()
+            t1 = time.perf_counter()
+            plan_validator(ctx)
+            tool_index(ctx)
+            t2 = time.perf_counter()
+            llm_clients.default()
+            t3 = time.perf_counter()
+            _init_ms = {"context": round((t1 - t0) * 1000, 1), "compile": round((t2 - t1) * 1000, 1),
+                        "clients": round((t3 - t2) * 1000, 1)}
+        return _init_ms
+
+
+def __getattr__(name: str) -> Any:
+    # 兼容旧的模块属性：client 为默认端点的客户端（生成调用走 app.llm_pool 选路），
+    # CONTEXT_JSON / CONTEXT_VERSION 为当前上下文版本；都在第一次访问时才创建/加载
+    if name == "client":
+        return llm_clients.default().client
+    if name == "CONTEXT_JSON":
+        return context_store.latest().text
+    if name == "CONTEXT_VERSION":
+        return context_store.latest().version
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
-env_path = pathlib.Path(__file__).parent / ".env"
-#print("加载路径:", env_path)
-load_dotenv(dotenv_path=env_path)
-
-#print("API_KEY=", os.getenv("OPENAI_API_KEY"))
-def load_context_json(path: pathlib.Path=pathlib.Path("./context.json")) -> str:
-    if not path.exists():
-        raise FileNotFoundError(f"未找到上下文文件：{path}")
-    return path.read_text(encoding="utf-8")
+# 是否自动修复 steps.order 连续性
+AUTO_FIX_ORDER = True
 
 
-client = OpenAI()  # 默认从环境变量读取 key / base_url
+# TESTAGENT_PROMPT_TOOL_SIGNATURES=1 时在上下文 JSON 之后附上工具注册表解析出的紧凑签名（默认关闭，提示词保持不变）；
+# 每次生成提示词时读取，运行中修改的值也会生效
+def _prompt_tool_signatures() -> bool:
+    return os.getenv("TESTAGENT_PROMPT_TOOL_SIGNATURES", "0") == "1"
 
-CTX_PATH = pathlib.Path("./context.json")
-CONTEXT_JSON = load_context_json(CTX_PATH)
-# 是否自动修复 steps.order 连续性
-AUTO_FIX_ORDER = True
 
 SYSTEM_PROMPT = """
 你是一名“测试执行规划器（Test Planner）”。你只能依据“上下文JSON”中的**事实**来规划步骤，
@@ -104,31 +156,56 @@ SYSTEM_PROMPT = """
 """.strip()
 # ===================== 新的 System Prompt 结束 =====================
 
-# JSON Schema：用于程序端严格校验（保持不变）
-PLAN_SCHEMA: Dict[str, Any] = {
-    "type": "object",
-    "properties": {
-        "case_name": {"type": "string"},
-        "case_desc": {"type": "string"},
-        "type": {"type": "integer", "enum": [1, 2]},
-        "steps": {
-            "type": "array",
-            "items": {
-                "type": "object",
-                "properties": {
-                    "order": {"type": "integer", "minimum": 1},
-                    "action": {"type": "string"},
-                    "tool": {"type": "string"},
-                    "params": {"type": "string"},
-                    "note": {"type": "string"}
-                },
-                "required": ["order", "action", "tool", "params", "note"]
-            },
-            "minItems": 1
-        }
-    },
-    "required": ["case_name", "case_desc", "steps"]
-}
+
+def plan_validator(ctx: ContextSnapshot | None = None) -> PlanValidator:
+    """
+    上下文版本（默认为本请求固定的版本）的预编译校验器（schema / order / 工具白名单 / 参数键，见 app.validation）。
+    """
+    ctx = ctx or context_store.current()
+    return get_validator(ctx.version, ctx.text, PLAN_SCHEMA)
+
+
+def tool_registry(ctx: ContextSnapshot | None = None) -> ToolRegistry:
+    """
+    上下文版本的结构化工具注册表（参数键、取值类型/示例、返回码、触发说法，见 app.tool_registry）。
+    """
+    ctx = ctx or context_store.current()
+    return get_registry(ctx.version, ctx.text)
+
+
+def context_prompt(context_json: str | None = None, ctx: ContextSnapshot | None = None) -> str:
+    """
+    提示词中的上下文部分（默认为本请求固定的版本）；开启 TESTAGENT_PROMPT_TOOL_SIGNATURES 且使用该版本时附上工具签名。
+    """
+    ctx = ctx or context_store.current()
+    context_json = ctx.text if context_json is None else context_json
+    text = "【上下文JSON】\n" + context_json
+    if _prompt_tool_signatures() and context_json == ctx.text:
+        text += "\n\n【工具签名】\n" + tool_registry(ctx).prompt_catalog()
+    return text
+
+
+def tool_index(ctx: ContextSnapshot | None = None) -> ToolIndex:
+    """
+    上下文版本的工具名模糊索引（供 autofix 映射白名单外的工具名）。
+    """
+    ctx = ctx or context_store.current()
+    return get_tool_index(ctx.version, ctx.text)
+
+
+def autofix(data: Dict[str, Any], model: str, repairs: List[str] | None = None,
+            ctx: ContextSnapshot | None = None) -> List[PlanFix]:
+    """
+    对解析出的计划做本地自动修复（工具名映射 / params / order，见 app.autofix），
+    生效的修复计入指标并追加到 repairs。
+    """
+    with span("autofix", model):
+        fixes = autofix_plan(data, tool_index(ctx), renumber=AUTO_FIX_ORDER)
+    for f in fixes:
+        PLAN_REPAIRS.inc(model=model, repair=f.code)
+        if repairs is not None:
+            repairs.append(f.describe())
+    return fixes
 
 
 def check_order_continuity(steps: List[Dict[str, Any]]) -> bool:
@@ -174,69 +251,182 @@ def extract_thinking_from_completion(resp) -> str | None:
         return m.group(1).strip() if m else None
     except Exception:
         return None
-def run_plan_chat(case_name: str,
-                  case_desc: str,
-                  context_json: str=CONTEXT_JSON,
-                  model: str = "qwen3-235b-a22b-thinking-2507",
-                  max_retries: int = 3) -> tuple[dict[str, Any], str]:
-    
-    print(f"🤖 调用LLM生成测试计划...")
-    print(f"   - 模型: {model}")
-    print(f"   - 端点: {client.base_url}")
-
-    user_context = "【上下文JSON】\n" + context_json
-    task = json.dumps({"case_name": case_name, "case_desc": case_desc}, ensure_ascii=False)
-
-    messages = [
-        {"role": "system", "content": SYSTEM_PROMPT},
-        {"role": "system", "content": "在不牺牲真实性的前提下，优先输出可迁移、可参数化、可复现的步骤。"},
-        {"role": "user", "content": user_context},
-        {"role": "user", "content": task}
-    ]
-
+def _usage_dict(resp) -> Dict[str, Any]:
+    usage = getattr(resp, "usage", None)
+    if usage is None:
+        return {}
+    details = getattr(usage, "completion_tokens_details", None)
+    return {
+        "prompt_tokens": getattr(usage, "prompt_tokens", None),
+        "completion_tokens": getattr(usage, "completion_tokens", None),
+        "reasoning_tokens": getattr(details, "reasoning_tokens", None) if details is not None else None,
+    }
+
+def _parse_plan_output(txt: str | None, model: str, repairs: List[str] | None = None) -> Dict[str, Any]:
+    """
+    解析 + 校验模型输出的计划 JSON；不合格时抛出异常。
+    解析先经 app.repair 容错修复（代码块、<think>、多余逗号、params 类型等），再经 app.autofix 本地修复
+    （工具名映射、order 重新编号），生效的修复追加到 repairs。
+    """
+    if not txt:
+        raise BadOutputError("模型输出为空")
+    with span("parse", model):
+        data, fired = parse_plan(txt)
+    for name in fired:
+        PLAN_REPAIRS.inc(model=model, repair=name)
+    if repairs is not None:
+        repairs.extend(fired)
+    autofix(data, model, repairs)
+    with span("validate", model):
+        plan_validator().check_schema(data)
+
+    if not check_order_continuity(data["steps"]):
+        raise ValidationError(
+            f"order 不连续: {[s['order'] for s in data['steps']]}")
+    return data
+
+def _plan_completion_with_retries(messages: List[Dict[str, str]],
+                                  model: str,
+                                  max_retries: int,
+                                  trace: Dict[str, Any] | None = None) -> tuple[dict[str, Any], str]:
+    """
+    run_plan_chat / edit_plan_chat 共用的调用 + 解析 + 校验 + 重试循环（重试策略见 app.retry）。
+    输出不合格时带上错误信息重新提示；所有尝试共享一个截止时间。
+    trace 不为 None 时记录模型、端点、每次尝试的耗时/错误/原始输出与累计 token 用量（供生成日志使用）。
+    """
+    if trace is not None:
+        trace.update({"model": model, "endpoint": None, "attempts": [], "usage": {}})
+    if SPECULATIVE:
+        return _plan_completion_speculative(messages, model, max_retries, trace)
+
+    policy = RetryPolicy(max_attempts=max_retries)
+    deadline = Deadline()
+    attempt_messages = messages
     last_err: Exception | None = None
     for attempt in range(1, max_retries + 1):
+        started = time.perf_counter()
+        txt = None
+        endpoint = None
+        repairs: List[str] = []
         try:
-            resp = client.chat.completions.create(
+            deadline.check()
+            resp, endpoint = llm_pool.create(
                 model=model,
-                messages=messages,
+                messages=attempt_messages,
                 #response_format={"type": "json_object"},
                 temperature=0,   # ★略升温以提升泛化
                 #top_p=0.9          # ★配合采样，仍受系统约束
+                timeout=deadline.timeout(stream=False),
             )
+            usage = _usage_dict(resp)
+            if trace is not None:
+                trace["endpoint"] = endpoint.base_url
+                for k, v in usage.items():
+                    if v is not None:
+                        trace["usage"][k] = trace["usage"].get(k, 0) + v
             txt = resp.choices[0].message.content  
-            data = json.loads(txt)
+            data = _parse_plan_output(txt, model, repairs)
             thinking_content = extract_thinking_from_completion(resp)
             #print(f"模型输出：{json.dumps(data, ensure_ascii=False, indent=2)}")
             #print(f"模型思考：{thinking_content}")
-            validate(instance=data, schema=PLAN_SCHEMA)
-
-            if not check_order_continuity(data["steps"]):
-                if AUTO_FIX_ORDER:
-                    data["steps"].sort(
-                        key=lambda s: (s.get("order")
-                                       if isinstance(s.get("order"), int)
-                                       else 10**9)
-                    )
-                    fix_orders_inplace(data["steps"])
-                else:
-                    raise ValidationError(
-                        f"order 不连续: {[s['order'] for s in data['steps']]}")
+            if trace is not None:
+                trace["attempts"].append({"attempt": attempt, "endpoint": endpoint.name,
+                                          "duration_ms": round((time.perf_counter() - started) * 1000, 1),
+                                          **({"repairs": repairs} if repairs else {})})
             return data,thinking_content
 
         except Exception as e:
             last_err = e
-            print(f"❌ 第 {attempt}/{max_retries} 次失败：{e}")
-            time.sleep(1)
+            kind = classify(e)
+            if trace is not None:
+                trace["attempts"].append({"attempt": attempt, "endpoint": endpoint.name if endpoint else None,
+                                          "duration_ms": round((time.perf_counter() - started) * 1000, 1),
+                                          **describe(e), "output": txt,
+                                          **({"repairs": repairs} if repairs else {})})
+            logger.warning("第 %d/%d 次失败（%s）：%s", attempt, max_retries, kind, e,
+                           extra={"model": model, "attempt": attempt})
+            delay = policy.next_delay(attempt, kind, e, deadline)
+            if delay is None:
+                break
+            if kind == BAD_OUTPUT:
+                attempt_messages = reprompt_messages(messages, txt, e)
+            time.sleep(delay)
 
     raise RuntimeError(f"重试后仍失败：{last_err}")
+
+def _plan_completion_speculative(messages: List[Dict[str, str]],
+                                 model: str,
+                                 max_retries: int,
+                                 trace: Dict[str, Any] | None = None) -> tuple[dict[str, Any], str]:
+    """
+    推测模式（TESTAGENT_SPECULATIVE=1）：每轮并发生成 N 个候选，取第一个通过校验且工具均在清单内的，
+    其余候选立即关闭；整轮都不合格时才按重试策略进入下一轮。
+    """
+    policy = RetryPolicy(max_attempts=max_retries)
+    deadline = Deadline()
+    attempt_messages = messages
+    last_err: BaseException | None = None
+    for attempt in range(1, max_retries + 1):
+        n = failure_stats.candidates(model)
+        try:
+            deadline.check()
+            rnd = run_candidates(attempt_messages, model, n, lambda txt, repairs: _parse_plan_output(txt, model, repairs),
+                                 plan_validator().tools_known, deadline)
+        except Exception as e:
+            rnd = CandidateRound(error=e)
+        if trace is not None:
+            trace["attempts"].extend({"attempt": attempt, **a} for a in rnd.attempts)
+            for k, v in rnd.usage.items():
+                trace["usage"][k] = trace["usage"].get(k, 0) + v
+        if rnd.plan is not None:
+            if trace is not None:
+                trace["endpoint"] = rnd.endpoint
+            return rnd.plan, rnd.thinking
+
+        last_err = rnd.error
+        kind = classify(last_err)
+        logger.warning("第 %d/%d 轮 %d 个候选均失败（%s）：%s", attempt, max_retries, n, kind, last_err,
+                       extra={"model": model, "attempt": attempt})
+        delay = policy.next_delay(attempt, kind, last_err, deadline)
+        if delay is None:
+            break
+        if kind == BAD_OUTPUT:
+            attempt_messages = reprompt_messages(messages, rnd.bad_output, last_err)
+        time.sleep(delay)
+
+    raise RuntimeError(f"重试后仍失败：{last_err}")
+def run_plan_chat(case_name: str,
+                  case_desc: str,
+                  context_json: str | None = None,
+                  model: str = "qwen3-235b-a22b-thinking-2507",
+                  max_retries: int = 3,
+                  trace: Dict[str, Any] | None = None) -> tuple[dict[str, Any], str]:
+    
+    logger.info("调用LLM生成测试计划", extra={"model": model})
+
+    # 本次生成固定使用此刻的上下文版本：提示词、校验、工具映射一致，中途替换上下文不影响本次生成
+    ctx = context_store.current()
+    with span("prompt.build", model):
+        user_context = context_prompt(context_json, ctx)
+        task = json.dumps({"case_name": case_name, "case_desc": case_desc}, ensure_ascii=False)
+
+        messages = [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "system", "content": "在不牺牲真实性的前提下，优先输出可迁移、可参数化、可复现的步骤。"},
+            {"role": "user", "content": user_context},
+            {"role": "user", "content": task}
+        ]
+
+    with context_store.pinned(ctx):
+        return _plan_completion_with_retries(messages, model=model, max_retries=max_retries, trace=trace)
 def edit_plan_chat(case_name: str,
                    case_desc: str,
                    user_request: str,
                    current_plan: Dict[str, Any],
-                   context_json: str=CONTEXT_JSON,
+                   context_json: str | None = None,
                    model: str = "qwen3-235b-a22b-thinking-2507",
-                   max_retries: int = 3) -> tuple[dict[str, Any], str]:
+                   max_retries: int = 3,
+                   trace: Dict[str, Any] | None = None) -> tuple[dict[str, Any], str]:
     EDIT_SYSTEM_PROMPT = """
 你是一名“测试计划修改器（Test Planner, Editor）”。
 你的输入将包含三个部分：
@@ -309,67 +499,38 @@ def edit_plan_chat(case_name: str,
 仅输出符合上述结构与规则的 JSON。
 """.strip()
         
-    print(f"🤖 调用LLM修改测试计划...")
-    print(f"   - 模型: {model}")
-    print(f"   - 端点: {client.base_url}")
-
-    user_context = "【上下文JSON】\n" + context_json
-    #task = json.dumps({"cmd": case_name, "cmd_desc": case_desc}, ensure_ascii=False)
-
-    messages = [
-        {"role": "system", "content": EDIT_SYSTEM_PROMPT},
-        {"role": "system", "content": "【当前计划为】\n"+ json.dumps(current_plan, ensure_ascii=False, indent=2)},
-        {"role": "user", "content": user_context},
-        {"role": "user", "content": "【修改需求】\n"+ user_request}
-    ]
-
-    last_err: Exception | None = None
-    for attempt in range(1, max_retries + 1):
-        try:
-            resp = client.chat.completions.create(
-                model=model,
-                messages=messages,
-                #response_format={"type": "json_object"},
-                temperature=0,   # ★略升温以提升泛化
-                #top_p=0.9          # ★配合采样，仍受系统约束
-            )
-            txt = resp.choices[0].message.content  
-            data = json.loads(txt)
-            thinking_content = extract_thinking_from_completion(resp)
-            #print(f"模型输出：{json.dumps(data, ensure_ascii=False, indent=2)}")
-            #print(f"模型思考：{thinking_content}")
-            validate(instance=data, schema=PLAN_SCHEMA)
-
-            if not check_order_continuity(data["steps"]):
-                if AUTO_FIX_ORDER:
-                    data["steps"].sort(
-                        key=lambda s: (s.get("order")
-                                       if isinstance(s.get("order"), int)
-                                       else 10**9)
-                    )
-                    fix_orders_inplace(data["steps"])
-                else:
-                    raise ValidationError(
-                        f"order 不连续: {[s['order'] for s in data['steps']]}")
-            return data,thinking_content
-
-        except Exception as e:
-            last_err = e
-            print(f"❌ 第 {attempt}/{max_retries} 次失败：{e}")
-            time.sleep(1)
-
-    raise RuntimeError(f"重试后仍失败：{last_err}")
+    logger.info("调用LLM修改测试计划", extra={"model": model})
+
+    # 本次生成固定使用此刻的上下文版本：提示词、校验、工具映射一致，中途替换上下文不影响本次生成
+    ctx = context_store.current()
+    with span("prompt.build", model):
+        user_context = context_prompt(context_json, ctx)
+        #task = json.dumps({"cmd": case_name, "cmd_desc": case_desc}, ensure_ascii=False)
+
+        messages = [
+            {"role": "system", "content": EDIT_SYSTEM_PROMPT},
+            {"role": "system", "content": "【当前计划为】\n"+ json.dumps(current_plan, ensure_ascii=False, indent=2)},
+            {"role": "user", "content": user_context},
+            {"role": "user", "content": "【修改需求】\n"+ user_request}
+        ]
+
+    with context_store.pinned(ctx):
+        return _plan_completion_with_retries(messages, model=model, max_retries=max_retries, trace=trace)
 def save_plan_to_json(plan: Dict[str, Any], path: pathlib.Path) -> None:
     path.write_text(json.dumps(plan, ensure_ascii=False, indent=2), encoding="utf-8")
 
 if __name__ == "__main__":
+    # 直接运行时自行加载 .env（端点与密钥在第一次调用时才读取）
+    from dotenv import load_dotenv
+    load_dotenv(dotenv_path=pathlib.Path(__file__).resolve().parent / ".env")
+    from app.log import setup_logging
+    setup_logging()
     #context_json_str = load_context_json(CTX_PATH)
     case_name = ""
     case_desc = """先把机器重启，然后跑Burnin测试30分钟，做1次S4，再跑burnin 30分钟"""
     plan,thinking = run_plan_chat(
         case_name=case_name,
         case_desc=case_desc,
-        context_json=CONTEXT_JSON,
         model="qwen3-235b-a22b-thinking-2507",
         max_retries=3
     )
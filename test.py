@@ -23,7 +23,8 @@ def test_run_case():
         "user_input":""
     }
     #先把机器重启，然后跑Burnin测试30分钟，做1次S4，再跑burnin 30分钟
-    resp = requests.post(url, headers=headers, json=payload)
+    # inline_thinking：旧版响应格式，直接内联完整 thinking
+    resp = requests.post(url, headers=headers, json=payload, params={"inline_thinking": "true"})
     print("POST /plan status:", resp.status_code)
     data = safe_json(resp)
     if not resp.ok:
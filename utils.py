@@ -6,11 +6,19 @@ import pathlib
 from copy import deepcopy
 from typing import Dict, Any, List, Optional, Tuple
 
-from openai import OpenAI
 from jsonschema import validate, ValidationError
-from step import run_plan_chat,save_plan_to_json, load_context_json, CTX_PATH, PLAN_SCHEMA
+from app.plan_schema import PLAN_SCHEMA
+from app.repair import salvage_json
+from app.validation import as_tuple
 # ----------- 通用工具 -----------
 def validate_plan(plan: Dict[str, Any],plan_schema:Dict[str,Any]=PLAN_SCHEMA) -> Tuple[bool, Optional[str]]:
+    """
+    默认 schema 走预编译的语义校验器（含工具白名单等，见 app.validation）；自定义 schema 时仅做 schema 校验。
+    """
+    if plan_schema is PLAN_SCHEMA:
+        # step 在用到时才导入：只用到 JSON 工具函数的脚本不必加载上下文与 LLM 客户端
+        from step import plan_validator
+        return as_tuple(plan_validator().validate(plan))
     try:
         validate(instance=plan, schema=plan_schema)
         return True, None
@@ -25,18 +33,13 @@ def json_pretty(obj: Any) -> str:
 
 def extract_first_json_blob(text: str) -> Optional[Dict[str, Any]]:
     """
-    从模型回复中提取第一段 {...} JSON。
+    从模型回复中提取第一段 {...} JSON（容错修复见 app.repair.salvage_json）。
     """
     try:
-        # 粗暴但实用：匹配最外层花括号
-        start = text.find("{")
-        end = text.rfind("}")
-        if start >= 0 and end > start:
-            blob = text[start:end+1]
-            return json.loads(blob)
+        data, _ = salvage_json(text)
+        return data if isinstance(data, dict) else None
     except Exception:
-        pass
-    return None
+        return None
 
 def check_json_format(target_text:Dict[str,Any],format:Dict[str,Any]) -> bool:
     """